@@ -6,3 +6,6 @@ admin.site.register(Message)
 admin.site.register(Example)
 admin.site.register(Atomspace)
 admin.site.register(Schema)
+admin.site.register(AtomspaceUpload)
+admin.site.register(QueryTranslation)
+admin.site.register(MessageJob)
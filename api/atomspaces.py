@@ -0,0 +1,90 @@
+import os, threading
+from collections import OrderedDict
+
+# MeTTa runners kept per process, each one holds a partition (the files a query needs) in its space
+MAX_CACHED_PARTITIONS = 8
+
+# Parsed MeTTa files, loaded once per process: {absolute path: (file signature, atoms)}
+_metta_files = {}
+# MeTTa runners with a partition loaded in their space, least recently used first: {frozenset of paths: (runner, runner lock)}
+_metta_runners = OrderedDict()
+_metta_files_lock = threading.RLock()
+
+def get_file_signature(metta_file_path):
+    stat = os.stat(metta_file_path)
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+def parse_metta_file(metta_file_path):
+    from hyperon import MeTTa
+
+    with open(metta_file_path) as metta_file:
+        return MeTTa().parse_all(metta_file.read())
+
+def load_metta_file(metta_file_path):
+    metta_file_path = os.path.abspath(metta_file_path)
+    file_signature = get_file_signature(metta_file_path)
+
+    with _metta_files_lock:
+        cached_file = _metta_files.get(metta_file_path)
+        if cached_file and cached_file[0] == file_signature:
+            return cached_file[1]
+
+        # The file was replaced by another worker, whose signal handlers don't reach this process
+        if cached_file:
+            _drop_metta_file(metta_file_path)
+
+        atoms = parse_metta_file(metta_file_path)
+        _metta_files[metta_file_path] = (file_signature, atoms)
+        return atoms
+
+def get_metta_runner(metta_file_paths):
+    from hyperon import MeTTa
+
+    runner_key = frozenset(os.path.abspath(path) for path in metta_file_paths)
+    loaded_files = [load_metta_file(path) for path in runner_key]
+
+    with _metta_files_lock:
+        cached_runner = _metta_runners.get(runner_key)
+        if cached_runner is None:
+            metta = MeTTa()
+            for atoms in loaded_files:
+                for atom in atoms:
+                    metta.space().add_atom(atom)
+            cached_runner = (metta, threading.Lock())
+            _metta_runners[runner_key] = cached_runner
+            while len(_metta_runners) > MAX_CACHED_PARTITIONS:
+                _metta_runners.popitem(last=False)
+            _drop_unused_metta_files()
+        _metta_runners.move_to_end(runner_key)
+
+    return cached_runner
+
+# Run a MeTTa query against the (cached) space of the given files, e.g. only the partition of the entities it references
+def run_metta_query(metta_query, metta_file_paths):
+    metta, runner_lock = get_metta_runner(metta_file_paths)
+    # A MeTTa runner can't be shared between threads
+    with runner_lock:
+        results = metta.run(metta_query)
+
+    return [[str(atom) for atom in result] for result in results]
+
+# Load the files (as one partition) ahead of the first query
+def warm_metta_files(metta_file_paths):
+    if metta_file_paths:
+        get_metta_runner(metta_file_paths)
+
+# Called when a MeTTa file is replaced or deleted
+def invalidate_metta_file(metta_file_path):
+    with _metta_files_lock:
+        _drop_metta_file(os.path.abspath(metta_file_path))
+
+def _drop_metta_file(metta_file_path):
+    _metta_files.pop(metta_file_path, None)
+    for runner_key in [key for key in _metta_runners if metta_file_path in key]:
+        del _metta_runners[runner_key]
+
+# Keep only the parsed files of the cached partitions, so the memory follows the working set
+def _drop_unused_metta_files():
+    used_file_paths = set().union(*_metta_runners.keys())
+    for metta_file_path in [path for path in _metta_files if path not in used_file_paths]:
+        del _metta_files[metta_file_path]
@@ -0,0 +1,160 @@
+import os, json, shutil, tarfile, zipfile, tempfile, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from django.db import transaction
+from .models import Atomspace
+from .metta_parser import get_metta_file_report
+from .metta_storage import store_metta_file, release_metta_files, metta_storage_lock
+from .caches import clear_answer_cache
+from .utils import update_schema_mappings, reset_prompt_engines
+
+IMPORTS_DIR = 'api/bio_data/imports'
+MANIFEST_FILE_NAME = 'manifest.json'
+METTA_FILE_FIELDS = ('node_metta_file', 'edge_metta_file')
+
+class BulkImportError(Exception):
+    def __init__(self, message, report=None):
+        super().__init__(message)
+        self.report = report
+
+def extract_archive(archive_path, target_dir):
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            archive.extractall(target_dir)
+    elif tarfile.is_tarfile(archive_path):
+        with tarfile.open(archive_path) as archive:
+            archive.extractall(target_dir, filter='data')
+    else:
+        raise BulkImportError('Unsupported archive, use a .zip or .tar(.gz) file.')
+
+# The manifest lists the atomspaces to import:
+# {"atomspaces": [{"db_name": "...", "nodes": ["gene"], "edges": ["transcribed to"],
+#                  "node_metta_file": "gene.metta", "edge_metta_file": "transcribed_to.metta"}]}
+# with the file paths relative to the manifest
+def read_manifest(source_dir):
+    manifest_path = os.path.join(source_dir, MANIFEST_FILE_NAME)
+    if not os.path.isfile(manifest_path):
+        raise BulkImportError(f'{MANIFEST_FILE_NAME} is missing.')
+
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as manifest_file:
+            manifest = json.load(manifest_file)
+    except ValueError as e: # Invalid JSON or UTF-8
+        raise BulkImportError(f'{MANIFEST_FILE_NAME} is not valid JSON: {e}')
+    entries = manifest.get('atomspaces', []) if isinstance(manifest, dict) else manifest
+    if not isinstance(entries, list) or not all(isinstance(entry, dict) for entry in entries):
+        raise BulkImportError(f'{MANIFEST_FILE_NAME} has to list the atomspaces as JSON objects.')
+
+    source_dir = os.path.realpath(source_dir)
+    db_names = set()
+    for entry in entries:
+        if not entry.get('db_name', None) or not isinstance(entry['db_name'], str):
+            raise BulkImportError('Every atomspace in the manifest needs a db_name.')
+        for entity_field in ('nodes', 'edges'):
+            entity_names = entry.get(entity_field, [])
+            if not isinstance(entity_names, list) or not all(isinstance(entity_name, str) for entity_name in entity_names):
+                raise BulkImportError(f"The {entity_field} of '{entry['db_name']}' have to be a list of names.")
+        for metta_file_field in METTA_FILE_FIELDS:
+            if entry.get(metta_file_field, None) is not None and not isinstance(entry[metta_file_field], str):
+                raise BulkImportError(f"The {metta_file_field} of '{entry['db_name']}' has to be a file path.")
+        if entry['db_name'] in db_names:
+            raise BulkImportError(f"'{entry['db_name']}' is listed more than once.")
+        db_names.add(entry['db_name'])
+
+        for metta_file_field in METTA_FILE_FIELDS:
+            if not entry.get(metta_file_field, None):
+                continue
+            metta_file_path = os.path.realpath(os.path.join(source_dir, entry[metta_file_field]))
+            if os.path.commonpath([source_dir, metta_file_path]) != source_dir or not os.path.isfile(metta_file_path):
+                raise BulkImportError(f"{entry[metta_file_field]} ('{entry['db_name']}') was not found.")
+            entry[metta_file_field] = metta_file_path
+
+    return entries
+
+# Validate every MeTTa file in parallel, then swap all the Atomspace records in a single transaction.
+# Nothing is changed if any file is invalid
+def import_atomspaces(source_path, max_workers=None):
+    os.makedirs(IMPORTS_DIR, exist_ok=True)
+    staging_dir = tempfile.mkdtemp(dir=IMPORTS_DIR)
+    try:
+        is_archive = not os.path.isdir(source_path)
+        if is_archive:
+            extract_archive(source_path, staging_dir)
+            source_path = staging_dir
+        entries = read_manifest(source_path)
+
+        metta_file_paths = sorted({entry[field] for entry in entries for field in METTA_FILE_FIELDS if entry.get(field, None)})
+        # Spawned, a forked copy of a threaded web worker isn't safe (like the MeTTa pool's workers)
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            file_reports = list(pool.map(get_metta_file_report, metta_file_paths))
+
+        # Hashed while validating, the files are stored under their content hash
+        content_hashes = {file_report['file']: file_report['content_hash'] for file_report in file_reports}
+        for file_report in file_reports:
+            file_report['file'] = os.path.relpath(file_report['file'], source_path)
+        if any(file_report['errors'] for file_report in file_reports):
+            raise BulkImportError('Invalid MeTTa files, nothing was imported.', report=file_reports)
+
+        # Extracted files are moved into place, files of a directory are copied
+        is_changed = swap_atomspaces(entries, content_hashes, move_files=is_archive)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    # Re-importing the same files & entities changes nothing, the loaded atomspaces and caches are kept
+    if is_changed:
+        update_schema_mappings()
+        reset_prompt_engines()
+        clear_answer_cache()
+
+    return {
+        'atomspaces': [entry['db_name'] for entry in entries],
+        'files': file_reports
+    }
+
+# Returns whether any Atomspace record changed
+def swap_atomspaces(entries, content_hashes, move_files=False):
+    # {source file path: stored file name}, a file can be listed by several atomspaces
+    stored_file_names = {}
+    # Files that weren't stored before, removed again if the swap fails
+    new_file_names = set()
+    replaced_file_names = set()
+    is_changed = False
+    # Locked until the records are committed, a concurrent release can't delete a stored file before
+    with metta_storage_lock():
+        try:
+            for entry in entries:
+                for metta_file_field in METTA_FILE_FIELDS:
+                    metta_file_path = entry.get(metta_file_field, None)
+                    if not metta_file_path:
+                        continue
+                    if metta_file_path not in stored_file_names:
+                        metta_file_name, is_new_file = store_metta_file(metta_file_path, content_hashes[metta_file_path], move=move_files)
+                        stored_file_names[metta_file_path] = metta_file_name
+                        if is_new_file:
+                            new_file_names.add(metta_file_name)
+                    entry[metta_file_field] = stored_file_names[metta_file_path]
+
+            with transaction.atomic():
+                for entry in entries:
+                    atomspace_fields = {
+                        'nodes': str(entry.get('nodes', [])),
+                        'edges': str(entry.get('edges', [])),
+                        **{field: entry.get(field, None) for field in METTA_FILE_FIELDS}
+                    }
+                    atomspace = Atomspace.objects.select_for_update().filter(db_name=entry['db_name']).first()
+                    if atomspace is None:
+                        Atomspace.objects.create(db_name=entry['db_name'], **atomspace_fields)
+                        is_changed = True
+                        continue
+                    if all(getattr(atomspace, field) == value for field, value in atomspace_fields.items()):
+                        continue
+
+                    # update() skips the signals, the replaced files are released once the swap is committed
+                    replaced_file_names.update(getattr(atomspace, field).name for field in METTA_FILE_FIELDS if getattr(atomspace, field))
+                    Atomspace.objects.filter(pk=atomspace.pk).update(**atomspace_fields)
+                    is_changed = True
+        except BaseException:
+            release_metta_files(new_file_names, Atomspace)
+            raise
+
+    release_metta_files(replaced_file_names - set(stored_file_names.values()), Atomspace)
+    return is_changed
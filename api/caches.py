@@ -0,0 +1,77 @@
+import re, json, hashlib
+from django.core.cache import caches
+from django.db import IntegrityError
+from django.db.models import F
+from .models import QueryTranslation
+
+# Cache alias (see CACHES in settings), local memory by default or a shared store between workers
+ANSWER_CACHE = 'answers'
+
+# Questions that only differ in case, spacing or the trailing punctuation share their answer
+def normalize_question(question):
+    return re.sub(r'[\s?.!]+$', '', ' '.join(question.lower().split()))
+
+# The answer depends on the earlier messages of the chat (llm_context) too, so a follow-up question
+# is only shared between chats with the same context
+def get_question_key(prefix, question, data_version, llm_context=''):
+    context_hash = hashlib.sha256(llm_context.encode()).hexdigest()
+    question_hash = hashlib.sha256(f'{data_version}\n{context_hash}\n{normalize_question(question)}'.encode()).hexdigest()
+    return f'{prefix}:{question_hash}'
+
+def get_cached_answer(question, data_version, llm_context=''):
+    return caches[ANSWER_CACHE].get(get_question_key('answer', question, data_version, llm_context))
+
+def cache_answer(question, data_version, metta_response, llm_context=''):
+    # Only keep what can be stored by any cache backend
+    cached_response = json.loads(json.dumps({
+        'metta_query': metta_response.get('metta_query', None),
+        'metta_response': metta_response.get('metta_response', None),
+        'llm_response': metta_response['llm_response']
+    }, default=str))
+    caches[ANSWER_CACHE].set(get_question_key('answer', question, data_version, llm_context), cached_response)
+
+# Answers are keyed by the data version, so old ones can't be hit anymore, this only frees the space early
+def clear_answer_cache():
+    caches[ANSWER_CACHE].clear()
+
+def get_cached_translation(question, schema_version):
+    translation = QueryTranslation.objects.filter(
+        question=normalize_question(question),
+        schema_version=schema_version
+    ).first()
+    if translation is None:
+        return None
+
+    QueryTranslation.objects.filter(pk=translation.pk).update(hit_count=F('hit_count') + 1)
+    return translation.metta_query
+
+def cache_translation(question, schema_version, metta_query):
+    try:
+        QueryTranslation.objects.update_or_create(
+            question=normalize_question(question)[:QueryTranslation._meta.get_field('question').max_length],
+            schema_version=schema_version,
+            defaults={'metta_query': metta_query}
+        )
+    except IntegrityError: # Cached by a concurrent request
+        pass
+
+# Translations moved per batch (stays under SQLite's limit of query parameters)
+CARRY_OVER_BATCH_SIZE = 500
+
+# Move the translations of the old schema version to the new one, except those is_affected(metta_query) rejects
+# (and the questions already translated with the new schema). Returns the number of translations kept
+def carry_over_translations(old_schema_version, new_schema_version, is_affected):
+    translated_questions = set(
+        QueryTranslation.objects.filter(schema_version=new_schema_version).values_list('question', flat=True)
+    )
+    kept_ids = [
+        translation_id for translation_id, question, metta_query in QueryTranslation.objects.filter(
+            schema_version=old_schema_version
+        ).values_list('pk', 'question', 'metta_query').iterator()
+        if question not in translated_questions and not is_affected(metta_query)
+    ]
+    for batch_start in range(0, len(kept_ids), CARRY_OVER_BATCH_SIZE):
+        QueryTranslation.objects.filter(
+            pk__in=kept_ids[batch_start:batch_start + CARRY_OVER_BATCH_SIZE]
+        ).update(schema_version=new_schema_version)
+    return len(kept_ids)
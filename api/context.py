@@ -0,0 +1,195 @@
+import threading
+from collections import OrderedDict, deque
+from django.conf import settings
+from django.db.models import F
+
+LLM_CONTEXT_HEADER = 'Use this interaction history between the "User" and the "Assistant" as additional context.\n\n ###\n'
+LLM_CONTEXT_FOOTER = '\n###\n\n'
+
+# Characters kept from each turn that is folded into the rolling summary
+SUMMARY_LINE_LENGTH = 150
+
+# Conversation contexts of the recently used chats, least recently used first
+_chat_contexts = OrderedDict()
+_chat_contexts_lock = threading.RLock()
+
+def get_context_settings():
+    return (
+        getattr(settings, 'LLM_CONTEXT_TOKEN_BUDGET', 2000),
+        getattr(settings, 'LLM_CONTEXT_SUMMARIES', False),
+        getattr(settings, 'LLM_CONTEXT_CACHED_CHATS', 1000)
+    )
+
+# Rough token count (~4 characters per token), enough to keep the prompt within the budget
+def count_tokens(text):
+    return len(text) // 4 + 1
+
+def get_speaker(is_user_message):
+    return 'User' if is_user_message else 'Assistant'
+
+def get_summary_line(speaker, message_text):
+    return f"{speaker}: {' '.join(message_text.split())[:SUMMARY_LINE_LENGTH]}"
+
+# The latest turns of a chat that fit in the token budget (+ optionally a summary of the older ones).
+# Kept up to date by the Message signals instead of being rebuilt for every question
+class ChatContext:
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        # {message id: (speaker, message text, token count)}, oldest first
+        self.turns = OrderedDict()
+        self.token_count = 0
+        self.summary_lines = deque()
+        self.summary_token_count = 0
+        # Chat.message_version when loaded (+ the changes made since by this process), compared with the
+        # database to pick up changes made by other worker processes
+        self.version = None
+        self.last_message_id = None
+
+    def load(self, message_model):
+        self.turns.clear()
+        self.summary_lines.clear()
+        self.token_count = self.summary_token_count = 0
+        self.version = get_chat_version(self.chat_id, message_model)
+        self.last_message_id = message_model.objects.filter(chat_id=self.chat_id) \
+            .order_by('-id').values_list('id', flat=True).first()
+
+        token_budget, with_summaries, _ = get_context_settings()
+        latest_messages = message_model.objects.filter(chat_id=self.chat_id) \
+            .order_by('-message_created_at', '-id') \
+            .values_list('id', 'is_user_message', 'message_text')
+
+        # Newest first, only until the budget (and the summary) is full
+        loaded_turns = []
+        loaded_token_count = 0
+        for message_id, is_user_message, message_text in latest_messages.iterator(chunk_size=100):
+            turn_token_count = count_tokens(message_text)
+            if not self.summary_lines and loaded_token_count + turn_token_count <= token_budget:
+                loaded_turns.append((message_id, (get_speaker(is_user_message), message_text, turn_token_count)))
+                loaded_token_count += turn_token_count
+                continue
+
+            # Everything older than the first turn that doesn't fit goes in the summary
+            if not with_summaries:
+                break
+            summary_line = get_summary_line(get_speaker(is_user_message), message_text)
+            if self.summary_token_count + count_tokens(summary_line) > token_budget:
+                break
+            self.summary_lines.appendleft(summary_line)
+            self.summary_token_count += count_tokens(summary_line)
+
+        for message_id, turn in reversed(loaded_turns):
+            self.turns[message_id] = turn
+        self.token_count = loaded_token_count
+
+    def add_message(self, message_id, is_user_message, message_text):
+        turn_token_count = count_tokens(message_text)
+        self.turns[message_id] = (get_speaker(is_user_message), message_text, turn_token_count)
+        self.token_count += turn_token_count
+        self.trim()
+
+    def update_message(self, message_id, is_user_message, message_text):
+        turn = self.turns.get(message_id)
+        if turn is None:
+            return
+        turn_token_count = count_tokens(message_text)
+        self.turns[message_id] = (get_speaker(is_user_message), message_text, turn_token_count)
+        self.token_count += turn_token_count - turn[2]
+        self.trim()
+
+    def remove_message(self, message_id):
+        turn = self.turns.pop(message_id, None)
+        if turn is not None:
+            self.token_count -= turn[2]
+
+    def trim(self):
+        token_budget, with_summaries, _ = get_context_settings()
+        while self.token_count > token_budget and self.turns:
+            _, (speaker, message_text, turn_token_count) = self.turns.popitem(last=False)
+            self.token_count -= turn_token_count
+            if with_summaries:
+                self.add_summary_line(speaker, message_text)
+
+    # Older turns are kept as a short line each, within the same token budget
+    def add_summary_line(self, speaker, message_text):
+        token_budget, _, _ = get_context_settings()
+        summary_line = get_summary_line(speaker, message_text)
+        self.summary_lines.append(summary_line)
+        self.summary_token_count += count_tokens(summary_line)
+
+        while self.summary_token_count > token_budget and self.summary_lines:
+            self.summary_token_count -= count_tokens(self.summary_lines.popleft())
+
+    def to_prompt(self, context_length=None):
+        turns = list(self.turns.values())
+        if context_length is not None:
+            turns = turns[-context_length:] if context_length > 0 else []
+
+        llm_context = LLM_CONTEXT_HEADER
+        if self.summary_lines:
+            llm_context += 'Summary of the earlier interaction:\n' + '\n'.join(self.summary_lines) + '\n\n'
+        for speaker, message_text, _ in turns:
+            llm_context += f"{speaker}: {message_text}\n"
+        llm_context += LLM_CONTEXT_FOOTER
+        return llm_context
+
+# One primary key lookup, the version is bumped on every change to the chat's messages (see bump_chat_version)
+def get_chat_version(chat_id, message_model):
+    chat_model = message_model._meta.get_field('chat_id').related_model
+    return chat_model.objects.filter(pk=chat_id).values_list('message_version', flat=True).first()
+
+def get_chat_context(chat_id, message_model):
+    with _chat_contexts_lock:
+        chat_context = _chat_contexts.get(chat_id)
+        if chat_context is None:
+            chat_context = ChatContext(chat_id)
+            _chat_contexts[chat_id] = chat_context
+            _, _, cached_chats = get_context_settings()
+            while len(_chat_contexts) > cached_chats:
+                _chat_contexts.popitem(last=False)
+        _chat_contexts.move_to_end(chat_id)
+
+        if chat_context.version is None or chat_context.version != get_chat_version(chat_id, message_model):
+            chat_context.load(message_model)
+        return chat_context
+
+# ---------------------------------- Called by the Message signals ----------------------------------
+
+# Called before the context is updated, for each message created, updated or deleted
+def bump_chat_version(chat_id, message_model, change_count=1):
+    chat_model = message_model._meta.get_field('chat_id').related_model
+    chat_model.objects.filter(pk=chat_id).update(message_version=F('message_version') + change_count)
+
+def add_context_message(message):
+    with _chat_contexts_lock:
+        chat_context = _chat_contexts.get(message.chat_id_id)
+        if chat_context is None or chat_context.version is None:
+            return
+
+        if chat_context.last_message_id is not None and message.id < chat_context.last_message_id:
+            # Not the latest message (e.g. imported history), rebuild on the next use
+            chat_context.version = None
+            return
+
+        chat_context.add_message(message.id, message.is_user_message, message.message_text)
+        chat_context.last_message_id = message.id
+        chat_context.version += 1
+
+def update_context_message(message):
+    with _chat_contexts_lock:
+        chat_context = _chat_contexts.get(message.chat_id_id)
+        if chat_context is None or chat_context.version is None:
+            return
+        chat_context.update_message(message.id, message.is_user_message, message.message_text)
+        chat_context.version += 1
+
+# Deletes are rare (and mostly whole chats), the context is rebuilt on its next use
+def remove_context_message(message):
+    with _chat_contexts_lock:
+        chat_context = _chat_contexts.get(message.chat_id_id)
+        if chat_context is not None:
+            chat_context.remove_message(message.id)
+            chat_context.version = None
+
+def drop_chat_context(chat_id):
+    with _chat_contexts_lock:
+        _chat_contexts.pop(chat_id, None)
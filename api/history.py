@@ -0,0 +1,155 @@
+import json
+from datetime import datetime
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+from .models import Chat, Message
+from .search import index_new_chats, index_new_messages
+
+# Chat history as NDJSON, one record per line: each chat followed by its messages (oldest first)
+#   {"type": "chat", "id": 1, "chat_name": "...", "chat_created_at": "...", "chat_updated_at": "...", "is_title_pending": false}
+#   {"type": "message", "id": 1, "chat_id": 1, "message_text": "...", "is_user_message": true, "message_created_at": "...", ...}
+CHAT_FIELDS = ('id', 'chat_name', 'chat_created_at', 'chat_updated_at', 'is_title_pending')
+MESSAGE_FIELDS = ('id', 'chat_id', 'message_text', 'is_user_message', 'message_created_at', 'message_updated_at')
+CHAT_TIMESTAMP_FIELDS = ('chat_created_at', 'chat_updated_at')
+MESSAGE_TIMESTAMP_FIELDS = ('message_created_at', 'message_updated_at')
+
+# Rows fetched from the database / inserted at a time
+EXPORT_CHUNK_SIZE = 2000
+IMPORT_BATCH_SIZE = 1000
+
+class HistoryImportError(Exception):
+    pass
+
+# Full precision timestamps (DjangoJSONEncoder would cut them to milliseconds)
+def format_history_line(record_type, record):
+    record = {field: value.isoformat() if isinstance(value, datetime) else value for field, value in record.items()}
+    return json.dumps({'type': record_type, **record}) + '\n'
+
+# Lazily yields the NDJSON lines, with constant memory: the chats and their messages are read with two
+# ordered iterators (the messages follow the (chat_id, message_created_at, id) index) and merged
+def generate_history_lines(chat_id=None):
+    chats = Chat.objects.order_by('id')
+    messages = Message.objects.order_by('chat_id', 'message_created_at', 'id')
+    if chat_id is not None:
+        chats = chats.filter(pk=chat_id)
+        messages = messages.filter(chat_id=chat_id)
+
+    message_rows = messages.values_list(*MESSAGE_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    message_row = next(message_rows, None)
+    for chat_row in chats.values_list(*CHAT_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield format_history_line('chat', dict(zip(CHAT_FIELDS, chat_row)))
+
+        # Skip the messages of chats created in the meantime (lower chat ids were already exported)
+        while message_row is not None and message_row[1] < chat_row[0]:
+            message_row = next(message_rows, None)
+        while message_row is not None and message_row[1] == chat_row[0]:
+            yield format_history_line('message', dict(zip(MESSAGE_FIELDS, message_row)))
+            message_row = next(message_rows, None)
+
+def parse_history_line(line, line_number):
+    try:
+        record = json.loads(line)
+    except ValueError:
+        raise HistoryImportError(f'Line {line_number}: invalid JSON.')
+    if not isinstance(record, dict) or record.get('type', None) not in ('chat', 'message'):
+        raise HistoryImportError(f"Line {line_number}: 'type' must be 'chat' or 'message'.")
+    return record
+
+def parse_timestamps(record, timestamp_fields, line_number):
+    timestamps = {}
+    for timestamp_field in timestamp_fields:
+        if record.get(timestamp_field, None) is None:
+            continue
+        timestamp = parse_datetime(str(record[timestamp_field]))
+        if timestamp is None:
+            raise HistoryImportError(f'Line {line_number}: invalid {timestamp_field}.')
+        timestamps[timestamp_field] = timestamp
+    return timestamps
+
+# Only JSON booleans, bool() would read "false" or 0 the wrong way round
+def parse_boolean(record, boolean_field, default, line_number):
+    value = record.get(boolean_field, default)
+    if not isinstance(value, bool):
+        raise HistoryImportError(f'Line {line_number}: {boolean_field} must be true or false.')
+    return value
+
+# Imports NDJSON lines (as exported by generate_history_lines) as new chats & messages, with batched inserts.
+# The ids are remapped, so a history can be imported next to the existing chats. All or nothing
+def import_history(lines, batch_size=IMPORT_BATCH_SIZE):
+    # {exported chat id: new chat id}
+    chat_ids = {}
+    exported_chat_ids = set()
+    # [(exported chat id, Chat, timestamps)]
+    pending_chats = []
+    # [(exported chat id, Message, timestamps)]
+    pending_messages = []
+    import_counts = {'chats': 0, 'messages': 0}
+
+    # Chats first, the messages need their new ids
+    def insert_pending_records():
+        if pending_chats:
+            created_chats = Chat.objects.bulk_create([chat for _, chat, _ in pending_chats])
+            for (exported_chat_id, _, _), created_chat in zip(pending_chats, created_chats):
+                chat_ids[exported_chat_id] = created_chat.id
+            restore_timestamps(Chat, pending_chats, CHAT_TIMESTAMP_FIELDS)
+            index_new_chats(created_chats)
+            import_counts['chats'] += len(pending_chats)
+            pending_chats.clear()
+
+        if pending_messages:
+            for exported_chat_id, message, _ in pending_messages:
+                message.chat_id_id = chat_ids[exported_chat_id]
+            created_messages = Message.objects.bulk_create([message for _, message, _ in pending_messages])
+            restore_timestamps(Message, pending_messages, MESSAGE_TIMESTAMP_FIELDS)
+            index_new_messages(created_messages)
+            import_counts['messages'] += len(pending_messages)
+            pending_messages.clear()
+
+    with transaction.atomic():
+        for line_number, line in enumerate(lines, start=1):
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            if not line.strip():
+                continue
+
+            record = parse_history_line(line, line_number)
+            if record['type'] == 'chat':
+                if record.get('id', None) is None:
+                    raise HistoryImportError(f'Line {line_number}: the chat id is missing.')
+                if record['id'] in exported_chat_ids:
+                    raise HistoryImportError(f"Line {line_number}: chat {record['id']} is listed more than once.")
+                exported_chat_ids.add(record['id'])
+                parse_boolean(record, 'is_title_pending', False, line_number)
+                chat = Chat(
+                    chat_name=str(record.get('chat_name', ''))[:Chat._meta.get_field('chat_name').max_length],
+                    # No title is generated for an imported chat, it keeps the exported name
+                    is_title_pending=False
+                )
+                pending_chats.append((record['id'], chat, parse_timestamps(record, CHAT_TIMESTAMP_FIELDS, line_number)))
+            else:
+                exported_chat_id = record.get('chat_id', None)
+                if exported_chat_id not in exported_chat_ids:
+                    raise HistoryImportError(f'Line {line_number}: the message belongs to chat {exported_chat_id}, which comes later or is missing.')
+                message_text = record.get('message_text', None)
+                if not isinstance(message_text, str) or len(message_text) > Message._meta.get_field('message_text').max_length:
+                    raise HistoryImportError(f'Line {line_number}: invalid message_text.')
+                message = Message(message_text=message_text, is_user_message=parse_boolean(record, 'is_user_message', True, line_number))
+                pending_messages.append((exported_chat_id, message, parse_timestamps(record, MESSAGE_TIMESTAMP_FIELDS, line_number)))
+
+            if len(pending_chats) + len(pending_messages) >= batch_size:
+                insert_pending_records()
+
+        insert_pending_records()
+
+    return import_counts
+
+# The timestamps are auto_now_add (overwritten by bulk_create), write back the exported ones
+def restore_timestamps(record_model, pending_records, timestamp_fields):
+    updated_records = []
+    for _, record, timestamps in pending_records:
+        if timestamps:
+            for timestamp_field, timestamp in timestamps.items():
+                setattr(record, timestamp_field, timestamp)
+            updated_records.append(record)
+    if updated_records:
+        record_model.objects.bulk_update(updated_records, list(timestamp_fields))
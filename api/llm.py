@@ -0,0 +1,193 @@
+import os, json, time, random, queue, threading, http.client
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from django.conf import settings
+from .metrics import increment_counter
+
+# Responses worth retrying: rate limited, overloaded or a server error
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+# Seconds, the backoff before retry n is random between 0 and min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**n)
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 20
+
+class LLMError(Exception):
+    pass
+
+# The request that was streaming the answer went away
+class LLMCancelled(LLMError):
+    pass
+
+# Requests per second with bursts of up to `capacity`, acquire() blocks until a token is free
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        # The bucket has to hold at least one token, or nothing could ever be acquired
+        self.capacity = max(capacity, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        # More tokens than the bucket holds would never be free, wait for a full bucket instead
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait_time = (tokens - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+# Process-wide client for an OpenAI compatible chat completions API: keep-alive connections are
+# reused between calls (no TCP/TLS handshake per call), at most max_concurrency calls run at once,
+# calls are paced by a token bucket and retried with jittered exponential backoff.
+# base_url can point to a local stand-in server (e.g. the benchmarks' fake LLM)
+class LLMClient:
+    def __init__(self, base_url, model_name, max_concurrency, rate_limit, rate_burst, max_retries, timeout):
+        base_url = urlsplit(base_url)
+        self.host = base_url.netloc
+        self.base_path = base_url.path.rstrip('/')
+        self.connection_class = http.client.HTTPSConnection if base_url.scheme == 'https' else http.client.HTTPConnection
+        self.model_name = model_name
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self._concurrency = threading.BoundedSemaphore(max_concurrency)
+        self._rate_limiter = TokenBucket(rate_limit, rate_burst) if rate_limit else None
+        # Idle keep-alive connections, at most one per concurrent call
+        self._connections = queue.LifoQueue(maxsize=max_concurrency)
+
+    # Wait for a concurrency slot and a rate limit token (also used around LLM calls made by other clients)
+    @contextmanager
+    def throttled(self, tokens=1):
+        with self._concurrency:
+            if self._rate_limiter is not None:
+                self._rate_limiter.acquire(tokens)
+            yield
+
+    def complete(self, prompt, model_name=None):
+        completion = self.post('/chat/completions', {
+            'model': model_name or self.model_name,
+            'messages': [{'role': 'user', 'content': prompt}]
+        })
+        try:
+            return completion['choices'][0]['message']['content']
+        except (KeyError, IndexError, TypeError):
+            raise LLMError('Unexpected response from the LLM API.')
+
+    # Yields the answer as it's generated (server-sent events with a content delta each). Only the request
+    # is retried, once the answer started a failure raises. Stops with LLMCancelled once cancel_event is set
+    def stream(self, prompt, model_name=None, cancel_event=None):
+        request_body = json.dumps({
+            'model': model_name or self.model_name,
+            'messages': [{'role': 'user', 'content': prompt}],
+            'stream': True
+        }).encode()
+        with self._send('/chat/completions', request_body) as response:
+            for line in response:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise LLMCancelled('The LLM answer was cancelled.')
+                line = line.decode(errors='replace').strip()
+                if not line.startswith('data:'):
+                    continue
+                event_data = line[len('data:'):].strip()
+                if event_data == '[DONE]':
+                    break
+                try:
+                    content = json.loads(event_data)['choices'][0].get('delta', {}).get('content', None)
+                except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+                    raise LLMError('Unexpected response from the LLM API.')
+                if content:
+                    yield content
+            # The rest of the body has to be read before the connection can be reused
+            response.read()
+
+    def post(self, path, payload):
+        with self._send(path, json.dumps(payload).encode()) as response:
+            response_body = response.read()
+        return json.loads(response_body)
+
+    # Send the request (retried) and hand over the successful response, read within the concurrency slot
+    @contextmanager
+    def _send(self, path, request_body):
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            with self.throttled():
+                try:
+                    connection, response = self._open(path, request_body)
+                    if response.status >= 400:
+                        try:
+                            response_body = response.read()
+                        finally:
+                            self._reuse_connection(connection, response)
+                except (OSError, http.client.HTTPException) as e:
+                    error = LLMError(f'LLM API request failed: {e}')
+                    retry_reason = 'connection'
+                else:
+                    if response.status < 400:
+                        try:
+                            yield response
+                        except (OSError, http.client.HTTPException) as e:
+                            connection.close()
+                            raise LLMError(f'LLM API request failed: {e}')
+                        except BaseException:
+                            connection.close()
+                            raise
+                        self._reuse_connection(connection, response)
+                        return
+                    error = LLMError(f'LLM API returned {response.status}: {response_body[:200].decode(errors="replace")}')
+                    if response.status not in RETRY_STATUSES:
+                        raise error
+                    retry_reason = str(response.status)
+                    retry_after = response.headers.get('Retry-After', None)
+
+            if attempt == self.max_retries:
+                raise error
+            increment_counter('api_llm_retries_total', reason=retry_reason)
+            # Backing off outside of the concurrency slot
+            time.sleep(self.get_retry_delay(attempt, retry_after))
+
+    def get_retry_delay(self, attempt, retry_after=None):
+        retry_delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+        try:
+            return max(retry_delay, float(retry_after)) if retry_after else retry_delay
+        except ValueError: # An HTTP date, not worth parsing
+            return retry_delay
+
+    def _open(self, path, request_body):
+        try:
+            connection = self._connections.get_nowait()
+        except queue.Empty:
+            connection = self.connection_class(self.host, timeout=self.timeout)
+
+        try:
+            connection.request('POST', f'{self.base_path}{path}', body=request_body, headers={
+                'Content-Type': 'application/json',
+                'Authorization': f"Bearer {os.environ.get('OPENAI_API_KEY', '')}"
+            })
+            return connection, connection.getresponse()
+        except BaseException:
+            connection.close()
+            raise
+
+    # Only a connection whose response was read to the end can be reused
+    def _reuse_connection(self, connection, response):
+        if response.will_close or not response.isclosed():
+            connection.close()
+            return
+        try:
+            self._connections.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+llm_client = LLMClient(
+    base_url=getattr(settings, 'LLM_API_BASE_URL', 'https://api.openai.com/v1'),
+    model_name=getattr(settings, 'LLM_MODEL_NAME', 'gpt-3.5-turbo'),
+    max_concurrency=getattr(settings, 'LLM_MAX_CONCURRENCY', 8),
+    rate_limit=getattr(settings, 'LLM_RATE_LIMIT', 5),
+    rate_burst=getattr(settings, 'LLM_RATE_BURST', 10),
+    max_retries=getattr(settings, 'LLM_MAX_RETRIES', 3),
+    timeout=getattr(settings, 'LLM_TIMEOUT', 60)
+)
@@ -0,0 +1,20 @@
+import sys
+from django.core.management.base import BaseCommand
+from api.history import generate_history_lines
+
+class Command(BaseCommand):
+    help = 'Export the chats and their messages as NDJSON (one record per line)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', nargs='?', default='-', help='Output file (default: stdout)')
+        parser.add_argument('--chat-id', type=int, default=None, help='Only export this chat')
+
+    def handle(self, *args, **options):
+        history_lines = generate_history_lines(chat_id=options['chat_id'])
+        if options['output'] == '-':
+            sys.stdout.writelines(history_lines)
+            return
+
+        with open(options['output'], 'w', encoding='utf-8') as output_file:
+            output_file.writelines(history_lines)
+        self.stderr.write(self.style.SUCCESS(f"Exported the chat history to {options['output']}."))
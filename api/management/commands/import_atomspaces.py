@@ -0,0 +1,21 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from api.bulk_import import import_atomspaces, BulkImportError
+
+class Command(BaseCommand):
+    help = 'Import many atomspaces at once from a directory or archive (.zip/.tar.gz) with a manifest.json'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='Directory or archive containing manifest.json and the MeTTa files')
+        parser.add_argument('--workers', type=int, default=None, help='Processes used to validate the files')
+
+    def handle(self, *args, **options):
+        try:
+            import_report = import_atomspaces(options['source'], max_workers=options['workers'])
+        except BulkImportError as e:
+            if e.report:
+                self.stderr.write(json.dumps(e.report, indent=2))
+            raise CommandError(str(e))
+
+        self.stdout.write(json.dumps(import_report['files'], indent=2))
+        self.stdout.write(self.style.SUCCESS(f"Imported {len(import_report['atomspaces'])} atomspaces."))
@@ -0,0 +1,24 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from api.history import import_history, HistoryImportError, IMPORT_BATCH_SIZE
+
+class Command(BaseCommand):
+    help = 'Import chats and messages from an NDJSON export (as new chats)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', nargs='?', default='-', help='NDJSON file (default: stdin)')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help='Records inserted at a time')
+
+    def handle(self, *args, **options):
+        try:
+            if options['source'] == '-':
+                import_counts = import_history(sys.stdin, batch_size=options['batch_size'])
+            else:
+                with open(options['source'], 'r', encoding='utf-8') as source_file:
+                    import_counts = import_history(source_file, batch_size=options['batch_size'])
+        except HistoryImportError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {import_counts['chats']} chats and {import_counts['messages']} messages."
+        ))
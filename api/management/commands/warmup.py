@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from api.warmup import warm_up
+
+class Command(BaseCommand):
+    help = ('Load the schema, mappings, prompt engine and atomspaces, and report how long each step takes. '
+            'Set API_WARM_UP=1 to do the same in each server process before it takes traffic')
+
+    def handle(self, *args, **options):
+        timings = warm_up()
+        if not timings:
+            self.stdout.write('No schema uploaded yet, nothing to warm up.')
+            return
+        for step, duration in timings.items():
+            self.stdout.write(f'{step:>16}: {duration:.3f}s')
+        self.stdout.write(self.style.SUCCESS(f'Warmed up in {sum(timings.values()):.3f}s.'))
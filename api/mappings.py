@@ -0,0 +1,147 @@
+import os, json, copy, fcntl, tempfile, threading
+from contextlib import contextmanager
+
+SCHEMA_MAPPINGS_PATH = './api/bio_data/schema_mappings.json'
+
+# In-memory copy of the schema mappings: (file signature, mappings)
+_schema_mappings = (None, None)
+_schema_mappings_lock = threading.Lock()
+
+def get_file_signature(file_path):
+    stat = os.stat(file_path)
+    # A replaced file has a new inode, even when written within the mtime resolution and with the same size
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+# Each change replaces the whole file, so its stat identifies the version (also across workers)
+def get_schema_mappings_version():
+    return '-'.join(str(part) for part in get_file_signature(SCHEMA_MAPPINGS_PATH))
+
+# The current mappings, only read from disk when another process replaced them. Don't modify the result
+def get_schema_mappings():
+    global _schema_mappings
+    if not os.path.isfile(SCHEMA_MAPPINGS_PATH):
+        return {'nodes': {}, 'edges': {}}
+
+    file_signature = get_file_signature(SCHEMA_MAPPINGS_PATH)
+    with _schema_mappings_lock:
+        if _schema_mappings[0] != file_signature:
+            with open(SCHEMA_MAPPINGS_PATH, 'r') as schema_mappings:
+                _schema_mappings = (file_signature, json.load(schema_mappings))
+        return _schema_mappings[1]
+
+# Serializes the read-modify-write of the mappings between threads and worker processes
+@contextmanager
+def schema_mappings_file_lock():
+    os.makedirs(os.path.dirname(SCHEMA_MAPPINGS_PATH), exist_ok=True)
+    with open(f'{SCHEMA_MAPPINGS_PATH}.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+# Serializes schema uploads between threads and worker processes: the previous schema is read, replaced,
+# diffed and its file deleted as one step. Separate from schema_mappings_file_lock, which the upload takes
+@contextmanager
+def schema_upload_lock():
+    os.makedirs(os.path.dirname(SCHEMA_MAPPINGS_PATH), exist_ok=True)
+    with open(f'{SCHEMA_MAPPINGS_PATH}.upload.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+# Write to a temporary file and swap it in, readers never see a partially written file
+def write_schema_mappings(mappings):
+    global _schema_mappings
+    mappings_dir = os.path.dirname(SCHEMA_MAPPINGS_PATH)
+    file_descriptor, temp_file_path = tempfile.mkstemp(dir=mappings_dir, suffix='.json.tmp')
+    try:
+        with os.fdopen(file_descriptor, 'w') as temp_file:
+            json.dump(mappings, temp_file)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_file_path, SCHEMA_MAPPINGS_PATH)
+    except BaseException:
+        if os.path.isfile(temp_file_path):
+            os.remove(temp_file_path)
+        raise
+
+    with _schema_mappings_lock:
+        _schema_mappings = (get_file_signature(SCHEMA_MAPPINGS_PATH), mappings)
+
+def set_metta_locations(mappings, atomspace_record, parse_entities, entity_names=None):
+    for entity_type, metta_file_field in (('nodes', 'node_metta_file'), ('edges', 'edge_metta_file')):
+        metta_file = atomspace_record.get(metta_file_field, None)
+        if not metta_file:
+            continue
+        for entity in parse_entities(atomspace_record.get(entity_type, '[]') or '[]'):
+            # Entities that aren't in the schema (or not being mapped) are ignored
+            if entity in mappings[entity_type] and (entity_names is None or entity in entity_names[entity_type]):
+                mappings[entity_type][entity]['metta_location'] = metta_file.lstrip('/')
+
+# An entity as defined in the schema, without the fields added by the mappings
+def get_entity_definition(entity):
+    return {key: value for key, value in entity.items() if key != 'metta_location'}
+
+# Names of the entities added, removed and changed between two schemas (unchanged ones are only counted)
+def diff_schema_items(old_items, new_items):
+    schema_diff = {}
+    for entity_type in ('nodes', 'edges'):
+        old_entities = old_items.get(entity_type, {})
+        new_entities = new_items.get(entity_type, {})
+        kept_entities = new_entities.keys() & old_entities.keys()
+        changed_entities = sorted(
+            entity for entity in kept_entities
+            if get_entity_definition(new_entities[entity]) != get_entity_definition(old_entities[entity])
+        )
+        schema_diff[entity_type] = {
+            'added': sorted(new_entities.keys() - old_entities.keys()),
+            'removed': sorted(old_entities.keys() - new_entities.keys()),
+            'changed': changed_entities,
+            'unchanged': len(kept_entities) - len(changed_entities)
+        }
+    return schema_diff
+
+def has_schema_changes(schema_diff):
+    return any(
+        schema_diff[entity_type][change] for entity_type in ('nodes', 'edges') for change in ('added', 'removed', 'changed')
+    )
+
+# Apply the atomspace records to the schema items (or to the current mappings) and write them once
+def apply_atomspace_mappings(atomspace_records, parse_entities, schema_items=None):
+    with schema_mappings_file_lock():
+        mappings = copy.deepcopy(schema_items if schema_items is not None else get_schema_mappings())
+        mappings.setdefault('nodes', {})
+        mappings.setdefault('edges', {})
+        for atomspace_record in atomspace_records:
+            set_metta_locations(mappings, atomspace_record, parse_entities)
+        write_schema_mappings(mappings)
+    return mappings
+
+# Switch the mappings to new schema items: the entities that are still in the schema keep their MeTTa file
+# (the files don't depend on the entity definition), only the added ones are mapped from the atomspace records.
+# atomspace_records is called (to read them) only if there are entities to map
+def apply_schema_diff(schema_items, schema_diff, atomspace_records, parse_entities):
+    with schema_mappings_file_lock():
+        previous_mappings = get_schema_mappings()
+        mappings = copy.deepcopy(schema_items)
+        mappings.setdefault('nodes', {})
+        mappings.setdefault('edges', {})
+        # The added entities (and any missing from the current mappings)
+        unmapped_entities = {}
+        for entity_type in ('nodes', 'edges'):
+            previous_entities = previous_mappings.get(entity_type, {})
+            unmapped_entities[entity_type] = set(schema_diff[entity_type]['added'])
+            for entity_name, entity in mappings[entity_type].items():
+                if entity_name in previous_entities and entity_name not in unmapped_entities[entity_type]:
+                    entity['metta_location'] = previous_entities[entity_name].get('metta_location', '')
+                else:
+                    unmapped_entities[entity_type].add(entity_name)
+
+        if any(unmapped_entities.values()):
+            for atomspace_record in atomspace_records():
+                set_metta_locations(mappings, atomspace_record, parse_entities, entity_names=unmapped_entities)
+        write_schema_mappings(mappings)
+    return mappings
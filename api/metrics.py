@@ -0,0 +1,89 @@
+import math, time, bisect, threading
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency histogram buckets
+STAGE_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, math.inf)
+
+# Metrics of this process, rendered in the Prometheus text format by /api/metrics/.
+# {stage: [bucket counts, sum, count]}
+_stage_durations = {}
+# {(metric name, labels): value}
+_counters = {}
+_metrics_lock = threading.Lock()
+
+COUNTER_HELP = {
+    'api_stage_errors_total': 'Stages that raised an exception.',
+    'api_llm_requests_total': 'LLM calls.',
+    'api_llm_errors_total': 'LLM calls that returned no answer (exceptions are counted by api_stage_errors_total).',
+    'api_llm_retries_total': 'LLM API requests retried, by reason (HTTP status or connection).',
+    'api_llm_tokens_total': 'Tokens sent to and received from the LLM (estimated from the text length).',
+    'api_cache_requests_total': 'Cache lookups by result (cache="in_flight": hit = joined an identical question in progress).'
+}
+
+def observe_stage(stage, duration):
+    bucket_index = bisect.bisect_left(STAGE_DURATION_BUCKETS, duration)
+    with _metrics_lock:
+        stage_duration = _stage_durations.get(stage)
+        if stage_duration is None:
+            stage_duration = _stage_durations[stage] = [[0] * len(STAGE_DURATION_BUCKETS), 0.0, 0]
+        stage_duration[0][bucket_index] += 1
+        stage_duration[1] += duration
+        stage_duration[2] += 1
+
+def increment_counter(metric_name, amount=1, **labels):
+    counter_key = (metric_name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        _counters[counter_key] = _counters.get(counter_key, 0) + amount
+
+# Time a stage of a request:  with timed_stage('metta_execution'): ...
+@contextmanager
+def timed_stage(stage):
+    start_time = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        increment_counter('api_stage_errors_total', stage=stage)
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - start_time)
+
+def record_llm_call(call, prompt, llm_response):
+    increment_counter('api_llm_requests_total', call=call)
+    if not llm_response:
+        increment_counter('api_llm_errors_total', call=call)
+    # ~4 characters per token, the LLM client doesn't report the usage
+    increment_counter('api_llm_tokens_total', len(prompt) // 4, call=call, direction='prompt')
+    increment_counter('api_llm_tokens_total', len(llm_response or '') // 4, call=call, direction='completion')
+
+def record_cache_lookup(cache, is_hit):
+    increment_counter('api_cache_requests_total', cache=cache, result='hit' if is_hit else 'miss')
+
+def format_labels(labels):
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}' if labels else ''
+
+def render_metrics():
+    with _metrics_lock:
+        stage_durations = {stage: (list(buckets), total, count) for stage, (buckets, total, count) in _stage_durations.items()}
+        counters = dict(_counters)
+
+    lines = [
+        '# HELP api_stage_duration_seconds Time spent in each stage of the API requests.',
+        '# TYPE api_stage_duration_seconds histogram'
+    ]
+    for stage, (buckets, total, count) in sorted(stage_durations.items()):
+        cumulative_count = 0
+        for upper_bound, bucket_count in zip(STAGE_DURATION_BUCKETS, buckets):
+            cumulative_count += bucket_count
+            bound_label = '+Inf' if upper_bound == math.inf else repr(upper_bound)
+            lines.append(f'api_stage_duration_seconds_bucket{format_labels([("stage", stage), ("le", bound_label)])} {cumulative_count}')
+        lines.append(f'api_stage_duration_seconds_sum{format_labels([("stage", stage)])} {total}')
+        lines.append(f'api_stage_duration_seconds_count{format_labels([("stage", stage)])} {count}')
+
+    for metric_name, metric_help in COUNTER_HELP.items():
+        lines.append(f'# HELP {metric_name} {metric_help}')
+        lines.append(f'# TYPE {metric_name} counter')
+        for (counter_name, labels), value in sorted(counters.items()):
+            if counter_name == metric_name:
+                lines.append(f'{metric_name}{format_labels(labels)} {value}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,178 @@
+import os, re, codecs, hashlib
+
+# Characters that change the parser state outside of strings & comments
+_SPECIAL_CHARS = re.compile(r'[()";\n]')
+_STRING_SPECIAL_CHARS = re.compile(r'["\\\n]')
+_HEAD_CHARS = re.compile(r'[^\s()";]*')
+_WHITESPACE = re.compile(r'[^\S\n]*')
+
+MAX_REPORTED_ERRORS = 20
+
+# Incremental MeTTa syntax check, fed one chunk at a time so files of any size are validated with bounded memory.
+# Counts the top level expressions by their head symbol (the entity type, e.g. `gene` in `(gene ENSG00000223972)`).
+# The whole parser state is JSON serializable (get_state) so a validation can be resumed across requests.
+class MettaValidator:
+    def __init__(self, state=None):
+        state = state or {}
+        self.depth = state.get('depth', 0)
+        self.in_string = state.get('in_string', False)
+        self.is_escaped = state.get('is_escaped', False)
+        self.in_comment = state.get('in_comment', False)
+        # Head symbol of the current top level expression while it is being read, otherwise None
+        self.head = state.get('head', None)
+        self.line = state.get('line', 1)
+        self.expression_count = state.get('expression_count', 0)
+        self.entity_counts = state.get('entity_counts', {})
+        self.errors = state.get('errors', [])
+
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._decoder.setstate((bytes.fromhex(state.get('pending_bytes', '')), 0))
+
+    def get_state(self):
+        return {
+            'depth': self.depth,
+            'in_string': self.in_string,
+            'is_escaped': self.is_escaped,
+            'in_comment': self.in_comment,
+            'head': self.head,
+            'line': self.line,
+            'expression_count': self.expression_count,
+            'entity_counts': self.entity_counts,
+            'errors': self.errors,
+            # Bytes of a multi-byte character split between two chunks
+            'pending_bytes': self._decoder.getstate()[0].hex()
+        }
+
+    @property
+    def is_valid(self):
+        return not self.errors
+
+    def add_error(self, error):
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f'Line {self.line}: {error}')
+
+    def feed(self, chunk):
+        try:
+            text = self._decoder.decode(chunk)
+        except UnicodeDecodeError:
+            self.add_error('File is not valid UTF-8.')
+            self._decoder.reset()
+            return
+        self._scan(text)
+
+    # Call once the last chunk was fed
+    def close(self):
+        self.feed(b'')
+        try:
+            self._decoder.decode(b'', final=True)
+        except UnicodeDecodeError:
+            self.add_error('File ends in the middle of a UTF-8 character.')
+
+        if self.in_string:
+            self.add_error('Unterminated string.')
+        if self.depth > 0:
+            self.add_error(f'{self.depth} unclosed parenthesis.')
+        return self.is_valid
+
+    def _scan(self, text):
+        position, text_length = 0, len(text)
+
+        while position < text_length:
+            if self.head is not None:
+                position = self._read_head(text, position)
+                continue
+
+            if self.in_comment:
+                line_end = text.find('\n', position)
+                if line_end == -1:
+                    break
+                self.in_comment = False
+                self.line += 1
+                position = line_end + 1
+                continue
+
+            if self.in_string:
+                if self.is_escaped:
+                    self.is_escaped = False
+                    self.line += text[position] == '\n'
+                    position += 1
+                    continue
+
+                match = _STRING_SPECIAL_CHARS.search(text, position)
+                if match is None:
+                    break
+                char, position = match.group(), match.end()
+                if char == '\\':
+                    self.is_escaped = True
+                elif char == '"':
+                    self.in_string = False
+                else:
+                    self.line += 1
+                continue
+
+            match = _SPECIAL_CHARS.search(text, position)
+            if match is None:
+                break
+            char, position = match.group(), match.end()
+
+            if char == '(':
+                self.depth += 1
+                if self.depth == 1:
+                    self.head = ''
+            elif char == ')':
+                if self.depth == 0:
+                    self.add_error('Unexpected ")".')
+                    continue
+                self.depth -= 1
+                if self.depth == 0:
+                    self.expression_count += 1
+            elif char == '"':
+                self.in_string = True
+            elif char == ';':
+                self.in_comment = True
+            else:
+                self.line += 1
+
+    def _read_head(self, text, position):
+        # Skip the whitespace between "(" and the head symbol
+        if not self.head:
+            position = _WHITESPACE.match(text, position).end()
+            if position == len(text):
+                return position
+
+        match = _HEAD_CHARS.match(text, position)
+        self.head += match.group()
+        position = match.end()
+
+        # The head symbol continues in the next chunk
+        if position == len(text):
+            return position
+
+        if self.head:
+            self.entity_counts[self.head] = self.entity_counts.get(self.head, 0) + 1
+        self.head = None
+        return position
+
+# Validate a whole file, reading it in chunks (and hashing it on the way if content_hash is given)
+def validate_metta_file(metta_file_path, chunk_size=1024 * 1024, content_hash=None):
+    validator = MettaValidator()
+    with open(metta_file_path, 'rb') as metta_file:
+        for chunk in iter(lambda: metta_file.read(chunk_size), b''):
+            validator.feed(chunk)
+            if content_hash is not None:
+                content_hash.update(chunk)
+    validator.close()
+    return validator
+
+# Picklable summary of a file's validation (runs in process pool workers, so no Django imports here)
+def get_metta_file_report(metta_file_path):
+    content_hash = hashlib.sha256()
+    validator = validate_metta_file(metta_file_path, content_hash=content_hash)
+    return {
+        'file': metta_file_path,
+        'size': os.path.getsize(metta_file_path),
+        'content_hash': content_hash.hexdigest(),
+        'expression_count': validator.expression_count,
+        'entity_counts': validator.entity_counts,
+        'errors': validator.errors
+    }
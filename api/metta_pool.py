@@ -0,0 +1,241 @@
+import os, time, queue, signal, logging, resource, threading, multiprocessing
+from django.conf import settings
+from .atomspaces import run_metta_query, warm_metta_files, invalidate_metta_file
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks for a timeout or a cancellation while a worker runs a query
+POLL_INTERVAL = 0.05
+
+class MettaQueryError(Exception):
+    pass
+
+class MettaQueryTimeout(MettaQueryError):
+    pass
+
+class MettaQueryCancelled(MettaQueryError):
+    pass
+
+# Resident memory of the current process in MB
+def get_process_memory_mb():
+    try:
+        with open('/proc/self/statm') as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except OSError:
+        # No /proc (e.g. macOS), use the peak instead (ru_maxrss is in bytes there)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024)
+
+# Runs in the worker process: loads the atomspaces once (then says it's ready), then answers queries until the pipe is closed
+def _work(connection, metta_file_paths):
+    # Ctrl+C is handled by the server, which stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        warm_metta_files(metta_file_paths)
+    except Exception as e:
+        logger.warning('Unable to preload the MeTTa files: %s', e)
+    connection.send(('ready', None, get_process_memory_mb()))
+
+    while True:
+        try:
+            metta_query, metta_file_paths, invalidated_file_paths = connection.recv()
+        except (EOFError, OSError):
+            break
+        # Files replaced or deleted since this worker's last query
+        for metta_file_path in invalidated_file_paths:
+            invalidate_metta_file(metta_file_path)
+        try:
+            reply = ('ok', run_metta_query(metta_query, metta_file_paths))
+        except Exception as e:
+            reply = ('error', f'{type(e).__name__}: {e}')
+        connection.send((*reply, get_process_memory_mb()))
+
+class MettaWorker:
+    def __init__(self, process_context, metta_file_paths, generation, invalidation_count):
+        self.connection, worker_connection = process_context.Pipe()
+        self.process = process_context.Process(
+            target=_work, args=(worker_connection, metta_file_paths), name='metta-worker', daemon=True
+        )
+        self.process.start()
+        worker_connection.close()
+        self.generation = generation
+        # The pool's invalidations this worker has seen (a new worker has nothing cached yet)
+        self.invalidation_count = invalidation_count
+        self.is_ready = False
+
+    # Wait until the worker has preloaded its files
+    def wait_until_ready(self, timeout=None):
+        if not self.is_ready and self.connection.poll(timeout):
+            self.connection.recv()
+            self.is_ready = True
+        return self.is_ready
+
+    def stop(self):
+        self.connection.close()
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=5)
+
+# Worker processes with the atomspace partitions they query cached. MeTTa execution is CPU bound, in the request thread
+# it would hold the GIL and stall every other request of the web worker.
+# A query that times out or is cancelled kills its worker (a running query can't be interrupted),
+# and workers whose memory grows past max_worker_memory_mb are replaced after their query.
+class MettaProcessPool:
+    def __init__(self, worker_count, query_timeout, max_worker_memory_mb):
+        self.worker_count = worker_count
+        self.query_timeout = query_timeout
+        self.max_worker_memory_mb = max_worker_memory_mb
+        # Spawned, a forked copy of a threaded web worker isn't safe
+        self._process_context = multiprocessing.get_context('spawn')
+        self._idle_workers = queue.LifoQueue()
+        self._worker_total = 0
+        # Bumped by restart(), workers of an older generation are stopped instead of reused
+        self._generation = 0
+        # MeTTa files preloaded by new workers (the partition of the latest query)
+        self._metta_file_paths = []
+        # Invalidated files, passed to each worker with its next query: {absolute path: invalidation count}
+        self._invalidated_file_paths = {}
+        self._invalidation_count = 0
+        self._workers_lock = threading.Lock()
+
+    def run(self, metta_query, metta_file_paths, timeout=None, cancel_event=None):
+        timeout = self.query_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        worker = self._acquire_worker(metta_file_paths, deadline)
+
+        try:
+            worker.connection.send((metta_query, list(metta_file_paths), self._take_invalidated_file_paths(worker)))
+            while True:
+                while not worker.connection.poll(POLL_INTERVAL):
+                    check_cancelled(cancel_event)
+                    if time.monotonic() > deadline:
+                        raise MettaQueryTimeout(f'The MeTTa query took longer than {timeout} seconds.')
+                    if not worker.process.is_alive():
+                        raise MettaQueryError('The MeTTa worker stopped while running the query.')
+                try:
+                    reply_status, reply, worker_memory_mb = worker.connection.recv()
+                except (EOFError, OSError):
+                    raise MettaQueryError('The MeTTa worker stopped while running the query.')
+                # A new worker says it's ready before answering
+                if reply_status != 'ready':
+                    break
+                worker.is_ready = True
+        except BaseException:
+            self._replace_worker(worker)
+            raise
+
+        if worker_memory_mb > self.max_worker_memory_mb:
+            logger.info('Recycling a MeTTa worker using %d MB', worker_memory_mb)
+            self._replace_worker(worker)
+        else:
+            self._release_worker(worker)
+
+        if reply_status == 'error':
+            raise MettaQueryError(reply)
+        return reply
+
+    # Start all the workers with the files preloaded and wait until they're ready (before taking traffic)
+    def warm_up(self, metta_file_paths, timeout=None):
+        started_workers = []
+        with self._workers_lock:
+            self._metta_file_paths = list(metta_file_paths)
+            while self._worker_total < self.worker_count:
+                self._worker_total += 1
+                started_workers.append(MettaWorker(self._process_context, self._metta_file_paths, self._generation, self._invalidation_count))
+
+        for worker in started_workers:
+            worker.wait_until_ready(timeout)
+            self._release_worker(worker)
+        return len(started_workers)
+
+    # Drop the files from the caches of the workers (when they run their next query), the other files stay loaded
+    def invalidate(self, metta_file_paths):
+        with self._workers_lock:
+            for metta_file_path in metta_file_paths:
+                self._invalidation_count += 1
+                self._invalidated_file_paths[os.path.abspath(metta_file_path)] = self._invalidation_count
+
+    def _take_invalidated_file_paths(self, worker):
+        with self._workers_lock:
+            invalidated_file_paths = [
+                metta_file_path for metta_file_path, invalidation_count in self._invalidated_file_paths.items()
+                if invalidation_count > worker.invalidation_count
+            ]
+            worker.invalidation_count = self._invalidation_count
+        return invalidated_file_paths
+
+    # Replace all the workers, busy workers are replaced once they're done
+    def restart(self):
+        with self._workers_lock:
+            self._generation += 1
+            self._metta_file_paths = []
+        self._stop_idle_workers()
+
+    def _acquire_worker(self, metta_file_paths, deadline):
+        with self._workers_lock:
+            self._metta_file_paths = list(metta_file_paths)
+            try:
+                return self._idle_workers.get_nowait()
+            except queue.Empty:
+                pass
+            # Workers are only started when needed, not in every process that imports this
+            if self._worker_total < self.worker_count:
+                self._worker_total += 1
+                try:
+                    return MettaWorker(self._process_context, self._metta_file_paths, self._generation, self._invalidation_count)
+                except BaseException:
+                    self._worker_total -= 1
+                    raise
+
+        try:
+            return self._idle_workers.get(timeout=max(deadline - time.monotonic(), 0))
+        except queue.Empty:
+            raise MettaQueryTimeout('No MeTTa worker became available in time.')
+
+    def _release_worker(self, worker):
+        with self._workers_lock:
+            if worker.generation == self._generation:
+                self._idle_workers.put(worker)
+                return
+        self._replace_worker(worker)
+
+    def _replace_worker(self, worker):
+        worker.stop()
+        with self._workers_lock:
+            worker = MettaWorker(self._process_context, self._metta_file_paths, self._generation, self._invalidation_count)
+            self._idle_workers.put(worker)
+
+    def _stop_idle_workers(self):
+        stopped_workers = []
+        with self._workers_lock:
+            while True:
+                try:
+                    stopped_workers.append(self._idle_workers.get_nowait())
+                except queue.Empty:
+                    break
+            self._worker_total -= len(stopped_workers)
+        for worker in stopped_workers:
+            worker.stop()
+
+# Queries run by the API. With METTA_POOL_WORKERS = 0 they run in the request thread instead
+metta_process_pool = MettaProcessPool(
+    worker_count=getattr(settings, 'METTA_POOL_WORKERS', 2),
+    query_timeout=getattr(settings, 'METTA_QUERY_TIMEOUT', 30),
+    max_worker_memory_mb=getattr(settings, 'METTA_WORKER_MAX_MEMORY_MB', 2048)
+)
+
+# Stop a question's pipeline between stages once its request went away
+def check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise MettaQueryCancelled('The MeTTa query was cancelled.')
+
+def execute_metta_query(metta_query, metta_file_paths, cancel_event=None):
+    check_cancelled(cancel_event)
+    if metta_process_pool.worker_count <= 0:
+        return run_metta_query(metta_query, metta_file_paths)
+    return metta_process_pool.run(metta_query, metta_file_paths, cancel_event=cancel_event)
+
+# Called when MeTTa files are replaced or deleted, in this process and in the workers
+def invalidate_metta_files(metta_file_paths):
+    for metta_file_path in metta_file_paths:
+        invalidate_metta_file(metta_file_path)
+    metta_process_pool.invalidate(metta_file_paths)
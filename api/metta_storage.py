@@ -0,0 +1,124 @@
+import os, fcntl, shutil, hashlib, tempfile, threading
+from contextlib import contextmanager
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from .metta_pool import invalidate_metta_files
+
+# MeTTa files are stored under the hash of their content: an identical re-upload reuses the stored file
+# (and the parsed atoms & runners cached for its path), and a file is only deleted once no Atomspace record uses it
+METTA_FILES_DIR = 'api/bio_data/bioatomspace'
+# Bytes read at a time when hashing a file
+HASH_READ_SIZE = 1024 * 1024
+
+def get_metta_file_name(content_hash):
+    return os.path.join(METTA_FILES_DIR, f'{content_hash}.metta')
+
+def hash_file(file_path):
+    content_hash = hashlib.sha256()
+    with open(file_path, 'rb') as metta_file:
+        for chunk in iter(lambda: metta_file.read(HASH_READ_SIZE), b''):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+# Hashed by the upload handlers while the request was read (otherwise read again here)
+def hash_uploaded_file(uploaded_file):
+    content_hash = getattr(uploaded_file, 'content_hash', None)
+    if content_hash is None:
+        content_hash = hashlib.sha256()
+        for chunk in uploaded_file.chunks():
+            content_hash.update(chunk)
+        content_hash = content_hash.hexdigest()
+    return content_hash
+
+# Nesting depth of metta_storage_lock() per thread
+_lock_state = threading.local()
+
+# Serializes storing and deleting files between threads and worker processes. Reentrant, so a file can be
+# stored and its Atomspace record committed under one lock (release_metta_files can't delete it in between)
+@contextmanager
+def metta_storage_lock():
+    lock_depth = getattr(_lock_state, 'depth', 0)
+    if lock_depth:
+        _lock_state.depth = lock_depth + 1
+        try:
+            yield
+        finally:
+            _lock_state.depth = lock_depth
+        return
+
+    os.makedirs(default_storage.path(METTA_FILES_DIR), exist_ok=True)
+    with open(default_storage.path(os.path.join(METTA_FILES_DIR, '.lock')), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        _lock_state.depth = 1
+        try:
+            yield
+        finally:
+            _lock_state.depth = 0
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+# Written to a temporary file and swapped in, readers never see a partially written file
+def write_metta_file(metta_file_path, write_content):
+    file_descriptor, temp_file_path = tempfile.mkstemp(dir=os.path.dirname(metta_file_path), suffix='.metta.tmp')
+    try:
+        with os.fdopen(file_descriptor, 'wb') as temp_file:
+            write_content(temp_file)
+        os.replace(temp_file_path, metta_file_path)
+    except BaseException:
+        if os.path.isfile(temp_file_path):
+            os.remove(temp_file_path)
+        raise
+
+# Store a file from disk (moved, or copied), returns the stored file name and whether it was new
+def store_metta_file(source_path, content_hash=None, move=False):
+    metta_file_name = get_metta_file_name(content_hash or hash_file(source_path))
+    metta_file_path = default_storage.path(metta_file_name)
+    with metta_storage_lock():
+        if os.path.isfile(metta_file_path):
+            if move:
+                os.remove(source_path)
+            return metta_file_name, False
+
+        if move:
+            os.replace(source_path, metta_file_path)
+        else:
+            def copy_content(temp_file):
+                with open(source_path, 'rb') as source_file:
+                    shutil.copyfileobj(source_file, temp_file, HASH_READ_SIZE)
+            write_metta_file(metta_file_path, copy_content)
+    return metta_file_name, True
+
+def store_uploaded_metta_file(uploaded_file):
+    metta_file_name = get_metta_file_name(hash_uploaded_file(uploaded_file))
+    restore_metta_file(metta_file_name, uploaded_file)
+    return metta_file_name
+
+# Write the uploaded file under its stored name unless it's there. Also called once the record using it is
+# committed: a release_metta_files() that ran in between (the record wasn't visible yet) may have deleted it
+def restore_metta_file(metta_file_name, uploaded_file):
+    metta_file_path = default_storage.path(metta_file_name)
+    with metta_storage_lock():
+        if not os.path.isfile(metta_file_path):
+            def copy_content(temp_file):
+                for chunk in uploaded_file.chunks():
+                    temp_file.write(chunk)
+            write_metta_file(metta_file_path, copy_content)
+
+# Delete the files no Atomspace record refers to anymore (call it once the record changes are committed)
+def release_metta_files(metta_file_names, atomspace_model):
+    metta_file_names = {metta_file_name for metta_file_name in metta_file_names if metta_file_name}
+    if not metta_file_names:
+        return
+
+    with metta_storage_lock():
+        used_file_names = set()
+        for node_metta_file, edge_metta_file in atomspace_model.objects.filter(
+            Q(node_metta_file__in=metta_file_names) | Q(edge_metta_file__in=metta_file_names)
+        ).values_list('node_metta_file', 'edge_metta_file'):
+            used_file_names.update((node_metta_file, edge_metta_file))
+
+        released_file_names = [
+            metta_file_name for metta_file_name in metta_file_names - used_file_names if default_storage.exists(metta_file_name)
+        ]
+        invalidate_metta_files([default_storage.path(metta_file_name) for metta_file_name in released_file_names])
+        for metta_file_name in released_file_names:
+            default_storage.delete(metta_file_name)
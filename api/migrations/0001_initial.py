@@ -0,0 +1,125 @@
+# Generated by Django 5.0.4 on 2026-10-18 00:33
+
+import api.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Atomspace',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('db_name', models.CharField(max_length=100, unique=True)),
+                ('nodes', models.CharField(default='[]', max_length=1000)),
+                ('edges', models.CharField(default='[]', max_length=1000)),
+                ('node_metta_file', models.FileField(null=True, upload_to=api.models.Atomspace.metta_file_path)),
+                ('edge_metta_file', models.FileField(null=True, upload_to=api.models.Atomspace.metta_file_path)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AtomspaceUpload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('db_name', models.CharField(max_length=100)),
+                ('file_type', models.CharField(choices=[('node', 'Node'), ('edge', 'Edge')], max_length=4)),
+                ('file_name', models.CharField(max_length=255)),
+                ('nodes', models.CharField(max_length=1000, null=True)),
+                ('edges', models.CharField(max_length=1000, null=True)),
+                ('total_size', models.BigIntegerField(null=True)),
+                ('received_size', models.BigIntegerField(default=0)),
+                ('parser_state', models.TextField(default='{}')),
+                ('upload_created_at', models.DateTimeField(auto_now_add=True)),
+                ('upload_updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Example',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('example_text', models.CharField(max_length=900)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='QueryTranslation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question', models.CharField(max_length=2000)),
+                ('schema_version', models.CharField(max_length=64)),
+                ('metta_query', models.TextField()),
+                ('hit_count', models.IntegerField(default=0)),
+                ('translation_created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Schema',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('schema_name', models.CharField(default='Schema', max_length=100, unique=True)),
+                ('schema_file', models.FileField(upload_to='api/bio_data/biocypher_schema')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Setting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message_context_length', models.IntegerField(default=10)),
+                ('openai_api_key', models.CharField(max_length=900)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Chat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chat_name', models.CharField(max_length=100)),
+                ('chat_created_at', models.DateTimeField(auto_now_add=True)),
+                ('chat_updated_at', models.DateTimeField(auto_now_add=True)),
+                ('is_title_pending', models.BooleanField(default=False)),
+                ('message_version', models.PositiveIntegerField(default=0, editable=False)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['chat_created_at', 'id'], name='api_chat_chat_cr_d340f9_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='Message',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message_text', models.CharField(max_length=2000)),
+                ('is_user_message', models.BooleanField(default=True)),
+                ('message_created_at', models.DateTimeField(auto_now_add=True)),
+                ('message_updated_at', models.DateTimeField(auto_now_add=True)),
+                ('chat_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.chat')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MessageJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message_text', models.CharField(max_length=2000)),
+                ('context_length', models.IntegerField(default=20)),
+                ('job_status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('job_error', models.TextField(blank=True, default='')),
+                ('job_created_at', models.DateTimeField(auto_now_add=True)),
+                ('job_updated_at', models.DateTimeField(auto_now=True)),
+                ('chat_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.chat')),
+                ('llm_message', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.message')),
+                ('user_message', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.message')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='querytranslation',
+            constraint=models.UniqueConstraint(fields=('question', 'schema_version'), name='unique_question_translation'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['chat_id', 'message_created_at', 'id'], name='api_message_chat_id_58442b_idx'),
+        ),
+    ]
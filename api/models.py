@@ -1,13 +1,25 @@
 import os
-from django.db import models
-from django.db.models.signals import pre_delete, pre_save
+from django.db import models, transaction
+from django.db.models.signals import pre_delete, pre_save, post_save, post_delete, post_migrate
 from django.dispatch import receiver
+from .metta_storage import METTA_FILES_DIR, store_uploaded_metta_file, restore_metta_file, release_metta_files
+from .context import bump_chat_version, add_context_message, update_context_message, remove_context_message, drop_chat_context
+from .search import create_search_index, index_message, unindex_message, index_chat, unindex_chat
 
 class Chat(models.Model):
     # topic_id = models.ForeignKey(Topic, on_delete=models.CASCADE)
     chat_name = models.CharField(max_length=100)
     chat_created_at = models.DateTimeField(auto_now_add=True)
     chat_updated_at = models.DateTimeField(auto_now_add=True)
+    # The chat name is a placeholder until the LLM generated title is written back
+    is_title_pending = models.BooleanField(default=False)
+    # Bumped on every change to the chat's messages, tells whether a cached conversation context is stale
+    message_version = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['chat_created_at', 'id'])
+        ]
 
     def __str__(self) -> str:
         return self.chat_name
@@ -19,9 +31,28 @@ class Message(models.Model):
     message_created_at = models.DateTimeField(auto_now_add=True)
     message_updated_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['chat_id', 'message_created_at', 'id'])
+        ]
+
     def __str__(self) -> str:
         return 'User Message' if self.is_user_message else 'LLM Message'
 
+# A question answered in the background, the client polls it until it's done or failed
+class MessageJob(models.Model):
+    chat_id = models.ForeignKey(Chat, on_delete=models.CASCADE)
+    message_text = models.CharField(max_length=2000)
+    context_length = models.IntegerField(default=20)
+    job_status = models.CharField(max_length=10, default='queued', choices=[
+        ('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')
+    ])
+    job_error = models.TextField(blank=True, default='')
+    user_message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, related_name='+')
+    llm_message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, related_name='+')
+    job_created_at = models.DateTimeField(auto_now_add=True)
+    job_updated_at = models.DateTimeField(auto_now=True)
+
 class Example(models.Model):
     example_text = models.CharField(max_length=900)
     
@@ -42,10 +73,11 @@ class Schema(models.Model):
     schema_file = models.FileField(upload_to='api/bio_data/biocypher_schema')
 
 class Atomspace(models.Model):
+    # Uploaded files are stored under their content hash instead (see store_metta_files)
     def metta_file_path(instance, filename):
         base_filename, file_extension = os.path.splitext(filename)
         new_filename = f"{base_filename}{file_extension}"
-        return os.path.join('api/bio_data/bioatomspace', new_filename)
+        return os.path.join(METTA_FILES_DIR, new_filename)
         # new_filename = f"custom_prefix_{instance.pk}{file_extension}"
         # file will be uploaded to MEDIA_ROOT/user_<id>/<filename>
         # return "api/bio_data/bioatomspace/".format(instance.user.id, filename)
@@ -56,6 +88,81 @@ class Atomspace(models.Model):
     node_metta_file = models.FileField(upload_to=metta_file_path, null=True)
     edge_metta_file = models.FileField(upload_to=metta_file_path, null=True)
 
+# MeTTa query generated for a (normalized) question, reused while the schema doesn't change
+class QueryTranslation(models.Model):
+    question = models.CharField(max_length=2000)
+    schema_version = models.CharField(max_length=64)
+    metta_query = models.TextField()
+    hit_count = models.IntegerField(default=0)
+    translation_created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['question', 'schema_version'], name='unique_question_translation')
+        ]
+
+    def __str__(self) -> str:
+        return self.question
+
+# A chunked (resumable) upload of a MeTTa file, swapped into its Atomspace record once complete
+class AtomspaceUpload(models.Model):
+    db_name = models.CharField(max_length=100)
+    file_type = models.CharField(max_length=4, choices=[('node', 'Node'), ('edge', 'Edge')])
+    file_name = models.CharField(max_length=255)
+    nodes = models.CharField(max_length=1000, null=True)
+    edges = models.CharField(max_length=1000, null=True)
+    total_size = models.BigIntegerField(null=True)
+    received_size = models.BigIntegerField(default=0)
+    # MettaValidator state (JSON), so validation resumes with the next chunk
+    parser_state = models.TextField(default='{}')
+    upload_created_at = models.DateTimeField(auto_now_add=True)
+    upload_updated_at = models.DateTimeField(auto_now=True)
+
+    def part_file_path(self):
+        return os.path.join('api/bio_data/uploads', f'{self.pk}.part')
+
+# Keep the cached conversation contexts in sync with the messages
+# (bulk inserts skip the signals, see save_message_records)
+@receiver(post_save, sender=Message)
+def update_chat_context(sender, instance, created, **kwargs):
+    bump_chat_version(instance.chat_id_id, sender)
+    if created:
+        add_context_message(instance)
+    else:
+        update_context_message(instance)
+
+@receiver(post_delete, sender=Message)
+def remove_chat_context_message(sender, instance, **kwargs):
+    bump_chat_version(instance.chat_id_id, sender)
+    remove_context_message(instance)
+
+@receiver(post_delete, sender=Chat)
+def delete_chat_context(sender, instance, **kwargs):
+    drop_chat_context(instance.pk)
+
+# Keep the full-text search index in sync with the messages & chat names
+# (bulk inserts and .update() skip the signals, index those records explicitly)
+@receiver(post_save, sender=Message)
+def update_message_search_index(sender, instance, **kwargs):
+    index_message(instance)
+
+@receiver(post_delete, sender=Message)
+def remove_message_search_index(sender, instance, **kwargs):
+    unindex_message(instance)
+
+@receiver(post_save, sender=Chat)
+def update_chat_search_index(sender, instance, **kwargs):
+    index_chat(instance)
+
+@receiver(post_delete, sender=Chat)
+def remove_chat_search_index(sender, instance, **kwargs):
+    unindex_chat(instance)
+
+@receiver(post_migrate)
+def create_search_index_tables(sender, **kwargs):
+    if sender.name == 'api':
+        create_search_index(Message, Chat)
+
 # Delete the Schema when deleting the Schema record
 @receiver(pre_delete, sender=Schema)
 def delete_old_schema(sender, instance, **kwargs):
@@ -63,32 +170,48 @@ def delete_old_schema(sender, instance, **kwargs):
     if instance.schema_file and os.path.isfile(instance.schema_file.path):
         os.remove(instance.schema_file.path)
 
-# Delete the MeTTa file of a deleted Atomspace record
-@receiver(pre_delete, sender=Atomspace)
-def delete_metta_file(sender, instance, **kwargs):
-    # Delete the MeTTa files from the file system
-    if instance.node_metta_file and os.path.isfile(instance.node_metta_file.path):
-        os.remove(instance.node_metta_file.path)
-
-    if instance.edge_metta_file and os.path.isfile(instance.edge_metta_file.path):
-        os.remove(instance.edge_metta_file.path)
+METTA_FILE_FIELDS = ('node_metta_file', 'edge_metta_file')
 
-# Delete old MeTTa file while updating (saving a new MeTTa file)
+# Store the uploaded MeTTa files under their content hash (an identical file is only stored once)
+# and remember the files being replaced
 @receiver(pre_save, sender=Atomspace)
-def delete_old_metta_file(sender, instance, **kwargs):
-    # Check if the instance has been previously saved
-    if instance.pk:
-        # Retrieve the existing record from the database
-        old_instance = sender.objects.get(pk=instance.pk)
-        # Compare the old file path with the new file path
-        if old_instance.node_metta_file != instance.node_metta_file:
-            # Delete the old file if it exists
-            if old_instance.node_metta_file and os.path.isfile(old_instance.node_metta_file.path):
-                os.remove(old_instance.node_metta_file.path)
-        
-        if old_instance.edge_metta_file != instance.edge_metta_file:
-            if old_instance.edge_metta_file and os.path.isfile(old_instance.edge_metta_file.path):
-                os.remove(old_instance.edge_metta_file.path)
-
-
-
+def store_metta_files(sender, instance, **kwargs):
+    old_instance = sender.objects.filter(pk=instance.pk).first() if instance.pk else None
+    instance._replaced_metta_files = set()
+    instance._stored_metta_files = []
+    for metta_file_field in METTA_FILE_FIELDS:
+        metta_file = getattr(instance, metta_file_field)
+        if metta_file and not metta_file._committed:
+            uploaded_file = metta_file.file
+            setattr(instance, metta_file_field, store_uploaded_metta_file(uploaded_file))
+            instance._stored_metta_files.append((getattr(instance, metta_file_field).name, uploaded_file))
+
+        old_metta_file = getattr(old_instance, metta_file_field) if old_instance else None
+        if old_metta_file and old_metta_file.name != getattr(instance, metta_file_field).name:
+            instance._replaced_metta_files.add(old_metta_file.name)
+
+# Files are shared between records, they're only deleted (once committed) if no other record uses them
+@receiver(post_save, sender=Atomspace)
+def release_replaced_metta_files(sender, instance, **kwargs):
+    replaced_metta_files = getattr(instance, '_replaced_metta_files', None)
+    if replaced_metta_files:
+        transaction.on_commit(lambda: release_metta_files(replaced_metta_files, sender))
+
+# The stored files aren't protected by the record until it's committed (unless the save ran under
+# metta_storage_lock), write back a file another request released in the meantime
+@receiver(post_save, sender=Atomspace)
+def restore_stored_metta_files(sender, instance, **kwargs):
+    for metta_file_name, uploaded_file in getattr(instance, '_stored_metta_files', []):
+        transaction.on_commit(lambda metta_file_name=metta_file_name, uploaded_file=uploaded_file:
+                              restore_metta_file(metta_file_name, uploaded_file))
+
+@receiver(post_delete, sender=Atomspace)
+def release_deleted_metta_files(sender, instance, **kwargs):
+    metta_file_names = {getattr(instance, metta_file_field).name for metta_file_field in METTA_FILE_FIELDS}
+    transaction.on_commit(lambda: release_metta_files(metta_file_names, sender))
+
+# Delete the partial file of a cancelled upload
+@receiver(pre_delete, sender=AtomspaceUpload)
+def delete_upload_part_file(sender, instance, **kwargs):
+    if os.path.isfile(instance.part_file_path()):
+        os.remove(instance.part_file_path())
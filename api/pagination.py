@@ -0,0 +1,16 @@
+from rest_framework.pagination import LimitOffsetPagination, CursorPagination
+
+# Keyset pagination, backed by the (created_at, id) indexes of the models
+class ChatCursorPagination(CursorPagination):
+    ordering = ('-chat_created_at', '-id')
+    page_size_query_param = 'limit'
+
+class MessageCursorPagination(CursorPagination):
+    ordering = ('-message_created_at', '-id')
+    page_size_query_param = 'limit'
+
+# ?pagination=cursor (or an existing ?cursor=) switches from limit/offset to cursor pagination
+def get_pagination_class(request, cursor_pagination_class):
+    if request.query_params.get('pagination', None) == 'cursor' or 'cursor' in request.query_params:
+        return cursor_pagination_class
+    return LimitOffsetPagination
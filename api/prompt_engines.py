@@ -0,0 +1,55 @@
+import queue, threading
+from contextlib import contextmanager
+
+# Prompt engines keep the state of the question they're answering on themselves (the question, the selected
+# entities & relationships...), so an engine answers one question at a time. Up to max_engines are built for
+# the current key (schema file hash, schema mappings version) and checked out per question
+class PromptEnginePool:
+    def __init__(self, max_engines):
+        self.max_engines = max_engines
+        self._engine_key = None
+        self._idle_engines = queue.LifoQueue()
+        self._engine_count = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self, engine_key, build_engine):
+        with self._lock:
+            # Engines built from older inputs are dropped when they're returned
+            if engine_key != self._engine_key:
+                self._engine_key = engine_key
+                self._idle_engines = queue.LifoQueue()
+                self._engine_count = 0
+            idle_engines = self._idle_engines
+            try:
+                prompt_engine = idle_engines.get_nowait()
+            except queue.Empty:
+                prompt_engine = None
+                is_building = self._engine_count < self.max_engines
+                if is_building:
+                    self._engine_count += 1
+
+        if prompt_engine is None:
+            if is_building:
+                try:
+                    prompt_engine = build_engine()
+                except BaseException:
+                    with self._lock:
+                        if idle_engines is self._idle_engines:
+                            self._engine_count -= 1
+                    raise
+            else:
+                # All the engines are answering a question, wait for one
+                prompt_engine = idle_engines.get()
+
+        try:
+            yield prompt_engine
+        finally:
+            idle_engines.put(prompt_engine)
+
+    # Drop the engines (e.g. after the schema or the schema mappings have changed)
+    def clear(self):
+        with self._lock:
+            self._engine_key = None
+            self._idle_engines = queue.LifoQueue()
+            self._engine_count = 0
@@ -0,0 +1,219 @@
+import re, threading
+from django.db import connection, OperationalError
+
+# SQLite FTS5 tables over the message texts and the chat names, rowid = the message / chat id.
+# Created after migrate (or on first use) and kept in sync by the Message & Chat signals
+MESSAGE_SEARCH_TABLE = 'api_message_search'
+CHAT_SEARCH_TABLE = 'api_chat_search'
+
+SEARCH_TYPES = ('all', 'messages', 'chats')
+HIGHLIGHT_START, HIGHLIGHT_END = '<mark>', '</mark>'
+# Tokens around the matches kept in a message snippet
+SNIPPET_TOKENS = 24
+
+_search_index_ready = None
+_search_index_lock = threading.Lock()
+
+def get_search_terms(query):
+    return re.findall(r'\w+', query.lower())
+
+# Every term must match (prefix match on the last one, for search as you type).
+# The terms are quoted so user input can't break the FTS5 query syntax
+def get_match_query(search_terms):
+    quoted_terms = [f'"{term}"' for term in search_terms]
+    quoted_terms[-1] += '*'
+    return ' '.join(quoted_terms)
+
+def create_search_index(message_model, chat_model):
+    global _search_index_ready
+    if connection.vendor != 'sqlite':
+        _search_index_ready = False
+        return False
+
+    with _search_index_lock:
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name IN (%s, %s)",
+                               [MESSAGE_SEARCH_TABLE, CHAT_SEARCH_TABLE])
+                existing_tables = {row[0] for row in cursor.fetchall()}
+
+                # Indexing the existing rows when a table is created
+                if MESSAGE_SEARCH_TABLE not in existing_tables:
+                    cursor.execute(f'CREATE VIRTUAL TABLE {MESSAGE_SEARCH_TABLE} USING fts5(message_text, chat_id UNINDEXED)')
+                    cursor.execute(
+                        f'INSERT INTO {MESSAGE_SEARCH_TABLE} (rowid, message_text, chat_id) '
+                        f'SELECT id, message_text, chat_id_id FROM {message_model._meta.db_table}'
+                    )
+                if CHAT_SEARCH_TABLE not in existing_tables:
+                    cursor.execute(f'CREATE VIRTUAL TABLE {CHAT_SEARCH_TABLE} USING fts5(chat_name)')
+                    cursor.execute(
+                        f'INSERT INTO {CHAT_SEARCH_TABLE} (rowid, chat_name) SELECT id, chat_name FROM {chat_model._meta.db_table}'
+                    )
+            _search_index_ready = True
+        except OperationalError:
+            # SQLite built without FTS5 (or the model tables don't exist yet)
+            _search_index_ready = False
+    return _search_index_ready
+
+def is_search_index_ready(message_model, chat_model):
+    if _search_index_ready is None:
+        return create_search_index(message_model, chat_model)
+    return _search_index_ready
+
+# ---------------------------------- Called by the Message & Chat signals ----------------------------------
+
+def is_message_index_ready(message):
+    return is_search_index_ready(type(message), message._meta.get_field('chat_id').related_model)
+
+def is_chat_index_ready(chat):
+    return is_search_index_ready(chat.message_set.model, type(chat))
+
+def index_message(message):
+    if not is_message_index_ready(message):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {MESSAGE_SEARCH_TABLE} WHERE rowid = %s', [message.id])
+        cursor.execute(f'INSERT INTO {MESSAGE_SEARCH_TABLE} (rowid, message_text, chat_id) VALUES (%s, %s, %s)',
+                       [message.id, message.message_text, message.chat_id_id])
+
+def unindex_message(message):
+    if is_message_index_ready(message):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {MESSAGE_SEARCH_TABLE} WHERE rowid = %s', [message.id])
+
+def index_chat(chat):
+    if not is_chat_index_ready(chat):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {CHAT_SEARCH_TABLE} WHERE rowid = %s', [chat.id])
+        cursor.execute(f'INSERT INTO {CHAT_SEARCH_TABLE} (rowid, chat_name) VALUES (%s, %s)', [chat.id, chat.chat_name])
+
+def unindex_chat(chat):
+    if is_chat_index_ready(chat):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {CHAT_SEARCH_TABLE} WHERE rowid = %s', [chat.id])
+
+# New records inserted in bulk (e.g. an imported chat history), one statement per batch
+def index_new_messages(messages):
+    if not messages or not is_message_index_ready(messages[0]):
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {MESSAGE_SEARCH_TABLE} (rowid, message_text, chat_id) VALUES (%s, %s, %s)',
+                           [(message.id, message.message_text, message.chat_id_id) for message in messages])
+
+def index_new_chats(chats):
+    if not chats or not is_chat_index_ready(chats[0]):
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {CHAT_SEARCH_TABLE} (rowid, chat_name) VALUES (%s, %s)',
+                           [(chat.id, chat.chat_name) for chat in chats])
+
+# ---------------------------------- Search results ----------------------------------
+
+# Ranked (bm25) search results, sliced by the paginator so only one page is fetched
+class SearchResults:
+    def __init__(self, search_terms, search_type='all', chat_id=None):
+        self.match_query = get_match_query(search_terms)
+        self.search_type = search_type
+        self.chat_id = chat_id
+
+    def get_selects(self, columns):
+        selects, params = [], []
+        if self.search_type in ('all', 'messages'):
+            chat_filter = ' AND chat_id = %s' if self.chat_id is not None else ''
+            selects.append(
+                f"SELECT {columns['message']} FROM {MESSAGE_SEARCH_TABLE} WHERE {MESSAGE_SEARCH_TABLE} MATCH %s{chat_filter}"
+            )
+            params += [self.match_query] + ([self.chat_id] if self.chat_id is not None else [])
+        if self.search_type in ('all', 'chats'):
+            chat_filter = ' AND rowid = %s' if self.chat_id is not None else ''
+            selects.append(f"SELECT {columns['chat']} FROM {CHAT_SEARCH_TABLE} WHERE {CHAT_SEARCH_TABLE} MATCH %s{chat_filter}")
+            params += [self.match_query] + ([self.chat_id] if self.chat_id is not None else [])
+        return ' UNION ALL '.join(selects), params
+
+    def count(self):
+        query, params = self.get_selects({'message': 'rowid', 'chat': 'rowid'})
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM ({query})', params)
+            return cursor.fetchone()[0]
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, page):
+        query, params = self.get_selects({
+            'message': (
+                f"'message', rowid, chat_id, "
+                f"snippet({MESSAGE_SEARCH_TABLE}, 0, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}', '...', {SNIPPET_TOKENS}), "
+                f"bm25({MESSAGE_SEARCH_TABLE})"
+            ),
+            'chat': (
+                f"'chat', rowid, rowid, "
+                f"highlight({CHAT_SEARCH_TABLE}, 0, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}'), "
+                f"bm25({CHAT_SEARCH_TABLE})"
+            )
+        })
+        with connection.cursor() as cursor:
+            # bm25 is lower for better matches
+            cursor.execute(f'{query} ORDER BY 5, 2 DESC LIMIT %s OFFSET %s', params + [page.stop - page.start, page.start])
+            return [
+                {'type': result_type, 'id': record_id, 'chat_id': chat_id, 'highlight': highlight, 'rank': rank}
+                for result_type, record_id, chat_id, highlight, rank in cursor.fetchall()
+            ]
+
+# Without FTS5: unranked icontains matches, newest first
+class FallbackSearchResults:
+    def __init__(self, search_terms, message_model, chat_model, search_type='all', chat_id=None):
+        self.search_terms = search_terms
+        self.querysets = []
+        if search_type in ('all', 'messages'):
+            messages = message_model.objects.all()
+            for search_term in search_terms:
+                messages = messages.filter(message_text__icontains=search_term)
+            if chat_id is not None:
+                messages = messages.filter(chat_id=chat_id)
+            self.querysets.append(('message', 'message_text', messages.order_by('-id')))
+        if search_type in ('all', 'chats'):
+            chats = chat_model.objects.all()
+            for search_term in search_terms:
+                chats = chats.filter(chat_name__icontains=search_term)
+            if chat_id is not None:
+                chats = chats.filter(pk=chat_id)
+            self.querysets.append(('chat', 'chat_name', chats.order_by('-id')))
+
+    def count(self):
+        return sum(queryset.count() for _, _, queryset in self.querysets)
+
+    def __len__(self):
+        return self.count()
+
+    def highlight(self, text):
+        pattern = '|'.join(re.escape(search_term) for search_term in self.search_terms)
+        return re.sub(f'({pattern})', rf'{HIGHLIGHT_START}\1{HIGHLIGHT_END}', text, flags=re.IGNORECASE)
+
+    def __getitem__(self, page):
+        results, offset = [], page.start
+        for result_type, text_field, queryset in self.querysets:
+            remaining = page.stop - page.start - len(results)
+            if remaining <= 0:
+                break
+            queryset_count = queryset.count()
+            if offset >= queryset_count:
+                offset -= queryset_count
+                continue
+            for record in queryset[offset:offset + remaining]:
+                results.append({
+                    'type': result_type,
+                    'id': record.id,
+                    'chat_id': record.chat_id_id if result_type == 'message' else record.id,
+                    'highlight': self.highlight(getattr(record, text_field)),
+                    'rank': None
+                })
+            offset = 0
+        return results
+
+def search_records(query, message_model, chat_model, search_type='all', chat_id=None):
+    search_terms = get_search_terms(query)
+    if is_search_index_ready(message_model, chat_model):
+        return SearchResults(search_terms, search_type, chat_id)
+    return FallbackSearchResults(search_terms, message_model, chat_model, search_type, chat_id)
@@ -4,13 +4,22 @@ from .models import *
 class ChatSerializer(serializers.ModelSerializer):
     class Meta:
         model = Chat
-        fields = '__all__'
+        # Internal, the context cache's change counter
+        exclude = ['message_version']
 
 class MessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
         fields = '__all__'
 
+class MessageJobSerializer(serializers.ModelSerializer):
+    user_message = MessageSerializer(read_only=True)
+    llm_message = MessageSerializer(read_only=True)
+
+    class Meta:
+        model = MessageJob
+        fields = '__all__'
+
 class ExampleSerializer(serializers.ModelSerializer):
     class Meta:
         model = Example
@@ -24,4 +33,15 @@ class AtomspaceSerializer(serializers.ModelSerializer):
 class SchemaSerializer(serializers.ModelSerializer):
     class Meta:
         model = Schema
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+class QueryTranslationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = QueryTranslation
+        fields = '__all__'
+
+class AtomspaceUploadSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AtomspaceUpload
+        exclude = ['parser_state']
+        read_only_fields = ['received_size']
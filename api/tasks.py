@@ -0,0 +1,99 @@
+import queue, logging, threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# Work that shouldn't hold up the request that triggered it (e.g. generating chat titles)
+_background_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'BACKGROUND_TASK_WORKERS', 4),
+    thread_name_prefix='api-background'
+)
+
+def _run_task(task, *args, **kwargs):
+    try:
+        return task(*args, **kwargs)
+    except Exception:
+        logger.exception('Background task %s failed', getattr(task, '__name__', task))
+    finally:
+        # Each worker thread gets its own DB connection, don't leave it open
+        connection.close()
+
+def run_in_background(task, *args, **kwargs):
+    return _background_executor.submit(_run_task, task, *args, **kwargs)
+
+# A fixed number of worker threads behind a bounded queue.
+# submit() raises queue.Full instead of queueing more work than the workers can catch up with
+class BoundedTaskQueue:
+    def __init__(self, name, worker_count, max_queued_tasks):
+        self.name = name
+        self.worker_count = worker_count
+        self._tasks = queue.Queue(maxsize=max_queued_tasks)
+        self._workers = []
+        self._workers_lock = threading.Lock()
+
+    @property
+    def queued_task_count(self):
+        return self._tasks.qsize()
+
+    @property
+    def is_started(self):
+        return bool(self._workers)
+
+    def submit(self, task, *args, **kwargs):
+        self._start_workers()
+        self._tasks.put_nowait((task, args, kwargs))
+
+    # The workers are only started once there is work, not in every process that imports this
+    def _start_workers(self):
+        if self._workers:
+            return
+        with self._workers_lock:
+            while len(self._workers) < self.worker_count:
+                worker = threading.Thread(target=self._work, name=f'{self.name}-{len(self._workers)}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def _work(self):
+        while True:
+            task, args, kwargs = self._tasks.get()
+            _run_task(task, *args, **kwargs)
+            self._tasks.task_done()
+
+# Questions submitted with ?async=true, answered in the background and polled through /api/jobs/<pk>/
+message_job_queue = BoundedTaskQueue(
+    name='api-message-jobs',
+    worker_count=getattr(settings, 'MESSAGE_JOB_WORKERS', 4),
+    max_queued_tasks=getattr(settings, 'MESSAGE_JOB_QUEUE_DEPTH', 100)
+)
+
+# Single-flight calls: concurrent run() calls with the same key wait for the first one and share its result
+# (or its exception) instead of each doing the same work. Only coalesces within this process
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._calls_lock = threading.Lock()
+
+    # Returns (result, whether it was shared from another call)
+    def run(self, key, task, *args, **kwargs):
+        with self._calls_lock:
+            call = self._calls.get(key)
+            is_shared = call is not None
+            if not is_shared:
+                call = self._calls[key] = Future()
+
+        if is_shared:
+            return call.result(), True
+
+        try:
+            result = task(*args, **kwargs)
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result, False
+        finally:
+            with self._calls_lock:
+                del self._calls[key]
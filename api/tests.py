@@ -1,3 +1,519 @@
-from django.test import TestCase
+import os, io, ast, json, time, queue, shutil, hashlib, tempfile, threading
+from concurrent.futures import Future
+from unittest import mock
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.test.client import encode_multipart, BOUNDARY, MULTIPART_CONTENT
+from django.http.multipartparser import MultiPartParser
+from django.core.files.uploadedfile import SimpleUploadedFile, InMemoryUploadedFile, TemporaryUploadedFile
+from datetime import datetime, timezone
+from .models import Chat, Message, QueryTranslation
+from .mappings import diff_schema_items, apply_schema_diff, get_schema_mappings, write_schema_mappings
+from .caches import carry_over_translations
+from .history import generate_history_lines, import_history, HistoryImportError
+from .llm import LLMClient, LLMError, TokenBucket
+from .metta_parser import MettaValidator
+from .upload_handlers import ContentHashMemoryFileUploadHandler, ContentHashTemporaryFileUploadHandler
+from .tasks import SingleFlight, BoundedTaskQueue
+from .prompt_engines import PromptEnginePool
+from benchmarks.fake_llm_server import FakeLLMRequestHandler, start_fake_llm_server
 
-# Create your tests here.
+OLD_SCHEMA_ITEMS = {
+    'nodes': {
+        'gene': {'represented_as': 'node', 'input_label': 'gene'},
+        'transcript': {'represented_as': 'node', 'input_label': 'transcript'},
+        'protein': {'represented_as': 'node', 'input_label': 'protein'}
+    },
+    'edges': {
+        'transcribed to': {'represented_as': 'edge', 'input_label': 'transcribed_to', 'source': 'transcript', 'target': 'gene'}
+    }
+}
+
+# gene & "transcribed to" unchanged, transcript changed, protein removed, exon added
+NEW_SCHEMA_ITEMS = {
+    'nodes': {
+        'gene': {'represented_as': 'node', 'input_label': 'gene'},
+        'transcript': {'represented_as': 'node', 'input_label': 'rna_transcript'},
+        'exon': {'represented_as': 'node', 'input_label': 'exon'}
+    },
+    'edges': {
+        'transcribed to': {'represented_as': 'edge', 'input_label': 'transcribed_to', 'source': 'transcript', 'target': 'gene'}
+    }
+}
+
+class SchemaDiffTests(SimpleTestCase):
+    def test_diff_schema_items(self):
+        self.assertEqual(diff_schema_items(OLD_SCHEMA_ITEMS, NEW_SCHEMA_ITEMS), {
+            'nodes': {'added': ['exon'], 'removed': ['protein'], 'changed': ['transcript'], 'unchanged': 1},
+            'edges': {'added': [], 'removed': [], 'changed': [], 'unchanged': 1}
+        })
+
+    def test_diff_ignores_the_mapped_metta_files(self):
+        mapped_items = json.loads(json.dumps(OLD_SCHEMA_ITEMS))
+        mapped_items['nodes']['gene']['metta_location'] = 'api/bio_data/bioatomspace/gene.metta'
+        schema_diff = diff_schema_items(mapped_items, OLD_SCHEMA_ITEMS)
+        self.assertEqual(schema_diff['nodes'], {'added': [], 'removed': [], 'changed': [], 'unchanged': 3})
+
+    def test_diff_from_no_schema(self):
+        schema_diff = diff_schema_items({'nodes': {}, 'edges': {}}, OLD_SCHEMA_ITEMS)
+        self.assertEqual(schema_diff['nodes']['added'], ['gene', 'protein', 'transcript'])
+        self.assertEqual(schema_diff['edges']['added'], ['transcribed to'])
+
+class ApplySchemaDiffTests(SimpleTestCase):
+    def setUp(self):
+        self.mappings_dir = tempfile.mkdtemp()
+        mappings_path_patch = mock.patch('api.mappings.SCHEMA_MAPPINGS_PATH', os.path.join(self.mappings_dir, 'schema_mappings.json'))
+        mappings_path_patch.start()
+        self.addCleanup(mappings_path_patch.stop)
+        self.addCleanup(shutil.rmtree, self.mappings_dir, ignore_errors=True)
+
+        previous_mappings = json.loads(json.dumps(OLD_SCHEMA_ITEMS))
+        for entity_type in ('nodes', 'edges'):
+            for entity_name, entity in previous_mappings[entity_type].items():
+                entity['metta_location'] = f'api/bio_data/bioatomspace/{entity_name}.metta'
+        write_schema_mappings(previous_mappings)
+
+    def test_kept_entities_keep_their_metta_files(self):
+        atomspace_records = [{'nodes': "['exon', 'gene']", 'edges': '[]', 'node_metta_file': '/api/bio_data/bioatomspace/exon.metta'}]
+        mappings = apply_schema_diff(
+            schema_items=NEW_SCHEMA_ITEMS,
+            schema_diff=diff_schema_items(OLD_SCHEMA_ITEMS, NEW_SCHEMA_ITEMS),
+            atomspace_records=lambda: atomspace_records,
+            parse_entities=ast.literal_eval
+        )
+
+        # Unchanged & changed entities keep their file, the added one is mapped from the records, the removed one is gone
+        self.assertEqual(mappings['nodes']['gene']['metta_location'], 'api/bio_data/bioatomspace/gene.metta')
+        self.assertEqual(mappings['nodes']['transcript']['metta_location'], 'api/bio_data/bioatomspace/transcript.metta')
+        self.assertEqual(mappings['nodes']['transcript']['input_label'], 'rna_transcript')
+        self.assertEqual(mappings['nodes']['exon']['metta_location'], 'api/bio_data/bioatomspace/exon.metta')
+        self.assertNotIn('protein', mappings['nodes'])
+        self.assertEqual(mappings['edges']['transcribed to']['metta_location'], 'api/bio_data/bioatomspace/transcribed to.metta')
+        self.assertEqual(get_schema_mappings(), mappings)
+
+    def test_records_are_only_read_for_added_entities(self):
+        def atomspace_records():
+            raise AssertionError('The atomspace records should not be read')
+
+        mappings = apply_schema_diff(
+            schema_items=OLD_SCHEMA_ITEMS,
+            schema_diff=diff_schema_items(OLD_SCHEMA_ITEMS, OLD_SCHEMA_ITEMS),
+            atomspace_records=atomspace_records,
+            parse_entities=ast.literal_eval
+        )
+        self.assertEqual(mappings['nodes']['protein']['metta_location'], 'api/bio_data/bioatomspace/protein.metta')
+
+class CarryOverTranslationsTests(TestCase):
+    def setUp(self):
+        QueryTranslation.objects.bulk_create([
+            QueryTranslation(question='which genes', schema_version='old', metta_query='!(match &self (gene $x) $x)'),
+            QueryTranslation(question='which transcripts', schema_version='old', metta_query='!(match &self (transcript $x) $x)'),
+            QueryTranslation(question='which proteins', schema_version='old', metta_query='!(match &self (protein $x) $x)'),
+            # Already translated with the new schema, the old translation is left behind
+            QueryTranslation(question='which proteins', schema_version='new', metta_query='!(match &self (protein $y) $y)')
+        ])
+
+    def test_unaffected_translations_are_kept(self):
+        translations_kept = carry_over_translations('old', 'new', is_affected=lambda metta_query: 'transcript' in metta_query)
+
+        self.assertEqual(translations_kept, 1)
+        self.assertEqual(
+            sorted(QueryTranslation.objects.filter(schema_version='new').values_list('question', 'metta_query')),
+            [('which genes', '!(match &self (gene $x) $x)'), ('which proteins', '!(match &self (protein $y) $y)')]
+        )
+        self.assertEqual(
+            sorted(QueryTranslation.objects.filter(schema_version='old').values_list('question', flat=True)),
+            ['which proteins', 'which transcripts']
+        )
+
+    def test_translations_are_moved_in_batches(self):
+        with mock.patch('api.caches.CARRY_OVER_BATCH_SIZE', 1):
+            translations_kept = carry_over_translations('old', 'new', is_affected=lambda metta_query: False)
+
+        self.assertEqual(translations_kept, 2)
+        self.assertEqual(QueryTranslation.objects.filter(schema_version='old').count(), 1)
+
+class HistoryRoundTripTests(TestCase):
+    def setUp(self):
+        self.chats = [Chat.objects.create(chat_name=f'Chat {index}') for index in range(2)]
+        for chat in self.chats:
+            for index in range(3):
+                Message.objects.create(chat_id=chat, message_text=f'{chat.chat_name} message {index}', is_user_message=index % 2 == 0)
+        # Exported with full precision and written back on import (auto_now_add would overwrite them)
+        Message.objects.filter(chat_id=self.chats[0], message_text='Chat 0 message 0').update(
+            message_created_at=datetime(2024, 1, 2, 3, 4, 5, 123456, tzinfo=timezone.utc)
+        )
+
+    def get_history(self, chat_ids):
+        return [
+            (chat.chat_name, chat.is_title_pending, chat.chat_created_at, [
+                (message.message_text, message.is_user_message, message.message_created_at, message.message_updated_at)
+                for message in Message.objects.filter(chat_id=chat).order_by('message_created_at', 'id')
+            ])
+            for chat in Chat.objects.filter(pk__in=chat_ids).order_by('id')
+        ]
+
+    def test_export_import_round_trip(self):
+        history_lines = list(generate_history_lines())
+        self.assertEqual([json.loads(line)['type'] for line in history_lines], (['chat'] + ['message'] * 3) * 2)
+
+        existing_chat_ids = [chat.pk for chat in self.chats]
+        # Uploaded files yield bytes
+        import_counts = import_history(line.encode() for line in history_lines)
+        self.assertEqual(import_counts, {'chats': 2, 'messages': 6})
+
+        imported_chat_ids = list(Chat.objects.exclude(pk__in=existing_chat_ids).values_list('pk', flat=True))
+        self.assertEqual(len(imported_chat_ids), 2)
+        self.assertEqual(self.get_history(imported_chat_ids), self.get_history(existing_chat_ids))
+
+    def test_import_in_batches(self):
+        import_counts = import_history(list(generate_history_lines()), batch_size=2)
+        self.assertEqual(import_counts, {'chats': 2, 'messages': 6})
+        self.assertEqual(Message.objects.count(), 12)
+
+    def test_export_single_chat(self):
+        history_lines = list(generate_history_lines(chat_id=self.chats[1].pk))
+        self.assertEqual(len(history_lines), 4)
+        self.assertTrue(all(json.loads(line).get('chat_id', self.chats[1].pk) == self.chats[1].pk for line in history_lines))
+
+    def test_invalid_import_changes_nothing(self):
+        history_lines = list(generate_history_lines())
+        history_lines.append('{"type": "message", "chat_id": 999, "message_text": "orphan"}\n')
+
+        with self.assertRaises(HistoryImportError):
+            import_history(history_lines, batch_size=2)
+        self.assertEqual(Chat.objects.count(), 2)
+        self.assertEqual(Message.objects.count(), 6)
+
+    def test_flags_must_be_booleans(self):
+        for invalid_line in (
+            '{"type": "message", "chat_id": 1, "message_text": "hi", "is_user_message": "false"}\n',
+            '{"type": "message", "chat_id": 1, "message_text": "hi", "is_user_message": 0}\n',
+            '{"type": "chat", "id": 2, "chat_name": "Chat", "is_title_pending": "no"}\n'
+        ):
+            with self.subTest(invalid_line=invalid_line), self.assertRaisesRegex(HistoryImportError, 'must be true or false'):
+                import_history(['{"type": "chat", "id": 1, "chat_name": "Chat"}\n', invalid_line])
+        self.assertEqual(Chat.objects.count(), 2)
+
+class TokenBucketTests(SimpleTestCase):
+    def test_bursts_up_to_the_capacity(self):
+        token_bucket = TokenBucket(rate=1, capacity=3)
+        start_time = time.monotonic()
+        for _ in range(3):
+            token_bucket.acquire()
+        self.assertLess(time.monotonic() - start_time, 0.5)
+
+    def test_waits_for_the_rate(self):
+        token_bucket = TokenBucket(rate=50, capacity=1)
+        start_time = time.monotonic()
+        for _ in range(6):
+            token_bucket.acquire()
+        # The first token is in the bucket, the other 5 come at 50 per second
+        self.assertGreaterEqual(time.monotonic() - start_time, 0.09)
+
+    def test_more_tokens_than_the_capacity(self):
+        token_bucket = TokenBucket(rate=50, capacity=2)
+        token_bucket.acquire(tokens=5)
+        self.assertEqual(token_bucket.tokens, 0)
+
+class LLMClientTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.base_url = start_fake_llm_server()
+
+    def setUp(self):
+        for patch in (
+            mock.patch.dict(os.environ, {'BENCHMARK_LLM_LATENCY': '0'}),
+            # No backoff between the retries
+            mock.patch('api.llm.RETRY_BASE_DELAY', 0)
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def get_client(self, max_retries=3, rate_limit=None, rate_burst=1):
+        return LLMClient(
+            base_url=self.base_url, model_name='fake', max_concurrency=2,
+            rate_limit=rate_limit, rate_burst=rate_burst, max_retries=max_retries, timeout=5
+        )
+
+    # The fake server fails the calls while the random number is below its error rate
+    def fail_calls(self, error_rate, error_status, random_numbers):
+        for patch in (
+            mock.patch.object(FakeLLMRequestHandler, 'error_rate', error_rate),
+            mock.patch.object(FakeLLMRequestHandler, 'error_status', error_status)
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+        server_random = mock.patch('benchmarks.fake_llm_server.random.random', side_effect=random_numbers)
+        self.addCleanup(server_random.stop)
+        return server_random.start()
+
+    def test_retries_rate_limited_and_failed_calls(self):
+        for error_status in (429, 500, 503):
+            with self.subTest(error_status=error_status):
+                server_random = self.fail_calls(0.5, error_status, [0.0, 0.0, 1.0])
+                self.assertTrue(self.get_client().complete('Which genes?').startswith('Benchmark answer'))
+                self.assertEqual(server_random.call_count, 3)
+
+    def test_streamed_call_is_retried(self):
+        server_random = self.fail_calls(0.5, 429, [0.0, 1.0])
+        self.assertTrue(''.join(self.get_client().stream('Which genes?')).startswith('Benchmark answer'))
+        self.assertEqual(server_random.call_count, 2)
+
+    def test_gives_up_after_the_retries(self):
+        server_random = self.fail_calls(1.0, 503, [0.0] * 10)
+        with self.assertRaisesRegex(LLMError, '503'):
+            self.get_client(max_retries=2).complete('Which genes?')
+        self.assertEqual(server_random.call_count, 3)
+
+    def test_client_errors_are_not_retried(self):
+        server_random = self.fail_calls(1.0, 400, [0.0] * 10)
+        with self.assertRaisesRegex(LLMError, '400'):
+            self.get_client().complete('Which genes?')
+        self.assertEqual(server_random.call_count, 1)
+
+    def test_calls_are_throttled(self):
+        llm_client = self.get_client(rate_limit=20, rate_burst=1)
+        start_time = time.monotonic()
+        for _ in range(4):
+            llm_client.complete('Which genes?')
+        # One call from the burst, the other 3 at 20 per second
+        self.assertGreaterEqual(time.monotonic() - start_time, 0.14)
+
+# Strings & comments with parenthesis, escapes, multi-byte characters and a multi-line expression
+METTA_CONTENT = """; Genes (and transcripts) — été
+(gene ENSG00000223972)
+(gene "DDX11L1 (\\"pseudo\\")")
+(transcript ENST00000456328
+    (gene ENSG00000223972))  ; 漢字
+(  transcribed_to ENST00000456328 ENSG00000223972)
+""".encode()
+
+class MettaValidatorTests(SimpleTestCase):
+    def validate(self, content, chunk_size):
+        validator = MettaValidator()
+        for start in range(0, len(content), chunk_size):
+            validator.feed(content[start:start + chunk_size])
+        validator.close()
+        return validator.get_state()
+
+    def test_chunk_boundaries_dont_change_the_result(self):
+        whole_file_state = self.validate(METTA_CONTENT, len(METTA_CONTENT))
+        self.assertEqual(whole_file_state['errors'], [])
+        self.assertEqual(whole_file_state['expression_count'], 4)
+        self.assertEqual(whole_file_state['entity_counts'], {'gene': 2, 'transcript': 1, 'transcribed_to': 1})
+        self.assertEqual(whole_file_state['line'], 7)
+
+        for chunk_size in range(1, len(METTA_CONTENT)):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(self.validate(METTA_CONTENT, chunk_size), whole_file_state)
+
+    def test_invalid_file_at_every_chunk_boundary(self):
+        invalid_content = METTA_CONTENT + b')\n(gene "unterminated\n'
+        whole_file_state = self.validate(invalid_content, len(invalid_content))
+        self.assertEqual(len(whole_file_state['errors']), 3)
+
+        for chunk_size in range(1, len(invalid_content)):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(self.validate(invalid_content, chunk_size), whole_file_state)
+
+    def test_resumed_from_the_saved_state(self):
+        whole_file_state = self.validate(METTA_CONTENT, len(METTA_CONTENT))
+        for split_at in range(1, len(METTA_CONTENT)):
+            with self.subTest(split_at=split_at):
+                validator = MettaValidator()
+                validator.feed(METTA_CONTENT[:split_at])
+                # Saved between two upload requests
+                validator = MettaValidator(json.loads(json.dumps(validator.get_state())))
+                validator.feed(METTA_CONTENT[split_at:])
+                validator.close()
+                self.assertEqual(validator.get_state(), whole_file_state)
+
+class ContentHashUploadHandlerTests(SimpleTestCase):
+    def upload(self, content, chunk_size):
+        request_body = encode_multipart(BOUNDARY, {'file': SimpleUploadedFile('gene.metta', content)})
+        upload_handlers = [ContentHashMemoryFileUploadHandler(), ContentHashTemporaryFileUploadHandler()]
+        for upload_handler in upload_handlers:
+            upload_handler.chunk_size = chunk_size
+        _, files = MultiPartParser(
+            {'CONTENT_TYPE': MULTIPART_CONTENT, 'CONTENT_LENGTH': len(request_body)},
+            io.BytesIO(request_body), upload_handlers
+        ).parse()
+        return files['file']
+
+    def test_streamed_hash_matches_the_file(self):
+        content = METTA_CONTENT * 500
+        for max_memory_size, uploaded_file_class in ((len(content) * 2, InMemoryUploadedFile), (1024, TemporaryUploadedFile)):
+            for chunk_size in (64, 1000, 64 * 1024):
+                with self.subTest(max_memory_size=max_memory_size, chunk_size=chunk_size), \
+                        override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=max_memory_size):
+                    uploaded_file = self.upload(content, chunk_size)
+                    self.assertIsInstance(uploaded_file, uploaded_file_class)
+                    self.assertEqual(uploaded_file.content_hash, hashlib.sha256(content).hexdigest())
+                    uploaded_file.close()
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        # Counts the calls waiting for the first one's result
+        self.waiting_calls = threading.Semaphore(0)
+        waiting_calls = self.waiting_calls
+
+        class WaitedFuture(Future):
+            def result(self, timeout=None):
+                waiting_calls.release()
+                return super().result(timeout)
+
+        future_patch = mock.patch('api.tasks.Future', WaitedFuture)
+        future_patch.start()
+        self.addCleanup(future_patch.stop)
+        self.single_flight = SingleFlight()
+        self.task_started, self.finish_task = threading.Event(), threading.Event()
+
+    # Runs the same call from call_count threads, the first one is still running while the others join it
+    def run_concurrently(self, task, call_count=4):
+        outcomes = [None] * call_count
+
+        def run_call(index):
+            try:
+                outcomes[index] = self.single_flight.run('key', task)
+            except Exception as e:
+                outcomes[index] = e
+
+        threads = [threading.Thread(target=run_call, args=(index,)) for index in range(call_count)]
+        threads[0].start()
+        self.assertTrue(self.task_started.wait(5))
+        for thread in threads[1:]:
+            thread.start()
+        for _ in threads[1:]:
+            self.assertTrue(self.waiting_calls.acquire(timeout=5))
+        self.finish_task.set()
+        for thread in threads:
+            thread.join(5)
+        return outcomes
+
+    def test_concurrent_calls_share_the_result(self):
+        task_calls = []
+
+        def task():
+            task_calls.append(1)
+            self.task_started.set()
+            self.finish_task.wait(5)
+            return 'answer'
+
+        self.assertEqual(self.run_concurrently(task), [('answer', False)] + [('answer', True)] * 3)
+        self.assertEqual(len(task_calls), 1)
+        # Once it's done the next call runs the task again
+        self.assertEqual(self.single_flight.run('key', task), ('answer', False))
+        self.assertEqual(len(task_calls), 2)
+
+    def test_concurrent_calls_share_the_exception(self):
+        def failing_task():
+            self.task_started.set()
+            self.finish_task.wait(5)
+            raise ValueError('No answer')
+
+        outcomes = self.run_concurrently(failing_task)
+        self.assertTrue(all(isinstance(outcome, ValueError) for outcome in outcomes))
+        # The failed call isn't kept
+        self.assertEqual(self.single_flight.run('key', lambda: 'answer'), ('answer', False))
+
+    def test_different_keys_run_separately(self):
+        self.assertEqual(self.single_flight.run('a', lambda: 1), (1, False))
+        self.assertEqual(self.single_flight.run('b', lambda: 2), (2, False))
+
+class BoundedTaskQueueTests(SimpleTestCase):
+    def test_full_queue_raises(self):
+        task_queue = BoundedTaskQueue(name='test-tasks', worker_count=1, max_queued_tasks=1)
+        task_started, finish_task, finished_tasks = threading.Event(), threading.Event(), []
+
+        def task(name):
+            task_started.set()
+            finish_task.wait(5)
+            finished_tasks.append(name)
+
+        task_queue.submit(task, 'running')
+        self.assertTrue(task_started.wait(5))
+        task_queue.submit(task, 'queued')
+        self.assertEqual(task_queue.queued_task_count, 1)
+        with self.assertRaises(queue.Full):
+            task_queue.submit(task, 'rejected')
+
+        finish_task.set()
+        task_queue._tasks.join()
+        self.assertEqual(finished_tasks, ['running', 'queued'])
+
+    def test_failed_task_doesnt_stop_the_worker(self):
+        task_queue = BoundedTaskQueue(name='test-tasks', worker_count=1, max_queued_tasks=2)
+        finished_tasks = []
+
+        def failing_task():
+            raise ValueError('Task failed')
+
+        with self.assertLogs('api.tasks', 'ERROR'):
+            task_queue.submit(failing_task)
+            task_queue.submit(finished_tasks.append, 'after')
+            task_queue._tasks.join()
+        self.assertEqual(finished_tasks, ['after'])
+
+class PromptEnginePoolTests(SimpleTestCase):
+    def setUp(self):
+        self.built_engines = []
+
+    def build_engine(self):
+        self.built_engines.append(object())
+        return self.built_engines[-1]
+
+    def test_engine_is_reused(self):
+        prompt_engine_pool = PromptEnginePool(max_engines=2)
+        with prompt_engine_pool.acquire('v1', self.build_engine) as first_engine:
+            pass
+        with prompt_engine_pool.acquire('v1', self.build_engine) as second_engine:
+            pass
+        self.assertIs(first_engine, second_engine)
+        self.assertEqual(len(self.built_engines), 1)
+
+    def test_engine_answers_one_question_at_a_time(self):
+        prompt_engine_pool = PromptEnginePool(max_engines=2)
+        with prompt_engine_pool.acquire('v1', self.build_engine) as first_engine, \
+                prompt_engine_pool.acquire('v1', self.build_engine) as second_engine:
+            self.assertIsNot(first_engine, second_engine)
+
+            # Past max_engines a question waits for an engine to be returned
+            acquired_engines = []
+            def acquire_engine():
+                with prompt_engine_pool.acquire('v1', self.build_engine) as prompt_engine:
+                    acquired_engines.append(prompt_engine)
+            waiting_thread = threading.Thread(target=acquire_engine)
+            waiting_thread.start()
+            waiting_thread.join(0.1)
+            self.assertEqual(acquired_engines, [])
+        waiting_thread.join(5)
+
+        self.assertIn(acquired_engines[0], (first_engine, second_engine))
+        self.assertEqual(len(self.built_engines), 2)
+
+    def test_engines_of_an_older_key_are_dropped(self):
+        prompt_engine_pool = PromptEnginePool(max_engines=1)
+        with prompt_engine_pool.acquire('v1', self.build_engine) as old_engine:
+            # The schema changed while the old engine was answering
+            with prompt_engine_pool.acquire('v2', self.build_engine) as new_engine:
+                self.assertIsNot(new_engine, old_engine)
+        with prompt_engine_pool.acquire('v2', self.build_engine) as prompt_engine:
+            self.assertIs(prompt_engine, new_engine)
+
+        prompt_engine_pool.clear()
+        with prompt_engine_pool.acquire('v2', self.build_engine) as prompt_engine:
+            self.assertIsNot(prompt_engine, new_engine)
+        self.assertEqual(len(self.built_engines), 3)
+
+    def test_failed_build_frees_its_slot(self):
+        prompt_engine_pool = PromptEnginePool(max_engines=1)
+
+        def failing_build():
+            raise RuntimeError('Schema file missing')
+
+        with self.assertRaises(RuntimeError):
+            with prompt_engine_pool.acquire('v1', failing_build):
+                pass
+        with prompt_engine_pool.acquire('v1', self.build_engine) as prompt_engine:
+            self.assertIs(prompt_engine, self.built_engines[0])
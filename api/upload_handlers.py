@@ -0,0 +1,29 @@
+import hashlib
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+# Hash uploaded files while they stream in (set as FILE_UPLOAD_HANDLERS), the hex SHA-256 of the content
+# is set as uploaded_file.content_hash so it doesn't have to be read again (see api/metta_storage.py)
+class ContentHashMixin:
+    def new_file(self, *args, **kwargs):
+        # Before super(), the memory handler raises StopFutureHandlers when it keeps the file
+        self.content_hash = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        # Only the handler that keeps the chunk hashes it (the memory handler passes big files on)
+        passed_on_data = super().receive_data_chunk(raw_data, start)
+        if passed_on_data is None:
+            self.content_hash.update(raw_data)
+        return passed_on_data
+
+    def file_complete(self, file_size):
+        uploaded_file = super().file_complete(file_size)
+        if uploaded_file is not None:
+            uploaded_file.content_hash = self.content_hash.hexdigest()
+        return uploaded_file
+
+class ContentHashMemoryFileUploadHandler(ContentHashMixin, MemoryFileUploadHandler):
+    pass
+
+class ContentHashTemporaryFileUploadHandler(ContentHashMixin, TemporaryFileUploadHandler):
+    pass
@@ -0,0 +1,90 @@
+import os, json, fcntl
+from django.db import transaction
+from .models import Atomspace
+from .serializers import AtomspaceUploadSerializer
+from .metta_parser import MettaValidator
+from .metta_storage import hash_file, store_metta_file, metta_storage_lock
+
+UPLOADS_DIR = 'api/bio_data/uploads'
+# Bytes read from the request body at a time
+UPLOAD_READ_SIZE = 64 * 1024
+
+class UploadChunkError(Exception):
+    pass
+
+# The chunk doesn't start at the received size (a concurrent or stale request), resume from received_size
+class UploadOffsetError(UploadChunkError):
+    pass
+
+def get_upload_progress(upload):
+    parser_state = json.loads(upload.parser_state)
+    return {
+        **AtomspaceUploadSerializer(upload).data,
+        'expression_count': parser_state.get('expression_count', 0),
+        'entity_counts': parser_state.get('entity_counts', {}),
+        'errors': parser_state.get('errors', [])
+    }
+
+def create_upload_part_file(upload):
+    os.makedirs(UPLOADS_DIR, exist_ok=True)
+    open(upload.part_file_path(), 'wb').close()
+
+# Append a chunk from the request stream to the partial file, validating it on the way. The part file is
+# locked, so concurrent requests for the same upload can't interleave their writes. Nothing is recorded
+# (the written bytes are dropped) if the chunk doesn't start at upload_offset or goes past total_size
+def append_upload_chunk(upload, stream, upload_offset):
+    with open(upload.part_file_path(), 'r+b') as part_file:
+        fcntl.flock(part_file, fcntl.LOCK_EX)
+        try:
+            upload.refresh_from_db()
+            if upload_offset != upload.received_size:
+                raise UploadOffsetError(f'The chunk has to start at offset {upload.received_size}.')
+            validator = MettaValidator(json.loads(upload.parser_state))
+
+            # Drop anything written after the last recorded chunk (e.g. an interrupted request)
+            part_file.seek(upload.received_size)
+            part_file.truncate()
+
+            received_size = upload.received_size
+            for chunk in iter(lambda: stream.read(UPLOAD_READ_SIZE), b''):
+                received_size += len(chunk)
+                if upload.total_size is not None and received_size > upload.total_size:
+                    part_file.truncate(upload.received_size)
+                    raise UploadChunkError(f'The chunk goes past the upload size of {upload.total_size} bytes.')
+                part_file.write(chunk)
+                validator.feed(chunk)
+
+            upload.received_size = received_size
+            upload.parser_state = json.dumps(validator.get_state())
+            upload.save()
+        finally:
+            fcntl.flock(part_file, fcntl.LOCK_UN)
+    return upload
+
+# Move the complete file into the bioatomspace folder (under its content hash, dropped if that content is
+# already stored) and point the Atomspace record to it.
+# Returns the Atomspace record and the validation errors (the upload is kept if there are any)
+def complete_upload(upload):
+    # The closing checks aren't saved, more chunks can still fix an incomplete file
+    validator = MettaValidator(json.loads(upload.parser_state))
+    if not validator.close():
+        return None, validator.errors
+
+    # Hashed here, a hash can't be carried between the chunk requests like the validator state
+    content_hash = hash_file(upload.part_file_path())
+    # Locked until the record is committed, a concurrent release can't delete the (already stored) file before
+    with metta_storage_lock(), transaction.atomic():
+        metta_file_name, _ = store_metta_file(upload.part_file_path(), content_hash, move=True)
+
+        atomspace_fields = {f'{upload.file_type}_metta_file': metta_file_name}
+        if upload.nodes is not None:
+            atomspace_fields['nodes'] = upload.nodes
+        if upload.edges is not None:
+            atomspace_fields['edges'] = upload.edges
+
+        atomspace, _ = Atomspace.objects.update_or_create(
+            db_name=upload.db_name,
+            defaults=atomspace_fields
+        )
+    upload.delete()
+    return atomspace, []
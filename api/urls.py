@@ -5,8 +5,10 @@ urlpatterns = [
 # ---------------------------------- CHATS ----------------------------------
     # path('chats/', ChatListAll.as_view()),
     path('chats/', ChatList.as_view()),
-    # GET - List all chats
-    # POST - Create a chat  | required field = chat_name(str)
+    # GET - List all chats  | ?limit=&offset= or ?pagination=cursor&limit= (then follow the 'next'/'previous' links)
+    # POST - Create a chat  | required field = message_text(str)
+            # | The chat is named after the message first, the LLM title is written back in the background
+            # | (is_title_pending is true until then, poll chats/<pk>/ to pick up the new chat_name)
     path('chats/<int:pk>/', ChatDetail.as_view()),
     # GET - Fetch a chat by ID
     # PUT - Update the chat    | only pass the updated fields
@@ -14,15 +16,37 @@ urlpatterns = [
 
 # ---------------------------------- MESSAGES ----------------------------------
     path('chats/<int:chat_id>/messages/', MessageList.as_view()),
-    # GET - List all messages in a chat
+    # GET - List all messages in a chat  | ?limit=&offset= or ?pagination=cursor&limit= (then follow the 'next'/'previous' links)
     # POST - Create a message(question) inside that chat  | required field = message_text(str)
             # | This will take some time as it has to query metta files and prompt the llm 
             # | If successful, the response will be the user's question and the llm's answer (in markdown)
+            # | ?async=true returns a job right away (202), poll jobs/<pk>/ for the answer (503 + Retry-After if the queue is full)
+    path('chats/<int:chat_id>/messages/stream/', MessageStream.as_view()),
+    # POST - Create a message and stream the answer as server-sent events  | required field = message_text(str)
+            # | Events: metta_query, metta_result, llm_token (one per token), done (the saved messages) or error
+            # | Serve through ASGI (biochatter_metta_server/asgi.py) so streams don't hold a worker thread
+    path('jobs/<int:pk>/', MessageJobDetail.as_view()),
+    # GET - Fetch a message job  | job_status = queued, running, done (with user_message & llm_message) or failed (with job_error)
     path('messages/<int:pk>/', MessageDetail.as_view()),
     # GET - Fetch a message by ID
     # PUT - Update the message    | only pass the updated fields
     # DELETE - Delete the message
 
+# ---------------------------------- HISTORY ----------------------------------
+    path('history/export/', HistoryExport.as_view()),
+    # GET - Download every chat with its messages as NDJSON (one JSON record per line, streamed)  | ?chat_id= for a single chat
+            # | Also available as: python manage.py export_history [output file]
+    path('history/import/', HistoryImport.as_view()),
+    # POST - Import an NDJSON export as new chats  | required fields= history_file(file)
+            # | All or nothing, the error names the first invalid line
+            # | Also available as: python manage.py import_history <file>
+
+# ---------------------------------- SEARCH ----------------------------------
+    path('search/', SearchList.as_view()),
+    # GET - Full-text search of the messages & chat names  | required param = q(str), every word must match
+            # | ?type=all|messages|chats, ?chat_id= to search a single chat, ?limit=&offset=
+            # | Results are ranked best first: type ('message' or 'chat'), id, chat_id, highlight (matches wrapped in <mark>), rank
+
 # ---------------------------------- EXAMPLES ----------------------------------
     path('examples/', ExampleList.as_view()),
     # GET - List all examples
@@ -32,6 +56,18 @@ urlpatterns = [
     # PUT - Update the example    | only pass the updated fields
     # DELETE - Delete the example
 
+# ---------------------------------- METRICS ----------------------------------
+    path('metrics/', MetricsView.as_view()),
+    # GET - Stage latency histograms, LLM and cache counters (Prometheus text format, per worker process)
+
+# ---------------------------------- TRANSLATIONS ----------------------------------
+    path('translations/', QueryTranslationList.as_view()),
+    # GET - List the cached question to MeTTa query translations  | ?question= to filter
+    # DELETE - Purge the translations  | ?stale=true to only purge the ones made for older schemas
+    path('translations/<int:pk>/', QueryTranslationDetail.as_view()),
+    # GET - Fetch a translation by ID
+    # DELETE - Purge the translation
+
 # ---------------------------------- SCHEMA ----------------------------------
     path('schema/', SchemaList.as_view()),
     # GET - List all entities in the schema
@@ -47,4 +83,18 @@ urlpatterns = [
     # GET - Fetch atomspace data by ID
     # PUT - Update atomspace data    | only pass the updated fields
     # DELETE - Delete the atomspace data (along with the MeTTa files)
+    path('atomspaces/import/', AtomspaceImport.as_view()),
+    # POST - Import many atomspaces at once  | required fields= archive(file, .zip or .tar.gz with a manifest.json)
+                                           # | All files are validated first, then every atomspace is swapped in at once
+                                           # | Also available as: python manage.py import_atomspaces <archive or directory>
+    path('atomspaces/uploads/', AtomspaceUploadList.as_view()),
+    # GET - List the unfinished chunked uploads
+    # POST - Start a chunked upload of a MeTTa file  | required fields= db_name(str), file_type('node' or 'edge'), file_name(str)
+                                                   # | optional fields= nodes(str), edges(str), total_size(int)
+    path('atomspaces/uploads/<int:pk>/', AtomspaceUploadDetail.as_view()),
+    # GET - Upload progress (received_size, entity_counts, errors) | resume the upload from received_size
+    # PUT - Append a chunk  | send the raw bytes as the body and the current received_size as the Upload-Offset header
+    # DELETE - Cancel the upload
+    path('atomspaces/uploads/<int:pk>/complete/', AtomspaceUploadComplete.as_view()),
+    # POST - Finish the upload, the file is only swapped into the atomspace (db_name) if it's a valid MeTTa file
 ]
\ No newline at end of file
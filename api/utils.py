@@ -1,20 +1,57 @@
 from rest_framework.response import Response
 from rest_framework import status
-from biochatter_metta.prompts import BioCypherPromptEngine
-from .models import Schema, Atomspace
+from django.utils import timezone
+from django.db import transaction
+from django.conf import settings
+from .models import Schema, Atomspace, Chat, MessageJob
 from .serializers import SchemaSerializer, AtomspaceSerializer
-import json, ast
+from .context import get_chat_context, add_context_message, bump_chat_version
+from .search import index_message, index_chat
+from .caches import get_question_key, get_cached_answer, cache_answer, get_cached_translation, cache_translation, carry_over_translations
+from .tasks import SingleFlight
+from .llm import llm_client, LLMError, LLMCancelled
+from .metta_pool import execute_metta_query, invalidate_metta_files, check_cancelled, MettaQueryTimeout, MettaQueryCancelled
+from .metrics import timed_stage, record_llm_call, record_cache_lookup
+from .mappings import SCHEMA_MAPPINGS_PATH, get_schema_mappings, get_schema_mappings_version, apply_atomspace_mappings
+from .mappings import diff_schema_items, has_schema_changes, apply_schema_diff
+from .prompt_engines import PromptEnginePool
+from asgiref.sync import sync_to_async
+from datetime import datetime, timedelta, timezone as dt_timezone
+import json, ast, os, re, hashlib, threading, asyncio
+from contextlib import contextmanager
+
+# Long-lived prompt engines, for the current (schema file hash, schema mappings version)
+prompt_engine_pool = PromptEnginePool(max_engines=getattr(settings, 'PROMPT_ENGINE_POOL_SIZE', 4))
+# Parsed schema items (nodes & edges), keyed by the schema file hash
+_schema_items = {}
+# Content hashes of files, keyed by path and reused while the file is unchanged on disk
+_file_hashes = {}
+# Questions being answered right now, keyed by the normalized question & the data version
+_answer_flights = SingleFlight()
+
+# Messages used as context when the request doesn't set context_length
+DEFAULT_CONTEXT_LENGTH = 20
+
+# Seconds between SSE comments sent while the answer is being generated
+SSE_KEEP_ALIVE_INTERVAL = 10
+
+# Strings and symbols of a MeTTa expression
+METTA_SYMBOL_PATTERN = re.compile(r'"[^"]*"|[^\s()"]+')
 
 # Check if the id exists in the database
 def record_exists(record_model, record_id):
     return record_model.objects.filter(pk=record_id).exists()
 
-# Update only the fields present in update_data
+# Update only the fields present in update_data (only those are written, so a concurrent
+# update of the other fields, e.g. Chat.message_version, isn't overwritten)
 def update_record(record_instance, update_data):
     if record_instance:
         for key, value in update_data.items():
             setattr(record_instance, key, value)
-        record_instance.save()
+        record_instance.save(update_fields=[
+            field.name for field in record_instance._meta.concrete_fields
+            if not field.primary_key and (field.name in update_data or field.attname in update_data)
+        ])
         return Response(status=status.HTTP_204_NO_CONTENT)
     else:
         return Response('Record does not exist!' ,status=status.HTTP_404_NOT_FOUND)
@@ -49,28 +86,294 @@ def add_record(record_data, record_model, record_serializer, additional_fields=N
     else:
         return Response(serialized_record.errors, status=status.HTTP_400_BAD_REQUEST)
     
-def add_message_record(user_data, chat_id, message_model, message_serializer_class, llm_context=''):
+def get_file_hash(file_path):
+    stat = os.stat(file_path)
+    file_signature = (stat.st_mtime_ns, stat.st_size)
+
+    cached_hash = _file_hashes.get(file_path)
+    if cached_hash and cached_hash[0] == file_signature:
+        return cached_hash[1]
+
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            file_hash.update(chunk)
+
+    _file_hashes[file_path] = (file_signature, file_hash.hexdigest())
+    return file_hash.hexdigest()
+
+def get_schema_version(schema_file_path):
+    return get_file_hash(schema_file_path)
+
+def get_cached_schema_items(schema_file_path):
+    schema_version = get_schema_version(schema_file_path)
+    schema_items = _schema_items.get(schema_version)
+    if schema_items is None:
+        # Imported on first use (like the prompt engine), biochatter_metta pulls in the whole LLM stack
+        from biochatter_metta.metta_prompt import get_schema_items
+        schema_items = get_schema_items(schema_file_path)
+        # Only the current schema is needed
+        _schema_items.clear()
+        _schema_items[schema_version] = schema_items
+    return schema_items
+
+# ETag & Last-Modified of the current schema, for conditional requests
+def get_schema_etag(request, *args, **kwargs):
+    schema_file_path = get_schema_file_path()
+    if not schema_file_path or not os.path.isfile(f'./{schema_file_path}'):
+        return None
+    return get_schema_version(f'./{schema_file_path}')
+
+def get_schema_last_modified(request, *args, **kwargs):
+    schema_file_path = get_schema_file_path()
+    if not schema_file_path or not os.path.isfile(f'./{schema_file_path}'):
+        return None
+    return datetime.fromtimestamp(os.stat(f'./{schema_file_path}').st_mtime, tz=dt_timezone.utc)
+
+# Version of the data an answer is based on: the schema content and every atomspace's MeTTa files
+def get_data_version(schema_file_path):
+    metta_file_versions = []
+    for metta_file_names in Atomspace.objects.order_by('pk').values_list('node_metta_file', 'edge_metta_file'):
+        for metta_file_name in metta_file_names:
+            if metta_file_name and os.path.isfile(metta_file_name):
+                stat = os.stat(metta_file_name)
+                metta_file_versions.append(f'{metta_file_name}:{stat.st_size}:{stat.st_mtime_ns}')
+
+    atomspace_version = hashlib.sha256('\n'.join(metta_file_versions).encode()).hexdigest()
+    return f'{get_schema_version(schema_file_path)}-{atomspace_version}'
+
+@timed_stage('prompt_engine')
+def build_prompt_engine(schema_file_path):
+    from biochatter_metta.prompts import BioCypherPromptEngine
+    return BioCypherPromptEngine(
+        model_name=llm_client.model_name,
+        schema_config_or_info_path=schema_file_path,
+        schema_mappings=SCHEMA_MAPPINGS_PATH,
+        openai_api_key='*****'
+    )
+
+# A prompt engine for the current schema & mappings, used by this thread only until the block exits
+@contextmanager
+def use_prompt_engine(schema_file_path):
+    engine_key = (get_file_hash(schema_file_path), get_schema_mappings_version())
+    with prompt_engine_pool.acquire(engine_key, lambda: build_prompt_engine(schema_file_path)) as prompt_engine:
+        yield prompt_engine
+
+# Drop the cached engines after the schema or the schema mappings have changed. The MeTTa workers keep their files:
+# stored files are named by their content, the replaced & deleted ones are invalidated by release_metta_files()
+def reset_prompt_engines():
+    prompt_engine_pool.clear()
+
+def get_schema_file_path():
     schema = SchemaSerializer( Schema.objects.last() )
-    schema_file_path = schema.data.get('schema_file', None)
-
-    prompt_engine = BioCypherPromptEngine(
-            model_name='gpt-3.5-turbo',
-            schema_config_or_info_path=f'./{schema_file_path}',
-            # schema_config_or_info_path=f'./api/bio_data/biocypher_schema/schema_config.yaml',
-            schema_mappings='./api/bio_data/schema_mappings.json',
-            openai_api_key='*****'
-        )
+    return schema.data.get('schema_file', None)
 
-    user_message = user_data['message_text']
+# The chat history (at most the last `context_length` messages, within the token budget) as additional context for the LLM
+@timed_stage('context')
+def get_llm_context(chat_id, context_length, message_model):
     try:
+        context_length = max(int(context_length), 0)
+    except (TypeError, ValueError):
+        context_length = DEFAULT_CONTEXT_LENGTH
+    return get_chat_context(chat_id, message_model).to_prompt(context_length)
+
+# Symbols of a MeTTa query that can name an entity type (strings, variables and spaces are skipped)
+def get_metta_query_symbols(metta_query):
+    return {
+        symbol.lower() for symbol in METTA_SYMBOL_PATTERN.findall(metta_query)
+        if not symbol.startswith(('"', '$', '&', '!'))
+    }
+
+# Names an entity can appear as in the MeTTa files
+def get_entity_labels(entity_name, entity):
+    entity_labels = {entity_name.replace(' ', '_')}
+    for label_key in ('input_label', 'label_as_edge'):
+        label = entity.get(label_key, None)
+        entity_labels.update([label] if isinstance(label, str) else label or [])
+    return {entity_label.lower() for entity_label in entity_labels}
+
+# The MeTTa files of the entities the query references (all the mapped files without a query,
+# or if it doesn't reference any mapped entity)
+def get_metta_file_paths(metta_query=None):
+    schema = get_schema_mappings()
+    query_symbols = get_metta_query_symbols(metta_query) if metta_query else set()
+    metta_file_paths, query_file_paths = set(), set()
+    for entity_type in ('nodes', 'edges'):
+        for entity_name, entity in schema.get(entity_type, {}).items():
+            if not entity.get('metta_location', None):
+                continue
+            metta_file_paths.add(entity['metta_location'])
+            if query_symbols & get_entity_labels(entity_name, entity):
+                query_file_paths.add(entity['metta_location'])
+    return sorted(query_file_paths or metta_file_paths)
+
+METTA_ANSWER_RESULT_LIMIT = getattr(settings, 'METTA_ANSWER_RESULT_LIMIT', 10)
+
+# The answer prompt of cached translations (first-time questions are answered with the prompt engine's own)
+ANSWER_PROMPT = '''\
+{llm_context}\
+Answer the question below based on the results of a MeTTa query run on the BioAtomspace knowledge base.
+Question: "{user_message}"
+MeTTa query: {metta_query}
+Query results ({result_note}): {metta_results}
+If the results are empty, say that no matching data was found. Format the answer in markdown.\
+'''
+
+# The runner returns one list of atoms per expression of the query, the answer only needs the first atoms
+def get_answer_results(metta_results):
+    atoms = [atom for result in metta_results for atom in result]
+    return atoms[:METTA_ANSWER_RESULT_LIMIT], len(atoms)
+
+# Answer with a previously generated MeTTa query: run it on the current atomspaces and only ask the LLM for the answer.
+# on_progress(event, data) gets the query, the results and the answer tokens as soon as they're ready
+def get_translated_metta_answer(user_message, metta_query, llm_context='', cancel_event=None, on_progress=None):
+    if on_progress is not None:
+        on_progress('metta_query', {'metta_query': metta_query})
+    with timed_stage('metta_execution'):
+        metta_results = execute_metta_query(metta_query, get_metta_file_paths(metta_query), cancel_event)
+    check_cancelled(cancel_event)
+    metta_results, result_count = get_answer_results(metta_results)
+    if on_progress is not None:
+        on_progress('metta_result', {'metta_result': metta_results})
+
+    result_note = f'{len(metta_results)} of {result_count}' if result_count > len(metta_results) else 'all'
+    answer_prompt = ANSWER_PROMPT.format(
+        llm_context=llm_context, user_message=user_message, metta_query=metta_query,
+        result_note=result_note, metta_results=metta_results
+    )
+    with timed_stage('answer_llm'):
+        llm_response = get_answer_llm_response(answer_prompt, cancel_event, on_progress)
+    record_llm_call('answer', answer_prompt, llm_response)
+
+    return {
+        'metta_query': metta_query,
+        'metta_response': metta_results,
+        'llm_response': llm_response
+    }
+
+def get_answer_llm_response(answer_prompt, cancel_event=None, on_progress=None):
+    if on_progress is None:
+        return llm_client.complete(answer_prompt)
+
+    llm_tokens = []
+    for token in llm_client.stream(answer_prompt, cancel_event=cancel_event):
+        llm_tokens.append(token)
+        on_progress('llm_token', {'token': token})
+    return ''.join(llm_tokens)
+
+# Run the question through the MeTTa & LLM pipeline (raises if no answer could be generated)
+def get_metta_answer(user_message, schema_file_path, llm_context='', cancel_event=None, on_progress=None):
+    with timed_stage('schema_load'):
+        data_version = get_data_version(f'./{schema_file_path}')
+        schema_version = get_schema_version(f'./{schema_file_path}')
+
+    cached_response = get_cached_answer(user_message, data_version, llm_context)
+    record_cache_lookup('answer', cached_response is not None)
+    if cached_response is not None:
+        return cached_response
+
+    # Concurrent requests for the same question, chat context & data version wait for one pipeline run and share its answer
+    question_key = get_question_key('in_flight', user_message, data_version, llm_context)
+    while True:
+        try:
+            metta_response, is_shared = _answer_flights.run(
+                question_key, generate_metta_answer,
+                user_message, schema_file_path, schema_version, data_version, llm_context, cancel_event, on_progress
+            )
+        except (MettaQueryCancelled, LLMCancelled):
+            if cancel_event is not None and cancel_event.is_set():
+                raise
+            # The request running the shared pipeline went away, run it for this one
+            continue
+        record_cache_lookup('in_flight', is_shared)
+        return metta_response
+
+# Ask the prompt engine: it generates the MeTTa query, runs it on its own copy of the mapped files and
+# answers with its own prompt. It has its own LLM client, but shares the concurrency limit & rate limit
+# (two LLM calls). biochatter_metta doesn't expose the query generation on its own, so only the queries of
+# cached translations run in the MeTTa pool
+def get_prompt_engine_answer(user_message, schema_file_path, llm_context='', on_progress=None):
+    with use_prompt_engine(f'./{schema_file_path}') as prompt_engine, \
+            timed_stage('metta_response'), llm_client.throttled(tokens=2):
         metta_response = prompt_engine.get_metta_response(
             user_question=user_message,
             with_llm_response=True,
             llm_context=llm_context
         )
+    record_llm_call('metta_response', f'{llm_context}{user_message}', metta_response.get('llm_response', None))
+
+    # The stages all finish at once inside the engine
+    if on_progress is not None:
+        on_progress('metta_query', {'metta_query': metta_response.get('metta_query', None)})
+        on_progress('metta_result', {'metta_result': metta_response.get('metta_response', None)})
+        if metta_response.get('llm_response', None):
+            on_progress('llm_token', {'token': metta_response['llm_response']})
+    return metta_response
+
+def generate_metta_answer(user_message, schema_file_path, schema_version, data_version, llm_context='', cancel_event=None, on_progress=None):
+    # Answered by a request that finished just before this one started
+    cached_response = get_cached_answer(user_message, data_version, llm_context)
+    if cached_response is not None:
+        return cached_response
+
+    # Skip the query generation if the question was already translated for this schema
+    metta_query = get_cached_translation(user_message, schema_version)
+    record_cache_lookup('translation', metta_query is not None)
+    metta_response = None
+    if metta_query is not None:
+        try:
+            metta_response = get_translated_metta_answer(user_message, metta_query, llm_context, cancel_event, on_progress)
+        except (MettaQueryTimeout, MettaQueryCancelled, LLMError):
+            # Running the same query (or asking the same LLM API, after the retries) inside the prompt engine won't help
+            raise
+        except Exception:
+            # Fall back to the whole pipeline
+            metta_response = None
+
+    if metta_response is None:
+        check_cancelled(cancel_event)
+        metta_response = get_prompt_engine_answer(user_message, schema_file_path, llm_context, on_progress)
+        if metta_response.get('metta_query', None):
+            cache_translation(user_message, schema_version, metta_response['metta_query'])
+
+    if not metta_response['llm_response']:
+        raise Exception('Unable to get LLM response!')
 
-        if not metta_response['llm_response']:
-            raise Exception('Unable to get LLM response!')
+    cache_answer(user_message, data_version, metta_response, llm_context)
+    return metta_response
+
+# Validate the question & the answer, then insert both in one transaction and serialize them together.
+# bulk_create skips the Message signals, so the cached chat context & the search index are updated here
+def save_message_records(user_data, llm_message, chat_id, message_model, message_serializer_class):
+    with timed_stage('message_write'):
+        user_data = user_data.dict() if hasattr(user_data, 'dict') else dict(user_data)
+        message_serializers = [
+            message_serializer_class(data={**user_data, 'chat_id': chat_id}),
+            message_serializer_class(data={**llm_message, 'chat_id': chat_id, 'is_user_message': False})
+        ]
+        for message_serializer in message_serializers:
+            if not message_serializer.is_valid():
+                return Response(message_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            messages = message_model.objects.bulk_create([
+                message_model(**message_serializer.validated_data) for message_serializer in message_serializers
+            ])
+            bump_chat_version(chat_id, message_model, len(messages))
+        for message in messages:
+            add_context_message(message)
+            index_message(message)
+
+        user_record, llm_record = message_serializer_class(messages, many=True).data
+    return user_record, llm_record
+
+def add_message_record(user_data, chat_id, message_model, message_serializer_class, llm_context=''):
+    with timed_stage('schema_load'):
+        schema_file_path = get_schema_file_path()
+
+    user_message = user_data['message_text']
+    try:
+        metta_response = get_metta_answer(user_message, schema_file_path, llm_context)
     except Exception as e:
         return Response(str(e), status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -78,42 +381,212 @@ def add_message_record(user_data, chat_id, message_model, message_serializer_cla
         'message_text': metta_response['llm_response']
     }
 
-    user_record = add_record(
-        record_data = dict(user_data),
-        record_model = message_model,
-        record_serializer= message_serializer_class,
-        additional_fields={'chat_id': chat_id},
-        get_serialized_record=True
+    return save_message_records(user_data, llm_message, chat_id, message_model, message_serializer_class)
+
+# Answer a queued question (runs on the message job queue)
+MESSAGE_JOB_TIMEOUT = getattr(settings, 'MESSAGE_JOB_TIMEOUT', 600)
+
+# Jobs left queued or running by a process that stopped (restart, crash, deploy) would be polled forever.
+# Other processes may still be working on theirs, so only the jobs not updated for MESSAGE_JOB_TIMEOUT
+# seconds (longer than any answer takes) are failed. Returns the number of jobs failed
+def fail_stale_message_jobs(job_ids=None):
+    stale_jobs = MessageJob.objects.filter(
+        job_status__in=('queued', 'running'),
+        job_updated_at__lt=timezone.now() - timedelta(seconds=MESSAGE_JOB_TIMEOUT)
     )
+    if job_ids is not None:
+        stale_jobs = stale_jobs.filter(pk__in=job_ids)
+    return stale_jobs.update(
+        job_status='failed',
+        job_error='The question was not answered in time (the server may have restarted), ask it again.',
+        job_updated_at=timezone.now()
+    )
+
+def run_message_job(job_id, message_model, message_serializer_class):
+    # Only a job still queued is run (it may have been failed as stale in the meantime)
+    if not MessageJob.objects.filter(pk=job_id, job_status='queued').update(job_status='running', job_updated_at=timezone.now()):
+        return
+    job = MessageJob.objects.get(pk=job_id)
 
-    llm_record = add_record(
-        record_data = llm_message,
-        record_model = message_model,
-        record_serializer= message_serializer_class,
-        additional_fields={'chat_id': chat_id, 'is_user_message': False},
-        get_serialized_record=True
+    try:
+        llm_context = get_llm_context(job.chat_id_id, job.context_length, message_model)
+        message_records = add_message_record(
+            user_data={'message_text': job.message_text},
+            chat_id=job.chat_id_id,
+            message_model=message_model,
+            message_serializer_class=message_serializer_class,
+            llm_context=llm_context
+        )
+    except Exception as e:
+        message_records = Response(str(e), status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    if isinstance(message_records, Response): # The pipeline failed
+        MessageJob.objects.filter(pk=job_id).update(
+            job_status='failed', job_error=str(message_records.data), job_updated_at=timezone.now()
+        )
+        return
+
+    user_record, llm_record = message_records
+    MessageJob.objects.filter(pk=job_id).update(
+        job_status='done',
+        user_message_id=user_record['id'],
+        llm_message_id=llm_record['id'],
+        job_updated_at=timezone.now()
     )
 
-    return user_record, llm_record
+# Server-sent event frame
+def format_sse_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, default=str)}\n\n'
 
-def update_schema_mappings(atomspace_record=None):
+# Answer a question as server-sent events, in stages: metta_query (sent again if a cached query failed and was
+# regenerated), metta_result, llm_token (one per token, as the LLM streams the answer) and finally done, with the
+# saved user & assistant messages (or error if no answer was generated). A cached or shared answer is sent at once
+async def stream_message_record(user_data, chat_id, message_model, message_serializer_class, llm_context=''):
+    user_message = user_data['message_text']
+    schema_file_path = await sync_to_async(get_schema_file_path)()
+
+    # The pipeline is blocking, so run it in a worker thread. Its progress comes back through a queue
+    # (None once it's finished), the connection is kept alive while nothing happens
+    loop = asyncio.get_running_loop()
+    progress_events = asyncio.Queue()
+    def on_progress(event, data):
+        loop.call_soon_threadsafe(progress_events.put_nowait, (event, data))
+
+    cancel_event = threading.Event()
+    answer_task = asyncio.ensure_future(
+        asyncio.to_thread(get_metta_answer, user_message, schema_file_path, llm_context, cancel_event, on_progress)
+    )
+    answer_task.add_done_callback(lambda task: progress_events.put_nowait((None, None)))
+    sent_events = set()
+    try:
+        while True:
+            try:
+                event, data = await asyncio.wait_for(progress_events.get(), timeout=SSE_KEEP_ALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            if event is None:
+                break
+            sent_events.add(event)
+            yield format_sse_event(event, data)
+    finally:
+        # The client went away, stop the MeTTa query or the LLM answer running for it
+        if not answer_task.done():
+            cancel_event.set()
+
+    try:
+        metta_response = answer_task.result()
+    except Exception as e:
+        yield format_sse_event('error', {'detail': str(e)})
+        return
+
+    # The stages that ran for another request (or before the answer was cached)
+    if 'metta_query' not in sent_events:
+        yield format_sse_event('metta_query', {'metta_query': metta_response.get('metta_query', None)})
+    if 'metta_result' not in sent_events:
+        yield format_sse_event('metta_result', {'metta_result': metta_response.get('metta_response', None)})
+    if 'llm_token' not in sent_events:
+        yield format_sse_event('llm_token', {'token': metta_response['llm_response']})
+
+    # Both rows are only written once the whole answer has been sent
+    message_records = await sync_to_async(save_message_records)(
+        user_data, {'message_text': metta_response['llm_response']}, chat_id, message_model, message_serializer_class
+    )
+    if isinstance(message_records, Response):
+        yield format_sse_event('error', {'detail': message_records.data})
+        return
+
+    user_record, llm_record = message_records
+    yield format_sse_event('done', {
+        'user_question': user_record,
+        'llm_response': llm_record
+    })
+
+# Use the start of the first message as the chat name until the LLM title is ready
+def get_placeholder_chat_name(message_text, max_length=50):
+    chat_name = ' '.join(message_text.split())
+    if len(chat_name) <= max_length:
+        return chat_name
+    return chat_name[:max_length - 3].rsplit(' ', 1)[0] + '...'
+
+def generate_chat_title(chat_id, message_text):
+    chat_title = ''
+    title_prompt = f'''\
+            Write a short and descriptive chat title based on the sample message below:
+            "{message_text}"\
+            The title should not me more than fifty characters long.\
+            Return only the title and without any explanations.\
+            '''.strip()
+    try:
+        with timed_stage('chat_title'):
+            llm_response = llm_client.complete(title_prompt)
+        record_llm_call('chat_title', title_prompt, llm_response)
+        chat_title = (llm_response or '').strip().strip('"')[:Chat._meta.get_field('chat_name').max_length]
+    finally:
+        # Only still pending chats are updated, so a rename in the meantime is kept.
+        # If the LLM fails the placeholder name stays, but the chat isn't left pending
+        pending_chat = Chat.objects.filter(pk=chat_id, is_title_pending=True)
+        if chat_title:
+            if pending_chat.update(chat_name=chat_title, chat_updated_at=timezone.now(), is_title_pending=False):
+                index_chat(Chat.objects.get(pk=chat_id))
+        else:
+            pending_chat.update(is_title_pending=False)
+
+# Entities & MeTTa files of an Atomspace record (None if there's no record), to tell if an upload changed anything
+def get_atomspace_state(db_name):
+    return Atomspace.objects.filter(db_name=db_name).values_list('nodes', 'edges', 'node_metta_file', 'edge_metta_file').first()
+
+# Point the schema entities to the MeTTa files of the atomspace record (or of all the records)
+def update_schema_mappings(atomspace_record=None, schema_items=None):
     if atomspace_record is None:
         atomspace_records = AtomspaceSerializer(Atomspace.objects.all(), many=True).data
     else:
         atomspace_records = [atomspace_record]
 
-    for atomspace in atomspace_records:
-        nodes = ast.literal_eval(atomspace.get('nodes','[]') or '[]')
-        edges = ast.literal_eval(atomspace.get('edges','[]') or '[]')
+    return apply_atomspace_mappings(
+        atomspace_records=atomspace_records,
+        parse_entities=ast.literal_eval,
+        schema_items=schema_items
+    )
+
+# Items & version of the current schema (no items and no version without a schema file)
+def get_current_schema():
+    schema_file_path = get_schema_file_path()
+    if not schema_file_path or not os.path.isfile(f'./{schema_file_path}'):
+        return {'nodes': {}, 'edges': {}}, None
+    return get_cached_schema_items(f'./{schema_file_path}'), get_schema_version(f'./{schema_file_path}')
 
-        with open("api/bio_data/schema_mappings.json", "r+") as schema_mappings:
-            schema = json.load(schema_mappings)
-            for node in nodes:
-                schema[f'nodes'][node]['metta_location'] = atomspace.get('node_metta_file', None).lstrip('/')
+# Move the mappings & caches from the old schema to the new one, only what depends on the added, removed or
+# changed entities is invalidated. Returns the changes and the number of MeTTa query translations kept
+def update_schema(old_schema_items, old_schema_version, schema_file_path):
+    schema_items = get_cached_schema_items(f'./{schema_file_path}')
+    schema_version = get_schema_version(f'./{schema_file_path}')
+    schema_diff = diff_schema_items(old_schema_items, schema_items)
 
-            for edge in edges:
-                schema[f'edges'][edge]['metta_location'] = atomspace.get('edge_metta_file', None).lstrip('/')
+    if has_schema_changes(schema_diff) or not os.path.isfile(SCHEMA_MAPPINGS_PATH):
+        previous_metta_file_paths = set(get_metta_file_paths())
+        apply_schema_diff(
+            schema_items=schema_items,
+            schema_diff=schema_diff,
+            atomspace_records=lambda: AtomspaceSerializer(Atomspace.objects.all(), many=True).data,
+            parse_entities=ast.literal_eval
+        )
+        # Parsed MeTTa files that are no longer mapped to any entity
+        invalidate_metta_files(previous_metta_file_paths - set(get_metta_file_paths()))
+
+    # The translations that don't mention an added, removed or changed entity still hold
+    # (answers are keyed by the schema version, they're regenerated from the kept translations)
+    translations_kept = 0
+    if old_schema_version is not None and old_schema_version != schema_version:
+        affected_labels = set()
+        for entity_type in ('nodes', 'edges'):
+            for entity_name in schema_diff[entity_type]['removed'] + schema_diff[entity_type]['changed']:
+                affected_labels |= get_entity_labels(entity_name, old_schema_items[entity_type][entity_name])
+            for entity_name in schema_diff[entity_type]['added'] + schema_diff[entity_type]['changed']:
+                affected_labels |= get_entity_labels(entity_name, schema_items[entity_type][entity_name])
+        translations_kept = carry_over_translations(
+            old_schema_version, schema_version,
+            is_affected=lambda metta_query: bool(get_metta_query_symbols(metta_query) & affected_labels)
+        )
 
-            schema_mappings.seek(0)  # rewind cursor to beginning of file
-            json.dump(schema, schema_mappings)
-            schema_mappings.truncate() # delete any trailing data (if new content is shorter)
\ No newline at end of file
+    return {**schema_diff, 'translations_kept': translations_kept}
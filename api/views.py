@@ -2,49 +2,64 @@ from rest_framework import generics, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.pagination import LimitOffsetPagination
+from django.http import HttpResponse, StreamingHttpResponse, HttpResponseBadRequest
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from asgiref.sync import sync_to_async
 
 from .models import *
 from .serializers import *
 from .utils import *
 
-import json, os
+import json, os, queue, tempfile
 from datetime import datetime
-from biochatter_metta.prompts import get_llm_response
-from biochatter_metta.metta_prompt import get_schema_items
+from .tasks import run_in_background, message_job_queue
+from .caches import clear_answer_cache
+from .metrics import timed_stage, render_metrics
+from .pagination import get_pagination_class, ChatCursorPagination, MessageCursorPagination
+from .bulk_import import import_atomspaces, BulkImportError
+from .metta_storage import metta_storage_lock
+from .mappings import schema_upload_lock
+from .uploads import get_upload_progress, create_upload_part_file, append_upload_chunk, complete_upload, UploadChunkError, UploadOffsetError
+from .search import search_records, get_search_terms, SEARCH_TYPES
+from .history import generate_history_lines, import_history, HistoryImportError
+# Seconds a client should wait before retrying when the message job queue is full
+MESSAGE_JOB_RETRY_AFTER = '5'
+
 # =========================================================== CHAT ===========================================================
 
 class ChatList(APIView):
     def get(self, request):
-        chats = Chat.objects.all().order_by('-chat_created_at')
+        chats = Chat.objects.all().order_by('-chat_created_at', '-id')
+        # /api/chats/?pagination=cursor&limit=20 for cursor pagination (follow the 'next' link)
         return get_paginated_records(
-            pagination_class=LimitOffsetPagination,
+            pagination_class=get_pagination_class(request, ChatCursorPagination),
             request=request,
             record_items=chats,
             record_serializer_class=ChatSerializer
         )
     
+    @method_decorator(timed_stage('chat_create'))
     def post(self, request):
         message_text = request.data.get('message_text', '')
-        if not message_text:
+        # A blank message would leave the chat without a (placeholder) name
+        if not isinstance(message_text, str) or not message_text.strip():
             return Response('message_text is missing!', status=status.HTTP_400_BAD_REQUEST)
 
-        llm_response, _, _ = get_llm_response(
-            openai_api_key='*',
-            prompt=f'''\
-            Write a short and descriptive chat title based on the sample message below:
-            "{message_text}"\
-            The title should not me more than fifty characters long.\
-            Return only the title and without any explanations.\
-            '''.strip()
-        )
-
+        # The title is generated in the background, poll the chat until is_title_pending is false
         chat_record = add_record(
-            record_data = {'chat_name': llm_response},
+            record_data = {'chat_name': get_placeholder_chat_name(message_text)},
             record_model = Chat,
             record_serializer= ChatSerializer,
+            additional_fields={'is_title_pending': True},
             get_serialized_record=True
         )
+        if isinstance(chat_record, Response): # Invalid chat
+            return chat_record
         chat_id = chat_record['id']
+        run_in_background(generate_chat_title, chat_id, message_text)
 
         # user_record, llm_record = add_message_record(
         #     user_data=request.data,
@@ -66,9 +81,13 @@ class ChatDetail(generics.RetrieveUpdateDestroyAPIView):
     def update(self, request, pk):
         chat_instance = Chat.objects.get(pk=pk)
         request.data.update({'chat_updated_at': datetime.now()})
+        # A chat renamed by the user shouldn't be overwritten by the generated title
+        if 'chat_name' in request.data:
+            request.data.update({'is_title_pending': False})
         return update_record(
             record_instance = chat_instance,
-            update_data = request.data
+            # Only bumped by the Message signals
+            update_data = {key: value for key, value in request.data.items() if key != 'message_version'}
         )
 
 # =========================================================== MESSAGE ===========================================================
@@ -79,47 +98,119 @@ class MessageList(APIView):
         if not chat_exists:
             return Response('Invalid Chat ID!' ,status=status.HTTP_400_BAD_REQUEST)
         
-        messages = Message.objects.filter(chat_id=chat_id).order_by('-message_created_at')
+        messages = Message.objects.filter(chat_id=chat_id).order_by('-message_created_at', '-id')
 
         # /api/chats/<chat_id>/messages/?limit=2&offset=2 (Limit = no. of messages, Offset = start from)
+        # /api/chats/<chat_id>/messages/?pagination=cursor&limit=2 for cursor pagination (follow the 'next' link)
         return get_paginated_records(
-            pagination_class=LimitOffsetPagination,
+            pagination_class=get_pagination_class(request, MessageCursorPagination),
             request=request,
             record_items=messages,
             record_serializer_class=MessageSerializer
         )
     
+    @method_decorator(timed_stage('message_post'))
     def post(self, request, chat_id):
         chat_exists = record_exists(record_model=Chat, record_id=chat_id)
         if not chat_exists:
             return Response('Invalid Chat ID!' ,status=status.HTTP_400_BAD_REQUEST)
 
         # Get context length from query parameter
-        context_length = self.request.query_params.get('context_length', 20)
-        message_history = MessageSerializer( Message.objects.filter(chat_id=chat_id).order_by('-message_created_at')[:context_length], many=True ).data
-        # Get the list in ascending chronological order
-        message_history.reverse()
-        # Format in chat style message
-        llm_context = 'Use this interaction history between the "User" and the "Assistant" as additional context.\n\n ###\n'
-        for message in message_history:
-            smn = 'User' if message['is_user_message'] else 'Assistant'
-            llm_context += f"{smn}: {message['message_text']}\n"
-        llm_context += '\n###\n\n'
-
-        user_record, llm_record = add_message_record(
+        context_length = self.request.query_params.get('context_length', DEFAULT_CONTEXT_LENGTH)
+
+        # ?async=true answers in the background, poll /api/jobs/<pk>/ for the result
+        if self.request.query_params.get('async', None) == 'true':
+            return self.submit_message_job(request, chat_id, context_length)
+
+        llm_context = get_llm_context(
+            chat_id=chat_id,
+            context_length=context_length,
+            message_model=Message
+        )
+
+        message_records = add_message_record(
             user_data=request.data,
             chat_id=chat_id,
             message_model=Message,
             message_serializer_class=MessageSerializer,
             llm_context=llm_context
         )
+        if isinstance(message_records, Response): # The pipeline or the validation failed
+            return message_records
 
-        # TODO: check both responses and return a single response
+        user_record, llm_record = message_records
         return Response({
             'user_question': user_record,
             'llm_response': llm_record
         }, status=status.HTTP_201_CREATED)
 
+    def submit_message_job(self, request, chat_id, context_length):
+        message_text = request.data.get('message_text', '')
+        if not message_text:
+            return Response('message_text is missing!', status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            context_length = max(int(context_length), 0)
+        except (TypeError, ValueError):
+            context_length = DEFAULT_CONTEXT_LENGTH
+
+        # The first job of this process, fail the ones a stopped process left behind
+        if not message_job_queue.is_started:
+            fail_stale_message_jobs()
+
+        job = MessageJob.objects.create(chat_id_id=chat_id, message_text=message_text, context_length=context_length)
+        try:
+            message_job_queue.submit(run_message_job, job.pk, Message, MessageSerializer)
+        except queue.Full:
+            job.delete()
+            response = Response('Too many questions are waiting to be answered, try again later.',
+                                status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            response['Retry-After'] = MESSAGE_JOB_RETRY_AFTER
+            return response
+
+        return Response(MessageJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+@method_decorator(csrf_exempt, name='dispatch')
+class MessageStream(View):
+    # Served as server-sent events, run under ASGI (biochatter_metta_server.asgi) so the stream doesn't hold a worker
+    async def post(self, request, chat_id):
+        chat_exists = await Chat.objects.filter(pk=chat_id).aexists()
+        if not chat_exists:
+            return HttpResponseBadRequest('Invalid Chat ID!')
+
+        if request.content_type == 'application/json':
+            try:
+                user_data = json.loads(request.body or '{}')
+            except ValueError:
+                return HttpResponseBadRequest('Invalid JSON!')
+            if not isinstance(user_data, dict):
+                return HttpResponseBadRequest('The request body must be a JSON object!')
+        else:
+            user_data = request.POST.dict()
+        if not user_data.get('message_text', ''):
+            return HttpResponseBadRequest('message_text is missing!')
+
+        context_length = request.GET.get('context_length', DEFAULT_CONTEXT_LENGTH)
+        llm_context = await sync_to_async(get_llm_context)(
+            chat_id=chat_id,
+            context_length=context_length,
+            message_model=Message
+        )
+
+        response = StreamingHttpResponse(
+            stream_message_record(
+                user_data=user_data,
+                chat_id=chat_id,
+                message_model=Message,
+                message_serializer_class=MessageSerializer,
+                llm_context=llm_context
+            ),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
 class MessageDetail(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = MessageSerializer
     queryset = Message.objects.all()
@@ -132,6 +223,15 @@ class MessageDetail(generics.RetrieveUpdateDestroyAPIView):
             update_data = request.data
         )
 
+class MessageJobDetail(generics.RetrieveAPIView):
+    serializer_class = MessageJobSerializer
+    queryset = MessageJob.objects.all()
+
+    # A job lost in a restart is reported as failed instead of staying queued or running
+    def get_object(self):
+        fail_stale_message_jobs([self.kwargs['pk']])
+        return super().get_object()
+
 # =========================================================== EXAMPLE ===========================================================
 
 class ExampleList(APIView):
@@ -164,12 +264,102 @@ class ExampleDetail(generics.RetrieveUpdateDestroyAPIView):
             update_data = request.data
         )
 
+# =========================================================== HISTORY ===========================================================
+
+class HistoryExport(APIView):
+    def get(self, request):
+        chat_id = request.query_params.get('chat_id', None)
+        if chat_id is not None and not (chat_id.isdigit() and record_exists(record_model=Chat, record_id=chat_id)):
+            return Response('Invalid Chat ID!', status=status.HTTP_400_BAD_REQUEST)
+
+        # Streamed line by line, the history is never loaded whole
+        response = StreamingHttpResponse(generate_history_lines(chat_id=chat_id), content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="chat_history.ndjson"'
+        return response
+
+class HistoryImport(APIView):
+    @method_decorator(timed_stage('history_import'))
+    def post(self, request):
+        history_file = request.FILES.get('history_file', None)
+        if history_file is None:
+            return Response('\'history_file\' file is required.', status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            import_counts = import_history(history_file)
+        except (HistoryImportError, UnicodeDecodeError) as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(import_counts, status=status.HTTP_201_CREATED)
+
+# =========================================================== SEARCH ===========================================================
+
+class SearchList(APIView):
+    def get(self, request):
+        query = request.query_params.get('q', '')
+        if not get_search_terms(query):
+            return Response('q is missing!', status=status.HTTP_400_BAD_REQUEST)
+
+        search_type = request.query_params.get('type', 'all')
+        if search_type not in SEARCH_TYPES:
+            return Response(f"type must be one of: {', '.join(SEARCH_TYPES)}", status=status.HTTP_400_BAD_REQUEST)
+
+        chat_id = request.query_params.get('chat_id', None)
+        if chat_id is not None:
+            try:
+                chat_id = int(chat_id)
+            except ValueError:
+                return Response('Invalid Chat ID!', status=status.HTTP_400_BAD_REQUEST)
+
+        search_results = search_records(query, Message, Chat, search_type, chat_id)
+        paginator = LimitOffsetPagination()
+        result_page = paginator.paginate_queryset(search_results, request)
+        return paginator.get_paginated_response(result_page)
+
+# =========================================================== METRICS ===========================================================
+
+class MetricsView(APIView):
+    # Prometheus text format, the metrics are per worker process
+    def get(self, request):
+        return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# =========================================================== TRANSLATIONS ===========================================================
+
+class QueryTranslationList(APIView):
+    def get(self, request):
+        translations = QueryTranslation.objects.all().order_by('-translation_created_at', '-id')
+        question = request.query_params.get('question', None)
+        if question:
+            translations = translations.filter(question__icontains=question)
+
+        return get_paginated_records(
+            pagination_class=LimitOffsetPagination,
+            request=request,
+            record_items=translations,
+            record_serializer_class=QueryTranslationSerializer
+        )
+
+    def delete(self, request):
+        translations = QueryTranslation.objects.all()
+        # ?stale=true only purges the translations made for older schemas
+        if request.query_params.get('stale', None) == 'true':
+            schema_file_path = get_schema_file_path()
+            if schema_file_path and os.path.isfile(f'./{schema_file_path}'):
+                translations = translations.exclude(schema_version=get_schema_version(f'./{schema_file_path}'))
+
+        translations.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class QueryTranslationDetail(generics.RetrieveDestroyAPIView):
+    serializer_class = QueryTranslationSerializer
+    queryset = QueryTranslation.objects.all()
+
 # =========================================================== SCHEMA ===========================================================
 
 class SchemaList(APIView):
     # serializer_class = SchemaSerializer
     # queryset = Schema.objects.all()
     # TODO: Adding a new schema should delete all the previous ones (including the Atomspaces)
+    @method_decorator(condition(etag_func=get_schema_etag, last_modified_func=get_schema_last_modified))
     def get(self, request):
         # TODO: get a list of all the nodes & edges in the schema
             # - get the last schema file uploaded
@@ -187,7 +377,7 @@ class SchemaList(APIView):
         # if (schema_file_path is None) or (not os.path.isfile(schema_file_path)):
         #     return Response('Schema not found!', status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        items = get_schema_items(f'./{schema_file_path}')
+        items = get_cached_schema_items(f'./{schema_file_path}')
 
         nodes = []
         for node in items['nodes'].keys():
@@ -196,45 +386,53 @@ class SchemaList(APIView):
         for edge in items['edges'].keys():
             edges.append(edge)
 
-        return Response({
+        response = Response({
             'nodes': nodes,
             'edges': edges
         }, status=status.HTTP_200_OK)
+        # Cacheable, but clients should revalidate with the ETag (304 if the schema didn't change)
+        response['Cache-Control'] = 'no-cache'
+        return response
 
+    @method_decorator(timed_stage('schema_upload'))
     def post(self, request):
-        # Get the old schema path
-        prev_schema_exists = Schema.objects.exists()
-        if prev_schema_exists:
-            prev_schema = Schema.objects.get(schema_name='Schema') or None
-            prev_schema_path = os.path.abspath(prev_schema.schema_file.path) if prev_schema.schema_file else None
-
-        schema, created = Schema.objects.update_or_create(
-            defaults={'schema_file': request.FILES['schema_file']}
-        )
-
-        # Delete the old schema if the old one was updated
-        if not created and prev_schema_exists: # Schema is updated
-            if prev_schema_path and os.path.isfile(prev_schema_path):
-                os.remove(prev_schema_path)
-
-        # Write to schema_mappings
-        serialized_schema = SchemaSerializer(schema).data
-        schema_file_path = serialized_schema.get('schema_file', None)
-        items = get_schema_items(f'./{schema_file_path}')
-
-        with open('api/bio_data/schema_mappings.json', 'w') as f:
-            json.dump(items, f)
-
-        update_schema_mappings()
+        # Concurrent uploads would diff against (and delete) a schema file another upload just replaced
+        with schema_upload_lock():
+            # Get the old schema path
+            prev_schema_exists = Schema.objects.exists()
+            if prev_schema_exists:
+                prev_schema = Schema.objects.get(schema_name='Schema') or None
+                prev_schema_path = os.path.abspath(prev_schema.schema_file.path) if prev_schema.schema_file else None
+            # Diffed against the new schema, so only the affected entities are invalidated
+            prev_schema_items, prev_schema_version = get_current_schema()
+
+            schema, created = Schema.objects.update_or_create(
+                defaults={'schema_file': request.FILES['schema_file']}
+            )
+
+            # Delete the old schema if the old one was updated (unless the new one was stored under the same name)
+            if not created and prev_schema_exists: # Schema is updated
+                if prev_schema_path and os.path.isfile(prev_schema_path) and prev_schema_path != os.path.abspath(schema.schema_file.path):
+                    os.remove(prev_schema_path)
+
+            # Update schema_mappings
+            serialized_schema = SchemaSerializer(schema).data
+            schema_file_path = serialized_schema.get('schema_file', None)
+            # The prompt engine & the answers are keyed by the schema (and mappings) version, no need to reset them
+            schema_changes = update_schema(prev_schema_items, prev_schema_version, schema_file_path)
 
-        return Response(f"Schema {'Uploaded' if created else 'Updated'}!",
-                        status=status.HTTP_201_CREATED)
+        return Response({
+            'detail': f"Schema {'Uploaded' if created else 'Updated'}!",
+            **schema_changes
+        }, status=status.HTTP_201_CREATED)
     
     def delete(self, request):
         if Schema.objects.exists():
             schema = Schema.objects.get(schema_name='Schema')
 
             schema.delete()
+            reset_prompt_engines()
+            clear_answer_cache()
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
@@ -244,21 +442,29 @@ class AtomspaceList(generics.ListCreateAPIView):
     serializer_class = AtomspaceSerializer
     queryset = Atomspace.objects.all()
 
+    @method_decorator(timed_stage('atomspace_upload'))
     def create(self, request):
         db_name = request.data.get('db_name', None)
         if db_name is None: 
             return Response('\'db_name\' filed is required.', status=status.HTTP_400_BAD_REQUEST)
 
-        atomspace, created = Atomspace.objects.update_or_create(
-            db_name=db_name,
-            defaults={
-                'nodes': request.data.get('nodes', None),
-                'edges': request.data.get('edges', None),
-                'node_metta_file': request.FILES.get('node_metta_file', None),
-                'edge_metta_file': request.FILES.get('edge_metta_file', None)
-            }
-        )
+        previous_atomspace_state = get_atomspace_state(db_name)
+        # The files are stored (see store_metta_files) and the record committed under one lock
+        with metta_storage_lock():
+            atomspace, created = Atomspace.objects.update_or_create(
+                db_name=db_name,
+                defaults={
+                    'nodes': request.data.get('nodes', None),
+                    'edges': request.data.get('edges', None),
+                    'node_metta_file': request.FILES.get('node_metta_file', None),
+                    'edge_metta_file': request.FILES.get('edge_metta_file', None)
+                }
+            )
         serialized_atomspace = AtomspaceSerializer(atomspace).data
+        # An identical re-upload (same entities & file contents) is a no-op, the loaded atomspaces and caches are kept
+        if get_atomspace_state(db_name) == previous_atomspace_state:
+            return Response(serialized_atomspace, status=status.HTTP_204_NO_CONTENT)
+
         # serializer = AtomspaceSerializer(data=request.data)
         # if serializer.is_valid():
         #     atomspace_record = Atomspace.objects.create(**serializer.validated_data)
@@ -270,6 +476,8 @@ class AtomspaceList(generics.ListCreateAPIView):
         # atomspace_record = serialized_record.data
 
         update_schema_mappings(atomspace_record=serialized_atomspace)
+        reset_prompt_engines()
+        clear_answer_cache()
 
         # entity_type = atomspace_record['entity_type']
         # entity_names = ast.literal_eval(atomspace_record['entity_name'])
@@ -295,4 +503,113 @@ class AtomspaceDetail(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = AtomspaceSerializer
     queryset = Atomspace.objects.all()
 
+class AtomspaceImport(APIView):
+    @method_decorator(timed_stage('atomspace_import'))
+    def post(self, request):
+        archive = request.FILES.get('archive', None)
+        if archive is None:
+            return Response('\'archive\' file is required.', status=status.HTTP_400_BAD_REQUEST)
+
+        # Large uploads are already on disk, small ones are kept in memory
+        if hasattr(archive, 'temporary_file_path'):
+            archive_path = archive.temporary_file_path()
+        else:
+            with tempfile.NamedTemporaryFile(delete=False) as archive_file:
+                for chunk in archive.chunks():
+                    archive_file.write(chunk)
+            archive_path = archive_file.name
+
+        try:
+            import_report = import_atomspaces(archive_path)
+        except BulkImportError as e:
+            return Response({'detail': str(e), 'files': e.report}, status=status.HTTP_400_BAD_REQUEST)
+        finally:
+            if not hasattr(archive, 'temporary_file_path'):
+                os.remove(archive_path)
+
+        return Response(import_report, status=status.HTTP_201_CREATED)
+
+class AtomspaceUploadList(APIView):
+    def get(self, request):
+        uploads = AtomspaceUpload.objects.all().order_by('-upload_created_at')
+        return get_paginated_records(
+            pagination_class=LimitOffsetPagination,
+            request=request,
+            record_items=uploads,
+            record_serializer_class=AtomspaceUploadSerializer
+        )
+
+    def post(self, request):
+        upload_record = add_record(
+            record_data = request.data.dict() if hasattr(request.data, 'dict') else dict(request.data),
+            record_model = AtomspaceUpload,
+            record_serializer= AtomspaceUploadSerializer,
+            get_serialized_record=True
+        )
+        if isinstance(upload_record, Response): # Invalid upload fields
+            return upload_record
+
+        upload = AtomspaceUpload.objects.get(pk=upload_record['id'])
+        create_upload_part_file(upload)
+        return Response(get_upload_progress(upload), status=status.HTTP_201_CREATED)
+
+class AtomspaceUploadDetail(APIView):
+    def get(self, request, pk):
+        upload = AtomspaceUpload.objects.filter(pk=pk).first()
+        if upload is None:
+            return Response('Upload does not exist!', status=status.HTTP_404_NOT_FOUND)
+        return Response(get_upload_progress(upload), status=status.HTTP_200_OK)
+
+    @method_decorator(timed_stage('atomspace_upload_chunk'))
+    def put(self, request, pk):
+        upload = AtomspaceUpload.objects.filter(pk=pk).first()
+        if upload is None:
+            return Response('Upload does not exist!', status=status.HTTP_404_NOT_FOUND)
+
+        # The offset has to match what was received so far, otherwise the client should resume from received_size
+        upload_offset = request.headers.get('Upload-Offset', request.query_params.get('offset', None))
+        if upload_offset is None or not upload_offset.isdigit() or int(upload_offset) != upload.received_size:
+            return Response(get_upload_progress(upload), status=status.HTTP_409_CONFLICT)
+        # No body, or a body sent without a Content-Length (chunked transfer encoding)
+        if request.stream is None:
+            return Response('The chunk is empty or has no Content-Length!', status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            upload = append_upload_chunk(upload, request.stream, int(upload_offset))
+        except UploadOffsetError:
+            return Response(get_upload_progress(upload), status=status.HTTP_409_CONFLICT)
+        except UploadChunkError as e:
+            return Response({**get_upload_progress(upload), 'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(get_upload_progress(upload), status=status.HTTP_200_OK)
+
+    def delete(self, request, pk):
+        AtomspaceUpload.objects.filter(pk=pk).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class AtomspaceUploadComplete(APIView):
+    def post(self, request, pk):
+        upload = AtomspaceUpload.objects.filter(pk=pk).first()
+        if upload is None:
+            return Response('Upload does not exist!', status=status.HTTP_404_NOT_FOUND)
+
+        if upload.total_size is not None and upload.received_size != upload.total_size:
+            return Response(get_upload_progress(upload), status=status.HTTP_400_BAD_REQUEST)
+
+        previous_atomspace_state = get_atomspace_state(upload.db_name)
+        with timed_stage('atomspace_upload_complete'):
+            atomspace, errors = complete_upload(upload)
+        if errors:
+            return Response({**get_upload_progress(upload), 'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        serialized_atomspace = AtomspaceSerializer(atomspace).data
+        if get_atomspace_state(upload.db_name) == previous_atomspace_state:
+            return Response(serialized_atomspace, status=status.HTTP_201_CREATED)
+
+        update_schema_mappings(atomspace_record=serialized_atomspace)
+        reset_prompt_engines()
+        clear_answer_cache()
+
+        return Response(serialized_atomspace, status=status.HTTP_201_CREATED)
+
     
\ No newline at end of file
@@ -0,0 +1,43 @@
+import time, logging
+from .utils import get_schema_file_path, get_cached_schema_items, use_prompt_engine, get_metta_file_paths
+from .mappings import get_schema_mappings
+from .atomspaces import warm_metta_files
+from .metta_pool import metta_process_pool
+
+logger = logging.getLogger(__name__)
+
+# Load what the first question needs (schema, mappings, prompt engine, atomspaces) ahead of time.
+# Returns the seconds taken by each step
+def warm_up():
+    timings = {}
+
+    def run_step(step, task, *args):
+        start_time = time.perf_counter()
+        result = task(*args)
+        timings[step] = round(time.perf_counter() - start_time, 3)
+        return result
+
+    schema_file_path = get_schema_file_path()
+    if not schema_file_path:
+        logger.info('No schema uploaded yet, nothing to warm up.')
+        return timings
+
+    run_step('schema', get_cached_schema_items, f'./{schema_file_path}')
+    run_step('schema_mappings', get_schema_mappings)
+    # One engine, more are built if questions come in at the same time
+    run_step('prompt_engine', warm_up_prompt_engine, f'./{schema_file_path}')
+
+    # All the mapped files, the partition of the queries that don't name an entity
+    metta_file_paths = get_metta_file_paths()
+    if metta_file_paths:
+        if metta_process_pool.worker_count > 0:
+            run_step('atomspaces', metta_process_pool.warm_up, metta_file_paths)
+        else:
+            run_step('atomspaces', warm_metta_files, metta_file_paths)
+
+    logger.info('Warmed up in %.3fs: %s', sum(timings.values()), timings)
+    return timings
+
+def warm_up_prompt_engine(schema_file_path):
+    with use_prompt_engine(schema_file_path):
+        pass
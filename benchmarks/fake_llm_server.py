@@ -0,0 +1,71 @@
+import re, json, time, random, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from benchmarks.fake_packages.biochatter_metta.fake_llm import get_fake_llm_response
+
+# Local stand-in for the OpenAI chat completions API (POST <base url>/chat/completions), used through
+# LLM_API_BASE_URL. Answers deterministically after the fake LLM latency, `error_rate` of the calls get an
+# `error_status` (a 429 by default).
+# With "stream": true the answer is sent as server-sent events, one word per chunk
+class FakeLLMRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    error_rate = 0.0
+    error_status = 429
+
+    def do_POST(self):
+        request_body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if not self.path.endswith('/chat/completions'):
+            return self.send_json(404, {'error': {'message': 'Not found'}})
+        if random.random() < self.error_rate:
+            return self.send_json(self.error_status, {'error': {'message': 'Rate limited'}}, {'Retry-After': '0'})
+
+        prompt = ''.join(message.get('content', '') for message in request_body.get('messages', []))
+        if request_body.get('stream', False):
+            return self.send_stream(request_body.get('model', 'fake'), get_fake_llm_response(prompt))
+        self.send_json(200, {
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request_body.get('model', 'fake'),
+            'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {
+                'role': 'assistant', 'content': get_fake_llm_response(prompt)
+            }}]
+        })
+
+    def send_json(self, status, payload, headers=None):
+        response_body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response_body)))
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(response_body)
+
+    def send_stream(self, model_name, content):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for token in re.findall(r'\s*\S+\s*', content):
+            self.send_chunk('data: ' + json.dumps({
+                'object': 'chat.completion.chunk',
+                'model': model_name,
+                'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]
+            }) + '\n\n')
+        self.send_chunk('data: [DONE]\n\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def send_chunk(self, data):
+        data = data.encode()
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+
+    def log_message(self, format, *args):
+        pass
+
+# Serves on a free local port in a background thread, returns the base URL
+def start_fake_llm_server(error_rate=0.0, error_status=429):
+    FakeLLMRequestHandler.error_rate = error_rate
+    FakeLLMRequestHandler.error_status = error_status
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeLLMRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='fake-llm-server', daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}/v1'
@@ -0,0 +1,7 @@
+import os, time, hashlib
+
+# Deterministic stand-in for the LLM: waits BENCHMARK_LLM_LATENCY seconds and answers from a hash of the prompt
+def get_fake_llm_response(prompt):
+    time.sleep(float(os.environ.get('BENCHMARK_LLM_LATENCY', '0.05')))
+    prompt_hash = hashlib.sha256(prompt.encode()).hexdigest()
+    return f'Benchmark answer {prompt_hash[:16]}'
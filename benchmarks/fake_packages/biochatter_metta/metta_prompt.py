@@ -0,0 +1,11 @@
+import yaml
+
+def get_schema_items(schema_config_path):
+    with open(schema_config_path, 'r') as schema_file:
+        schema_config = yaml.safe_load(schema_file)
+
+    schema_items = {'nodes': {}, 'edges': {}}
+    for entity_name, entity in schema_config.items():
+        entity_type = 'edges' if entity.get('represented_as', 'node') == 'edge' else 'nodes'
+        schema_items[entity_type][entity_name] = {**entity, 'metta_location': ''}
+    return schema_items
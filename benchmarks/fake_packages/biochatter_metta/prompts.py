@@ -0,0 +1,39 @@
+import json, hashlib
+from .fake_llm import get_fake_llm_response
+from .metta_prompt import get_schema_items
+
+def get_llm_response(openai_api_key=None, prompt='', **kwargs):
+    return get_fake_llm_response(prompt), None, None
+
+# Same interface as biochatter_metta's engine. Like the real one, it reads the schema & mappings when it's built
+# and reads the MeTTa files of the queried entity on every question
+class BioCypherPromptEngine:
+    def __init__(self, model_name, schema_config_or_info_path, schema_mappings, openai_api_key=None):
+        self.schema_items = get_schema_items(schema_config_or_info_path)
+        with open(schema_mappings, 'r') as schema_mappings_file:
+            self.schema_mappings = json.load(schema_mappings_file)
+
+    def get_metta_response(self, user_question, with_llm_response=False, llm_context=''):
+        # "Query generation": one LLM round trip, then pick an entity from the question
+        get_fake_llm_response(user_question)
+        node_names = sorted(self.schema_mappings.get('nodes', {})) or ['gene']
+        question_hash = int(hashlib.sha256(user_question.encode()).hexdigest(), 16)
+        node_name = node_names[question_hash % len(node_names)]
+        input_label = self.schema_mappings.get('nodes', {}).get(node_name, {}).get('input_label', node_name)
+        metta_query = f'!(match &self ({input_label} $x) $x)'
+
+        metta_results = []
+        metta_location = self.schema_mappings.get('nodes', {}).get(node_name, {}).get('metta_location', '')
+        if metta_location:
+            with open(metta_location, 'r') as metta_file:
+                metta_results = [line.split()[1].rstrip(')') for line in metta_file if line.startswith(f'({input_label} ')]
+
+        llm_response = None
+        if with_llm_response:
+            llm_response = get_fake_llm_response(f'{llm_context}{user_question}{metta_results[:10]}')
+
+        return {
+            'metta_query': metta_query,
+            'metta_response': metta_results[:10],
+            'llm_response': llm_response
+        }
@@ -0,0 +1,30 @@
+import re
+
+# Minimal stand-in for hyperon's MeTTa runner: expressions are kept as text and
+# `(match &self (<head> $x) ...)` returns the expressions starting with <head>
+class GroundingSpace:
+    def __init__(self):
+        self.atoms = []
+
+    def add_atom(self, atom):
+        self.atoms.append(atom)
+
+    def remove_atom(self, atom):
+        self.atoms.remove(atom)
+
+class MeTTa:
+    def __init__(self):
+        self._space = GroundingSpace()
+
+    def space(self):
+        return self._space
+
+    def parse_all(self, program):
+        return [line.strip() for line in program.splitlines() if line.strip() and not line.startswith(';')]
+
+    def run(self, program):
+        match = re.search(r'\(match\s+&self\s+\((\S+)', program)
+        if match is None:
+            return [[]]
+        head = f'({match.group(1)} '
+        return [[atom for atom in self._space.atoms if atom.startswith(head)]]
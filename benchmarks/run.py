@@ -0,0 +1,306 @@
+import os, sys, json, time, argparse, resource, threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Offline load test of the API: the LLM & the MeTTa runtime are replaced by the deterministic
+# stand-ins in benchmarks/fake_packages, requests go through Django's test client (no server, no network).
+#
+#   python -m benchmarks.run --requests 200 --concurrency 8 --save-baseline benchmarks/baseline.json
+#   python -m benchmarks.run --requests 200 --concurrency 8 --compare benchmarks/baseline.json
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_PACKAGES_DIR = os.path.join(REPO_DIR, 'benchmarks', 'fake_packages')
+
+SCENARIOS = ['chats', 'messages', 'message_list', 'schema', 'schema_upload', 'atomspaces']
+
+SCHEMA_CONFIG = '''gene:
+  represented_as: node
+  input_label: gene
+transcript:
+  represented_as: node
+  input_label: transcript
+protein:
+  represented_as: node
+  input_label: protein
+transcribed to:
+  represented_as: edge
+  input_label: transcribed_to
+  source: transcript
+  target: gene
+translates to:
+  represented_as: edge
+  input_label: translates_to
+  source: transcript
+  target: protein
+'''
+
+# Alternated with SCHEMA_CONFIG by the schema_upload scenario, so every upload takes the diff path:
+# protein is changed, "translates to" removed and exon added (gene, transcript & "transcribed to" are unchanged)
+SCHEMA_CONFIG_CHANGED = '''gene:
+  represented_as: node
+  input_label: gene
+transcript:
+  represented_as: node
+  input_label: transcript
+protein:
+  represented_as: node
+  input_label: polypeptide
+exon:
+  represented_as: node
+  input_label: exon
+transcribed to:
+  represented_as: edge
+  input_label: transcribed_to
+  source: transcript
+  target: gene
+'''
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Offline load test with stubbed LLM & MeTTa backends.')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f'Comma separated, from: {", ".join(SCENARIOS)}')
+    parser.add_argument('--requests', type=int, default=100, help='Requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=4, help='Concurrent clients')
+    parser.add_argument('--metta-entities', type=int, default=10000, help='Expressions per synthetic MeTTa file')
+    parser.add_argument('--llm-latency', type=float, default=0.05, help='Seconds per fake LLM call')
+    parser.add_argument('--llm-error-rate', type=float, default=0.0, help='Share of the fake LLM API calls answered with a 429')
+    parser.add_argument('--llm-rate-limit', type=float, default=None, help='LLM_RATE_LIMIT (calls per second, default: no limit)')
+    parser.add_argument('--repeated-questions', type=int, default=0,
+                        help='Ask from this many distinct questions (0: every question is new)')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--save-baseline', help='Save the results as the baseline in this JSON file')
+    parser.add_argument('--compare', help='Compare with the baseline in this JSON file, exits with 1 on a regression')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='Allowed p95 latency increase / throughput decrease before failing (0.2 = 20%%)')
+    return parser.parse_args()
+
+def setup_django(args):
+    os.environ['BENCHMARK_LLM_LATENCY'] = str(args.llm_latency)
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'benchmarks.settings'
+    sys.path[:0] = [FAKE_PACKAGES_DIR, REPO_DIR]
+
+    # The API's own LLM calls go through api/llm.py, to a local stand-in server
+    from benchmarks.fake_llm_server import start_fake_llm_server
+    os.environ['LLM_API_BASE_URL'] = start_fake_llm_server(args.llm_error_rate)
+    if args.llm_rate_limit:
+        os.environ['BENCHMARK_LLM_RATE_LIMIT'] = str(args.llm_rate_limit)
+
+    import django
+    from django.conf import settings
+    # The app stores its files relative to the working directory
+    os.chdir(settings.BENCHMARK_DIR)
+    for bio_data_dir in ['biocypher_schema', 'bioatomspace', 'uploads', 'imports']:
+        os.makedirs(os.path.join('api/bio_data', bio_data_dir), exist_ok=True)
+    with open('api/bio_data/schema_mappings.json', 'w') as schema_mappings_file:
+        json.dump({'nodes': {}, 'edges': {}}, schema_mappings_file)
+
+    django.setup()
+    from django.core.management import call_command
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+def write_synthetic_metta(file_path, entity_count, template):
+    with open(file_path, 'w') as metta_file:
+        for index in range(entity_count):
+            metta_file.write(template.format(index=index))
+    return file_path
+
+def get_synthetic_metta_files(entity_count):
+    from django.conf import settings
+    data_dir = os.path.join(settings.BENCHMARK_DIR, 'synthetic')
+    os.makedirs(data_dir, exist_ok=True)
+    return {
+        'node_metta_file': write_synthetic_metta(
+            os.path.join(data_dir, 'nodes.metta'), entity_count,
+            '(gene ENSG{index:011d})\n(transcript ENST{index:011d})\n(protein ENSP{index:011d})\n'
+        ),
+        'edge_metta_file': write_synthetic_metta(
+            os.path.join(data_dir, 'edges.metta'), entity_count,
+            '(transcribed_to (transcript ENST{index:011d}) (gene ENSG{index:011d}))\n'
+            '(translates_to (transcript ENST{index:011d}) (protein ENSP{index:011d}))\n'
+        )
+    }
+
+def upload_schema(client, schema_config=SCHEMA_CONFIG):
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    return client.post('/api/schema/', {'schema_file': SimpleUploadedFile('schema_config.yaml', schema_config.encode())})
+
+def upload_atomspace(client, db_name, metta_files):
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    data = {'db_name': db_name, 'nodes': "['gene', 'transcript', 'protein']", 'edges': "['transcribed to', 'translates to']"}
+    for field_name, file_path in metta_files.items():
+        with open(file_path, 'rb') as metta_file:
+            data[field_name] = SimpleUploadedFile(os.path.basename(file_path), metta_file.read())
+    return client.post('/api/atomspaces/', data)
+
+def get_question(args, index):
+    question_index = index % args.repeated_questions if args.repeated_questions else index
+    return f'Which genes are transcribed from transcript ENST{question_index:011d}?'
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    # Nearest rank
+    rank = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+def run_scenario(name, send_request, request_count, concurrency):
+    from django.test import Client
+    from django.db import connections
+
+    local = threading.local()
+    # {error: count}
+    latencies, errors = [], {}
+    results_lock = threading.Lock()
+
+    def run_request(index):
+        if not hasattr(local, 'client'):
+            local.client = Client()
+        start_time = time.perf_counter()
+        try:
+            response = send_request(local.client, index)
+            error = f'HTTP {response.status_code}' if response.status_code >= 400 else None
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+        latency = time.perf_counter() - start_time
+        with results_lock:
+            latencies.append(latency)
+            if error is not None:
+                errors[error] = errors.get(error, 0) + 1
+
+    def run_worker(indices):
+        try:
+            for index in indices:
+                run_request(index)
+        finally:
+            connections.close_all()
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(run_worker, [range(worker, request_count, concurrency) for worker in range(concurrency)]))
+    duration = time.perf_counter() - start_time
+
+    latencies.sort()
+    to_ms = lambda seconds: round(seconds * 1000, 2) if seconds is not None else None
+    result = {
+        'requests': request_count,
+        'errors': sum(errors.values()),
+        'error_types': errors,
+        'p50_ms': to_ms(percentile(latencies, 0.50)),
+        'p95_ms': to_ms(percentile(latencies, 0.95)),
+        'p99_ms': to_ms(percentile(latencies, 0.99)),
+        'throughput_rps': round(request_count / duration, 2) if duration else None
+    }
+    print(f"{name:>14}: p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, p99 {result['p99_ms']} ms, "
+          f"{result['throughput_rps']} req/s, {result['errors']} errors", flush=True)
+    for error, count in errors.items():
+        print(f'{"":>16}{count} x {error}', flush=True)
+    return result
+
+# ru_maxrss is in kilobytes on Linux (bytes on macOS). RUSAGE_CHILDREN is the largest child that was waited for
+def get_peak_rss_mb(who=resource.RUSAGE_SELF):
+    peak_rss = resource.getrusage(who).ru_maxrss
+    return round(peak_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def run_benchmark(args):
+    from django.test import Client
+
+    scenario_names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown_scenarios = set(scenario_names) - set(SCENARIOS)
+    if unknown_scenarios:
+        sys.exit(f'Unknown scenarios: {", ".join(sorted(unknown_scenarios))}')
+
+    client = Client()
+    metta_files = get_synthetic_metta_files(args.metta_entities)
+    if upload_schema(client).status_code >= 400 or upload_atomspace(client, 'benchmark', metta_files).status_code >= 400:
+        sys.exit('Unable to set up the schema & atomspace!')
+
+    # One chat per client, so the message context grows like in a real conversation
+    chat_ids = []
+    for _ in range(args.concurrency):
+        response = client.post('/api/chats/', {'message_text': get_question(args, 0)}, content_type='application/json')
+        chat_ids.append(response.json()['chat_record']['id'])
+
+    scenario_requests = {
+        'chats': lambda client, index: client.post(
+            '/api/chats/', {'message_text': get_question(args, index)}, content_type='application/json'
+        ),
+        'messages': lambda client, index: client.post(
+            f'/api/chats/{chat_ids[index % len(chat_ids)]}/messages/',
+            {'message_text': get_question(args, index)}, content_type='application/json'
+        ),
+        'message_list': lambda client, index: client.get(f'/api/chats/{chat_ids[index % len(chat_ids)]}/messages/'),
+        'schema': lambda client, index: client.get('/api/schema/'),
+        'schema_upload': lambda client, index: upload_schema(client, SCHEMA_CONFIG_CHANGED if index % 2 == 0 else SCHEMA_CONFIG),
+        'atomspaces': lambda client, index: upload_atomspace(client, f'benchmark-{index}', metta_files)
+    }
+
+    results = {
+        'config': {
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'metta_entities': args.metta_entities,
+            'llm_latency': args.llm_latency,
+            'llm_error_rate': args.llm_error_rate,
+            'llm_rate_limit': args.llm_rate_limit,
+            'repeated_questions': args.repeated_questions
+        },
+        'scenarios': {}
+    }
+    for name in scenario_names:
+        results['scenarios'][name] = run_scenario(name, scenario_requests[name], args.requests, args.concurrency)
+
+    # The MeTTa workers hold the atomspaces, they're stopped (and waited for) to count in RUSAGE_CHILDREN
+    from api.metta_pool import metta_process_pool
+    metta_process_pool.restart()
+    results['peak_rss_self_mb'] = get_peak_rss_mb(resource.RUSAGE_SELF)
+    results['peak_rss_children_mb'] = get_peak_rss_mb(resource.RUSAGE_CHILDREN)
+    results['peak_rss_mb'] = max(results['peak_rss_self_mb'], results['peak_rss_children_mb'])
+    print(f"Peak RSS: {results['peak_rss_mb']} MB (server {results['peak_rss_self_mb']} MB, "
+          f"largest MeTTa worker {results['peak_rss_children_mb']} MB)")
+    return results
+
+# Regressions of the p95 latency & the throughput beyond max_regression, per scenario
+def compare_results(results, baseline, max_regression):
+    if baseline.get('config') != results['config']:
+        print('Warning: the baseline was run with a different configuration, the comparison may be meaningless.')
+
+    regressions = []
+    for name, result in results['scenarios'].items():
+        baseline_result = baseline.get('scenarios', {}).get(name)
+        if baseline_result is None:
+            continue
+        if baseline_result['p95_ms'] and result['p95_ms'] > baseline_result['p95_ms'] * (1 + max_regression):
+            regressions.append(f"{name}: p95 {baseline_result['p95_ms']} ms -> {result['p95_ms']} ms")
+        if baseline_result['throughput_rps'] and result['throughput_rps'] < baseline_result['throughput_rps'] * (1 - max_regression):
+            regressions.append(f"{name}: throughput {baseline_result['throughput_rps']} -> {result['throughput_rps']} req/s")
+        if result['errors'] > baseline_result['errors']:
+            regressions.append(f"{name}: errors {baseline_result['errors']} -> {result['errors']}")
+    return regressions
+
+def write_results(file_path, results):
+    with open(file_path, 'w') as results_file:
+        json.dump(results, results_file, indent=2)
+
+def main():
+    args = parse_args()
+    # Paths given on the command line are relative to where the benchmark was started
+    for path_arg in ['output', 'save_baseline', 'compare']:
+        if getattr(args, path_arg):
+            setattr(args, path_arg, os.path.abspath(getattr(args, path_arg)))
+
+    setup_django(args)
+    results = run_benchmark(args)
+
+    if args.output:
+        write_results(args.output, results)
+    if args.save_baseline:
+        write_results(args.save_baseline, results)
+        print(f'Baseline saved to {args.save_baseline}')
+    if args.compare:
+        with open(args.compare, 'r') as baseline_file:
+            regressions = compare_results(results, json.load(baseline_file), args.max_regression)
+        if regressions:
+            print('Regressions:\n  ' + '\n  '.join(regressions))
+            sys.exit(1)
+        print('No regressions.')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+import os, tempfile
+from biochatter_metta_server.settings import *
+
+# Everything the benchmark writes (database, schema, MeTTa files) goes to a throwaway directory
+BENCHMARK_DIR = os.environ.get('BENCHMARK_DIR') or tempfile.mkdtemp(prefix='biochatter-metta-benchmark-')
+
+DEBUG = False
+ALLOWED_HOSTS = ['*']
+
+DATABASES = {
+    'default': {
+        **DATABASES['default'],
+        'NAME': os.path.join(BENCHMARK_DIR, 'db.sqlite3'),
+    }
+}
+
+# The tables are created straight from the models (migrate --run-syncdb), the migrations aren't needed
+MIGRATION_MODULES = {'api': None}
+
+# The stand-in LLM server isn't rate limited, only limit the client when asked to
+LLM_RATE_LIMIT = float(os.environ['BENCHMARK_LLM_RATE_LIMIT']) if os.environ.get('BENCHMARK_LLM_RATE_LIMIT') else None
@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'biochatter_metta_server.settings')
 
 application = get_asgi_application()
+
+# API_WARM_UP=1 loads the schema, prompt engine & atomspaces before the first request
+# (instead of on it), see api/warmup.py
+if os.environ.get('API_WARM_UP', '') == '1':
+    from api.warmup import warm_up
+    warm_up()
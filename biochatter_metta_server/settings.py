@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
 from pathlib import Path
+import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -85,8 +86,41 @@ WSGI_APPLICATION = 'biochatter_metta_server.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # Django's SQLite backend + pragmas & immediate transactions (biochatter_metta_server/sqlite3)
+        'ENGINE': 'biochatter_metta_server.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Seconds a connection is kept open between requests (0 closes it after each request)
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+# Applied to each new SQLite connection. WAL lets the readers run alongside a writer,
+# synchronous=NORMAL is still safe with WAL and skips an fsync per commit,
+# busy_timeout (ms) waits for the lock of another writer instead of failing with "database is locked"
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Answers to repeated questions (least recently used are evicted first).
+    # Per process by default, use e.g. FileBasedCache to share the answers between the workers of a host
+    'answers': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'answers',
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000
+        }
     }
 }
 
@@ -127,6 +161,12 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Uploaded files are hashed while they're received (MeTTa files are stored by content hash, see api/metta_storage.py)
+FILE_UPLOAD_HANDLERS = [
+    'api.upload_handlers.ContentHashMemoryFileUploadHandler',
+    'api.upload_handlers.ContentHashTemporaryFileUploadHandler',
+]
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -141,4 +181,48 @@ REST_FRAMEWORK = {
     # ]
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
     'PAGE_SIZE': 200  # Set the default page size
-}
\ No newline at end of file
+}
+
+# Threads used for work done outside the request (e.g. generating chat titles)
+BACKGROUND_TASK_WORKERS = 4
+
+# Questions answered in the background (POST /api/chats/<chat_id>/messages/?async=true).
+# Submitting fails with 503 once MESSAGE_JOB_QUEUE_DEPTH questions are waiting
+MESSAGE_JOB_WORKERS = 4
+MESSAGE_JOB_QUEUE_DEPTH = 100
+# Seconds after which a job that is still queued or running is failed (left behind by a restart)
+MESSAGE_JOB_TIMEOUT = 600
+
+# Prompt engines kept per process, each one answers one question at a time
+PROMPT_ENGINE_POOL_SIZE = 4
+
+# MeTTa queries run in worker processes that keep the atomspace partitions they use loaded
+# (0 runs them in the request thread). Each worker holds its own copy in memory
+METTA_POOL_WORKERS = 2
+# Seconds before a query is stopped (its worker is killed & replaced)
+METTA_QUERY_TIMEOUT = 30
+# Workers are replaced once their memory grows past this
+METTA_WORKER_MAX_MEMORY_MB = 2048
+# Query results included in the answer prompt & the response
+METTA_ANSWER_RESULT_LIMIT = 10
+
+# LLM API (OpenAI compatible), shared by all the requests of a process. Point LLM_API_BASE_URL
+# to a local stand-in server to test without the real API
+LLM_API_BASE_URL = os.environ.get('LLM_API_BASE_URL', 'https://api.openai.com/v1')
+LLM_MODEL_NAME = 'gpt-3.5-turbo'
+# LLM calls running at once (also the number of keep-alive connections kept)
+LLM_MAX_CONCURRENCY = 8
+# Calls per second, with bursts of up to LLM_RATE_BURST calls (None disables the rate limit)
+LLM_RATE_LIMIT = 5
+LLM_RATE_BURST = 10
+# Retries of rate limited (429), server errors and connection failures, with jittered exponential backoff
+LLM_MAX_RETRIES = 3
+# Seconds
+LLM_TIMEOUT = 60
+
+# Conversation history sent to the LLM with each question
+LLM_CONTEXT_TOKEN_BUDGET = 2000
+# Keep a short summary of the turns that no longer fit in the budget
+LLM_CONTEXT_SUMMARIES = False
+# Chats whose context is kept in memory (per process)
+LLM_CONTEXT_CACHED_CHATS = 1000
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.db.backends.sqlite3 import base
+
+# Django's SQLite backend tuned for concurrent requests (Django 5.1+ covers both with the
+# 'init_command' & 'transaction_mode' OPTIONS)
+class DatabaseWrapper(base.DatabaseWrapper):
+    # Apply settings.SQLITE_PRAGMAS (WAL, busy_timeout...) to each new connection
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            connection.execute(f'PRAGMA {pragma} = {value}')
+        return connection
+
+    # A deferred transaction that reads before writing (e.g. update_or_create) fails right away with
+    # "database is locked" when another connection wrote in the meantime. An immediate one takes
+    # the write lock up front, waiting up to busy_timeout for it
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')